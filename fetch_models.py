@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+按清单 (models.json) 并行下载模型文件，Dockerfile 构建与 download_models.sh 共用
+
+- 多个文件同时下载，受全局并发数 (--jobs) 与总带宽 (--limit) 限制
+- 下载写入 <文件>.part，中断后从已下载的位置继续 (HTTP Range)
+- 边下载边计算 sha256，下载完成后不再重新读取文件
+- 清单中没有 size/sha256 时使用 Hugging Face 返回的 x-linked-size / x-linked-etag
+  (LFS 文件的 sha256)；两者都没有时只校验大小，绝不编造哈希
+- 已存在且有效的文件直接跳过 (校验结果记录在 <文件>.verified 中，之后无需再读文件)
+
+使用方法:
+   python3 fetch_models.py --target /comfyui/models
+   python3 fetch_models.py --manifest models.json --target comfyui-models --jobs 4 --limit 50
+
+环境变量:
+  HF_TOKEN: Hugging Face 访问令牌 (私有仓库需要)
+  HTTPS_PROXY / HTTP_PROXY: 代理 (也可用 --proxy 指定)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+CHUNK = 1024 * 1024
+USER_AGENT = "worker-comfyui-fetch/1.0"
+
+_log_lock = threading.Lock()
+
+
+def log(message: str) -> None:
+    with _log_lock:
+        print(f"fetch-models - {message}", flush=True)
+
+
+class RateLimiter:
+    """所有下载线程共享的令牌桶，bytes_per_second 为 0 时不限速"""
+
+    def __init__(self, bytes_per_second: float):
+        self.rate = bytes_per_second
+        self.allowance = bytes_per_second
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> None:
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= nbytes
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def _request(url: str, method: str = "GET", headers: Optional[Dict[str, str]] = None) -> urllib.request.Request:
+    headers = dict(headers or {})
+    headers.setdefault("User-Agent", USER_AGENT)
+    token = os.environ.get("HF_TOKEN")
+    if token and "huggingface.co" in url:
+        headers["Authorization"] = f"Bearer {token}"
+    return urllib.request.Request(url, method=method, headers=headers)
+
+
+def _proxy_handler(proxy: str) -> urllib.request.ProxyHandler:
+    """--proxy 指定的代理；未指定时沿用 HTTPS_PROXY / HTTP_PROXY 环境变量"""
+    return urllib.request.ProxyHandler({"http": proxy, "https": proxy} if proxy else None)
+
+
+def remote_metadata(url: str, timeout: int, proxy: str = "") -> Tuple[Optional[int], Optional[str]]:
+    """
+    从 Hugging Face 的 resolve 响应中读取文件大小和 sha256
+
+    resolve 地址返回 302，x-linked-size / x-linked-etag 在这一跳的响应头中，所以不跟随跳转。
+
+    Returns:
+        (大小, sha256)；无法获得的值为 None
+    """
+    opener = urllib.request.build_opener(_proxy_handler(proxy), _NoRedirect)
+    try:
+        response = opener.open(_request(url, "HEAD"), timeout=timeout)
+        headers, redirected = response.headers, False
+    except urllib.error.HTTPError as e:
+        headers, redirected = e.headers, True
+    except (urllib.error.URLError, OSError) as e:
+        log(f"HEAD {url} failed: {e}")
+        return None, None
+
+    etag = (headers.get("x-linked-etag") or "").strip('"').lower()
+    sha256 = etag if len(etag) == 64 and all(c in "0123456789abcdef" for c in etag) else None
+    # 跳转响应的 Content-Length 是跳转页面本身的长度
+    size = headers.get("x-linked-size") or (None if redirected else headers.get("content-length"))
+    return (int(size) if size and size.isdigit() else None), sha256
+
+
+def _marker_path(path: str) -> str:
+    return path + ".verified"
+
+
+def _read_marker(path: str) -> Optional[Dict]:
+    try:
+        with open(_marker_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_marker(path: str, size: int, sha256: Optional[str]) -> None:
+    st = os.stat(path)
+    with open(_marker_path(path), "w", encoding="utf-8") as f:
+        json.dump({"size": size, "sha256": sha256, "mtime": st.st_mtime}, f)
+
+
+def _hash_file(path: str, hasher, limit: Optional[int] = None) -> int:
+    done = 0
+    with open(path, "rb") as f:
+        while limit is None or done < limit:
+            chunk = f.read(CHUNK if limit is None else min(CHUNK, limit - done))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            done += len(chunk)
+    return done
+
+
+def is_valid(path: str, size: Optional[int], sha256: Optional[str]) -> bool:
+    """
+    检查已存在的文件是否有效
+
+    有 .verified 记录且大小、mtime、哈希一致时不读取文件；否则 (例如旧脚本下载的文件)
+    计算一次哈希并写入记录。
+    """
+    if not os.path.isfile(path):
+        return False
+    st = os.stat(path)
+    if size is not None and st.st_size != size:
+        return False
+    marker = _read_marker(path)
+    if marker and marker.get("size") == st.st_size and marker.get("mtime") == st.st_mtime:
+        if sha256 is None or marker.get("sha256") == sha256:
+            return True
+    if sha256 is None:
+        if size is None:
+            return False
+        _write_marker(path, size, None)
+        return True
+    hasher = hashlib.sha256()
+    _hash_file(path, hasher)
+    if hasher.hexdigest() != sha256:
+        return False
+    _write_marker(path, st.st_size, sha256)
+    return True
+
+
+def download(entry: Dict, target: str, limiter: RateLimiter, args) -> Tuple[str, str]:
+    """
+    下载一个清单条目
+
+    Returns:
+        (状态 "skip"/"done"/"fail", 说明)
+    """
+    path = os.path.join(target, entry["path"])
+    url = entry["url"]
+    size, sha256 = entry.get("size"), entry.get("sha256")
+    if size is None or sha256 is None:
+        remote_size, remote_sha = remote_metadata(url, args.timeout, args.proxy)
+        size = size if size is not None else remote_size
+        sha256 = sha256 if sha256 is not None else remote_sha
+    sha256 = sha256.lower() if sha256 else None
+    if sha256 is None:
+        checked = "only its size will be checked" if size is not None else "neither size nor content will be checked"
+        log(f"WARNING: {entry['path']}: no sha256 in the manifest or from the server, {checked}")
+
+    if is_valid(path, size, sha256):
+        return "skip", entry["path"]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = path + ".part"
+    error = "unknown error"
+    for attempt in range(1, args.retries + 1):
+        hasher = hashlib.sha256()
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if size is not None and offset > size:
+            os.remove(part)
+            offset = 0
+        if offset:
+            # 续传: 已下载的部分只需在本地读取一次以恢复哈希状态
+            _hash_file(part, hasher, offset)
+        try:
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            with urllib.request.urlopen(_request(url, headers=headers), timeout=args.timeout) as response:
+                if offset and response.status != 206:
+                    log(f"{entry['path']}: server ignored range request, restarting")
+                    hasher, offset = hashlib.sha256(), 0
+                mode = "ab" if offset else "wb"
+                with open(part, mode) as out:
+                    while True:
+                        chunk = response.read(CHUNK)
+                        if not chunk:
+                            break
+                        limiter.consume(len(chunk))
+                        out.write(chunk)
+                        hasher.update(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and size is not None and offset == size:
+                pass  # .part 已完整
+            else:
+                error = f"HTTP {e.code}"
+                log(f"{entry['path']}: {error} (attempt {attempt}/{args.retries})")
+                time.sleep(args.retry_wait)
+                continue
+        except (urllib.error.URLError, OSError) as e:
+            error = str(e)
+            log(f"{entry['path']}: {error} (attempt {attempt}/{args.retries}), resuming")
+            time.sleep(args.retry_wait)
+            continue
+
+        actual = os.path.getsize(part)
+        if size is not None and actual != size:
+            error = f"size {actual} != {size}"
+            log(f"{entry['path']}: {error} (attempt {attempt}/{args.retries})")
+            if actual > size:
+                os.remove(part)
+            continue
+        digest = hasher.hexdigest()
+        if sha256 and digest != sha256:
+            error = f"sha256 mismatch ({digest[:12]} != {sha256[:12]})"
+            log(f"{entry['path']}: {error}, discarding")
+            os.remove(part)
+            continue
+        os.replace(part, path)
+        _write_marker(path, actual, digest)
+        return "done", f"{entry['path']} ({actual / 1024 ** 2:.1f} MB, {'sha256 ok' if sha256 else 'size only'})"
+    return "fail", f"{entry['path']}: {error}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download model weights listed in a manifest")
+    parser.add_argument("--manifest", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "models.json"))
+    parser.add_argument("--target", required=True, help="models directory (e.g. /comfyui/models)")
+    parser.add_argument("--jobs", type=int, default=4, help="files downloaded concurrently (global connection budget)")
+    parser.add_argument("--limit", type=float, default=0, help="total bandwidth limit in MB/s (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=10)
+    parser.add_argument("--retry-wait", type=float, default=5)
+    parser.add_argument("--timeout", type=int, default=600)
+    parser.add_argument("--proxy", default="", help="HTTP(S) proxy URL")
+    args = parser.parse_args()
+
+    if args.proxy:
+        urllib.request.install_opener(urllib.request.build_opener(_proxy_handler(args.proxy)))
+
+    with open(args.manifest, "r", encoding="utf-8") as f:
+        files = json.load(f)["files"]
+
+    start = time.time()
+    limiter = RateLimiter(args.limit * 1024 * 1024)
+    log(f"Fetching {len(files)} files into {args.target} ({args.jobs} concurrent)")
+    failed, unverified = [], []
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs), thread_name_prefix="fetch") as pool:
+        for status, message in pool.map(lambda e: download(e, args.target, limiter, args), files):
+            log(f"[{status.upper()}] {message}")
+            if status == "fail":
+                failed.append(message)
+            elif status == "done" and message.endswith("size only)"):
+                unverified.append(message)
+
+    log(f"Finished in {time.time() - start:.0f}s, {len(failed)} failed")
+    if unverified:
+        log(f"WARNING: {len(unverified)} file(s) downloaded without a sha256 check")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Triton / TorchInductor 编译缓存的持久化工具
+
+TRITON_CACHE_DIR 与 TORCHINDUCTOR_CACHE_DIR 位于容器的临时磁盘上，新 worker 每次都要
+重新编译 sageattention 等 kernel。本脚本把两个缓存同步到网络卷上：
+
+1. 启动时恢复 (在 /start_original.sh 之前执行):
+   python3 /kernel_cache.py restore
+
+2. 每个任务结束后发布新编译的条目 (由 handler 在后台调用):
+   python3 /kernel_cache.py publish
+
+3. 构建镜像时预置缓存 (目录、tar 包或 tar 包 URL，内含 triton/ 与 inductor/ 子目录):
+   python3 /kernel_cache.py seed /tmp/kernel-cache.tar.gz
+
+每个文件先写入同目录下的临时文件再 os.replace，所以并发的 worker 之间不会读到半个文件；
+Triton 的 __grp__*.json 清单总是在同目录其他文件之后写入。
+
+环境变量:
+  TRITON_CACHE_DIR: 本地 Triton 缓存目录 (默认 /opt/triton-cache)
+  TORCHINDUCTOR_CACHE_DIR: 本地 Inductor 缓存目录 (默认 /opt/inductor-cache)
+  KERNEL_CACHE_VOLUME_DIR: 网络卷上的缓存目录 (默认 /runpod-volume/kernel-cache)
+  KERNEL_CACHE_STATS: 统计信息输出文件 (默认 /tmp/kernel-cache-stats.json)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import urllib.request
+from typing import Dict, Iterator, Tuple
+
+VOLUME_DIR = os.environ.get("KERNEL_CACHE_VOLUME_DIR", "/runpod-volume/kernel-cache")
+STATS_PATH = os.environ.get("KERNEL_CACHE_STATS", "/tmp/kernel-cache-stats.json")
+CACHES = {
+    "triton": os.environ.get("TRITON_CACHE_DIR", "/opt/triton-cache"),
+    "inductor": os.environ.get("TORCHINDUCTOR_CACHE_DIR", "/opt/inductor-cache"),
+}
+
+# 编译器自身的临时文件和锁不参与同步
+SKIP_DIRS = {"locks", "__pycache__"}
+TMP_PREFIX = ".kc-tmp-"
+
+
+def _is_transient(name: str) -> bool:
+    return name.startswith(TMP_PREFIX) or name.startswith("tmp.") or name.endswith((".tmp", ".lock"))
+
+
+def iter_entries(root: str) -> Iterator[Tuple[str, str]]:
+    """
+    遍历缓存目录中的文件
+
+    Args:
+        root: 缓存根目录
+
+    Yields:
+        (相对路径, 绝对路径)；同一目录中 __grp__ 清单排在最后
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        names = sorted(
+            (n for n in filenames if not _is_transient(n)),
+            key=lambda n: (n.startswith("__grp__"), n),
+        )
+        for name in names:
+            path = os.path.join(dirpath, name)
+            yield os.path.relpath(path, root), path
+
+
+def cache_size(root: str) -> Dict[str, int]:
+    """统计缓存目录的文件数与字节数"""
+    files = size = 0
+    for _, path in iter_entries(root):
+        try:
+            size += os.path.getsize(path)
+            files += 1
+        except OSError:
+            pass
+    return {"files": files, "bytes": size}
+
+
+def atomic_copy(src: str, dst: str) -> None:
+    """
+    复制文件，先写入目标目录中的临时文件再原子替换
+
+    Args:
+        src: 源文件
+        dst: 目标文件
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=TMP_PREFIX, dir=os.path.dirname(dst))
+    try:
+        with os.fdopen(fd, "wb") as out, open(src, "rb") as f:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def sync_missing(src_root: str, dst_root: str) -> Dict[str, int]:
+    """
+    把 src_root 中有而 dst_root 中没有的文件复制过去
+
+    已存在的文件不会被覆盖：缓存条目按内容哈希命名，同名即同内容。
+
+    Args:
+        src_root: 源缓存目录
+        dst_root: 目标缓存目录
+
+    Returns:
+        {"copied": 文件数, "bytes": 字节数, "errors": 失败数}
+    """
+    copied = copied_bytes = errors = 0
+    if not os.path.isdir(src_root):
+        return {"copied": 0, "bytes": 0, "errors": 0}
+    for rel, path in iter_entries(src_root):
+        dst = os.path.join(dst_root, rel)
+        if os.path.exists(dst):
+            continue
+        try:
+            atomic_copy(path, dst)
+            copied += 1
+            copied_bytes += os.path.getsize(dst)
+        except OSError as e:
+            errors += 1
+            print(f"kernel-cache - Failed to copy {rel}: {e}", file=sys.stderr)
+    return {"copied": copied, "bytes": copied_bytes, "errors": errors}
+
+
+def _write_stats(action: str, stats: Dict) -> None:
+    try:
+        with open(STATS_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data[action] = stats
+    tmp = f"{STATS_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, STATS_PATH)
+
+
+def _run(action: str, pairs) -> Dict:
+    start = time.time()
+    stats = {"time": start}
+    for name, src, dst in pairs:
+        result = sync_missing(src, dst)
+        result["local"] = cache_size(CACHES[name])
+        stats[name] = result
+        print(
+            f"kernel-cache - {action} {name}: {result['copied']} entries "
+            f"({result['bytes'] / 1024 / 1024:.1f} MB), {result['errors']} errors; "
+            f"local cache {result['local']['files']} files, {result['local']['bytes'] / 1024 / 1024:.1f} MB"
+        )
+    stats["seconds"] = round(time.time() - start, 3)
+    _write_stats(action, stats)
+    return stats
+
+
+def restore() -> Dict:
+    """从网络卷恢复缓存到本地目录"""
+    if not os.path.isdir(VOLUME_DIR):
+        print(f"kernel-cache - No volume cache at {VOLUME_DIR}, skipping restore")
+        _write_stats("restore", {"time": time.time(), "skipped": "no volume cache"})
+        return {}
+    return _run("restore", [(n, os.path.join(VOLUME_DIR, n), d) for n, d in CACHES.items()])
+
+
+def publish() -> Dict:
+    """把本地新编译的缓存条目发布到网络卷"""
+    if not os.path.isdir(os.path.dirname(VOLUME_DIR.rstrip("/")) or "/"):
+        print(f"kernel-cache - Volume for {VOLUME_DIR} is not mounted, skipping publish")
+        return {}
+    return _run("publish", [(n, d, os.path.join(VOLUME_DIR, n)) for n, d in CACHES.items()])
+
+
+def _extract_seed(archive: str, root: str) -> None:
+    """解压种子 tar 包；拒绝绝对路径、越出 root 的路径、越界链接与设备文件"""
+    with tarfile.open(archive) as tar:
+        if hasattr(tarfile, "data_filter"):
+            try:
+                tar.extractall(root, filter="data")
+            except tarfile.FilterError as e:
+                raise SystemExit(f"kernel-cache - Unsafe member in seed archive: {e}")
+            return
+        # Python < 3.12 (及未回移 data filter 的补丁版本) 手动检查成员路径
+        base = os.path.realpath(root)
+        for member in tar.getmembers():
+            target = os.path.realpath(os.path.join(base, member.name))
+            if os.path.isabs(member.name) or os.path.commonpath([base, target]) != base:
+                raise SystemExit(f"kernel-cache - Unsafe path in seed archive: {member.name}")
+            if member.issym() or member.islnk():
+                link_base = os.path.dirname(target) if member.issym() else base
+                link = os.path.realpath(os.path.join(link_base, member.linkname))
+                if os.path.isabs(member.linkname) or os.path.commonpath([base, link]) != base:
+                    raise SystemExit(f"kernel-cache - Unsafe link in seed archive: {member.name} -> {member.linkname}")
+            elif not (member.isfile() or member.isdir()):
+                raise SystemExit(f"kernel-cache - Unsupported member in seed archive: {member.name}")
+        tar.extractall(root)
+
+
+def seed(source: str) -> Dict:
+    """
+    构建镜像时预置缓存
+
+    Args:
+        source: 含 triton/ 与 inductor/ 子目录的目录、tar 包路径或 tar 包 URL
+    """
+    with tempfile.TemporaryDirectory() as work:
+        if source.startswith(("http://", "https://")):
+            archive = os.path.join(work, "seed.tar")
+            print(f"kernel-cache - Downloading seed from {source}")
+            urllib.request.urlretrieve(source, archive)
+            source = archive
+        if os.path.isfile(source):
+            root = os.path.join(work, "seed")
+            _extract_seed(source, root)
+            source = root
+        if not os.path.isdir(source):
+            raise SystemExit(f"kernel-cache - Seed source not found: {source}")
+        return _run("seed", [(n, os.path.join(source, n), d) for n, d in CACHES.items()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persist Triton/Inductor kernel caches on the network volume")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("restore", help="copy cached kernels from the volume into the local cache dirs")
+    sub.add_parser("publish", help="copy newly compiled kernels to the volume")
+    seed_parser = sub.add_parser("seed", help="pre-populate the local cache dirs at image build time")
+    seed_parser.add_argument("source", help="directory, tarball or tarball URL with triton/ and inductor/")
+    args = parser.parse_args()
+
+    if args.action == "restore":
+        restore()
+    elif args.action == "publish":
+        publish()
+    else:
+        seed(args.source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+解析 runpod cached models 的快照并生成模型链接清单
+
+启动时把 /comfyui/models/* 链接到 /runpod-volume/huggingface-cache/hub 中的模型快照：
+
+1. 建立索引: 列出所有 models--* 仓库及其快照，快照版本以 refs/main 为准
+   (没有 refs/main 时取最新的快照)；设置 MODEL_REPO 时只使用该仓库，否则选择
+   能解析最多 workflow 模型的仓库
+2. 解析 workflow 中引用的每个模型文件 (wan/ 子目录下的 LoRA、SeC-4B-fp16 与
+   Sec-4B-fp16 的大小写差异、clip_vision 回退到 clip 等) 到快照中的具体文件
+3. 结果写入清单 (MODEL_MANIFEST)；之后的启动只校验清单中的 refs/main 和每个文件的大小，
+   不再扫描目录，链接已正确时不做任何修改
+
+使用方法:
+   python3 /model_manifest.py            # 校验清单，失效时重建，然后创建链接
+   python3 /model_manifest.py --rebuild  # 强制重建清单
+
+环境变量:
+  MODEL_CACHE_HUB: HuggingFace 缓存目录 (默认 /runpod-volume/huggingface-cache/hub)
+  MODEL_REPO: 指定仓库 (例如 zzl1183635474/v2v)
+  MODEL_MANIFEST: 清单路径 (默认 /runpod-volume/model-manifest.json)
+  MODEL_WORKFLOW: 提供模型文件名的 workflow (默认 /warmup_workflow.json)
+  COMFY_MODELS_DIR: ComfyUI 模型目录 (默认 /comfyui/models)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+CACHE_HUB = os.environ.get("MODEL_CACHE_HUB", "/runpod-volume/huggingface-cache/hub")
+MODEL_REPO = os.environ.get("MODEL_REPO", "")
+MANIFEST_PATH = os.environ.get("MODEL_MANIFEST", "/runpod-volume/model-manifest.json")
+WORKFLOW_PATH = os.environ.get("MODEL_WORKFLOW", "/warmup_workflow.json")
+COMFY_MODELS = os.environ.get("COMFY_MODELS_DIR", "/comfyui/models")
+
+MANIFEST_VERSION = 1
+MODEL_EXTENSIONS = (".safetensors", ".sft", ".ckpt", ".pt", ".pth", ".bin", ".onnx", ".gguf")
+
+# 链接到 ComfyUI 的模型目录
+MODEL_DIRS = [
+    "vae", "loras", "diffusion_models", "sams", "detection",
+    "clip", "clip_vision", "text_encoders", "ultralytics",
+]
+# 快照中没有某个目录时使用的替代目录
+DIR_FALLBACKS = {"clip_vision": ["clip"], "diffusion_models": ["unet"], "text_encoders": ["clip"]}
+# 加载节点读取的模型目录 (按 ComfyUI 的搜索顺序)
+LOADER_DIRS = {
+    "WanVideoVAELoader": ["vae"],
+    "WanVideoLoraSelectMulti": ["loras"],
+    "WanVideoModelLoader": ["diffusion_models"],
+    "SeCModelLoader": ["sams"],
+    "OnnxDetectionModelLoader": ["detection"],
+    "CLIPVisionLoader": ["clip_vision"],
+    "CLIPLoader": ["text_encoders", "clip"],
+}
+
+
+def log(message: str) -> None:
+    print(f"model-manifest - {message}", flush=True)
+
+
+# ----------------------------------------------------------------------------
+# 仓库与快照索引
+# ----------------------------------------------------------------------------
+
+def repo_dir_name(repo: str) -> str:
+    """"owner/name" -> "models--owner--name\""""
+    return "models--" + repo.replace("/", "--")
+
+
+def resolve_snapshot(repo_path: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    确定仓库应使用的快照
+
+    Args:
+        repo_path: models--* 目录
+
+    Returns:
+        (快照哈希, 来源 "refs/main" 或 "newest")；没有快照时为 (None, None)
+    """
+    ref = read_ref(repo_path)
+    if ref and os.path.isdir(os.path.join(repo_path, "snapshots", ref)):
+        return ref, "refs/main"
+    snapshots_dir = os.path.join(repo_path, "snapshots")
+    try:
+        snapshots = [s for s in os.listdir(snapshots_dir) if os.path.isdir(os.path.join(snapshots_dir, s))]
+    except OSError:
+        return None, None
+    if not snapshots:
+        return None, None
+    if ref:
+        log(f"refs/main of {os.path.basename(repo_path)} points to missing snapshot {ref}")
+    newest = max(snapshots, key=lambda s: os.path.getmtime(os.path.join(snapshots_dir, s)))
+    return newest, "newest"
+
+
+def read_ref(repo_path: str, ref: str = "main") -> Optional[str]:
+    try:
+        with open(os.path.join(repo_path, "refs", ref), "r") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def index_snapshot(snapshot_path: str) -> Dict[str, int]:
+    """
+    列出快照中的所有文件 (快照中的文件是指向 blobs 的符号链接)
+
+    Returns:
+        {相对路径: 大小}
+    """
+    files = {}
+    for dirpath, _, filenames in os.walk(snapshot_path, followlinks=True):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                files[os.path.relpath(path, snapshot_path).replace(os.sep, "/")] = os.stat(path).st_size
+            except OSError:
+                pass
+    return files
+
+
+# ----------------------------------------------------------------------------
+# workflow 模型解析
+# ----------------------------------------------------------------------------
+
+def workflow_models(path: str) -> List[Tuple[str, str]]:
+    """
+    列出 workflow 引用的模型
+
+    Returns:
+        [(加载节点类型, 模型文件名)]，按出现顺序去重
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            workflow = json.load(f)
+    except (OSError, ValueError) as e:
+        log(f"No workflow model list ({path}: {e})")
+        return []
+    workflow = workflow.get("input", {}).get("workflow", workflow)
+    models = []
+    for node in workflow.values():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, str) and value.endswith(MODEL_EXTENSIONS):
+                entry = (node.get("class_type", ""), value)
+                if entry not in models:
+                    models.append(entry)
+    return models
+
+
+def dir_source(files: Dict[str, int], category: str) -> Optional[str]:
+    """快照中为 ComfyUI 目录 category 提供文件的目录 (自身或回退目录)"""
+    prefixes = {rel.split("/", 1)[0] for rel in files if "/" in rel}
+    for candidate in [category] + DIR_FALLBACKS.get(category, []):
+        if candidate in prefixes:
+            return candidate
+    return None
+
+
+def resolve_model(files: Dict[str, int], class_type: str, name: str) -> Tuple[Optional[str], Optional[str], bool]:
+    """
+    把 workflow 中的模型文件名解析到快照中的具体文件
+
+    Returns:
+        (ComfyUI 目录, 快照中的相对路径, 是否需要别名链接)；找不到时路径为 None
+    """
+    name = name.replace("\\", "/")
+    categories = LOADER_DIRS.get(class_type) or MODEL_DIRS
+    for category in categories:
+        source = dir_source(files, category)
+        if source and f"{source}/{name}" in files:
+            return category, f"{source}/{name}", False
+
+    # 大小写不同、缺少 wan/ 前缀或放在其他目录中的文件
+    lower_name, base = name.lower(), os.path.basename(name).lower()
+    search = [c for category in categories for c in [category] + DIR_FALLBACKS.get(category, [])]
+    ranked = sorted(
+        files,
+        key=lambda rel: (rel.split("/", 1)[0] not in search, rel.count("/")),
+    )
+    for rel in ranked:
+        sub = rel.split("/", 1)[1] if "/" in rel else rel
+        if sub.lower() == lower_name or os.path.basename(rel).lower() == base:
+            return categories[0], rel, True
+    return categories[0], None, False
+
+
+# ----------------------------------------------------------------------------
+# 清单
+# ----------------------------------------------------------------------------
+
+def build_plan(repo_path: str, snapshot: str, files: Dict[str, int], models: List[Tuple[str, str]]) -> Dict:
+    """
+    根据快照索引生成清单
+
+    没有别名的目录整体链接到快照；需要别名的目录在本地创建真实目录，逐个文件链接，
+    避免向网络卷中的快照写入任何东西。
+    """
+    snapshot_path = os.path.join(repo_path, "snapshots", snapshot)
+    resolved, missing, aliases = {}, [], {}
+    for class_type, name in models:
+        category, rel, alias = resolve_model(files, class_type, name)
+        if rel is None:
+            missing.append(name)
+            continue
+        resolved[name] = {"path": os.path.join(snapshot_path, rel), "size": files[rel], "category": category}
+        if alias:
+            aliases.setdefault(category, {})[name] = os.path.join(snapshot_path, rel)
+
+    links = {}
+    for category in MODEL_DIRS:
+        source = dir_source(files, category)
+        link = os.path.join(COMFY_MODELS, category)
+        if category not in aliases:
+            if source:
+                links[link] = os.path.join(snapshot_path, source)
+            continue
+        if source:
+            for rel in files:
+                if rel.startswith(source + "/"):
+                    links[os.path.join(link, rel[len(source) + 1:])] = os.path.join(snapshot_path, rel)
+        for name, target in aliases[category].items():
+            links[os.path.join(link, name)] = target
+
+    return {
+        "version": MANIFEST_VERSION,
+        "created": time.time(),
+        "repo": os.path.basename(repo_path),
+        "repo_path": repo_path,
+        "snapshot": snapshot,
+        "models": resolved,
+        "missing": missing,
+        "links": links,
+        "local_dirs": sorted(aliases),
+    }
+
+
+def rebuild(models: List[Tuple[str, str]]) -> Optional[Dict]:
+    """扫描 hub 目录，选择仓库与快照并生成清单"""
+    if MODEL_REPO:
+        candidates = [os.path.join(CACHE_HUB, repo_dir_name(MODEL_REPO))]
+    else:
+        candidates = sorted(
+            os.path.join(CACHE_HUB, d) for d in os.listdir(CACHE_HUB) if d.startswith("models--")
+        )
+
+    best = None
+    for repo_path in candidates:
+        snapshot, source = resolve_snapshot(repo_path)
+        if not snapshot:
+            log(f"No usable snapshot in {repo_path}")
+            continue
+        files = index_snapshot(os.path.join(repo_path, "snapshots", snapshot))
+        plan = build_plan(repo_path, snapshot, files, models)
+        score = (len(plan["models"]), len(files))
+        log(
+            f"Indexed {os.path.basename(repo_path)} @ {snapshot[:12]} ({source}): "
+            f"{len(files)} files, {len(plan['models'])}/{len(models)} workflow models"
+        )
+        if best is None or score > best[0]:
+            best = (score, plan)
+    return best[1] if best else None
+
+
+def validate(manifest: Dict, models: List[Tuple[str, str]]) -> Optional[str]:
+    """
+    校验清单是否仍然有效 (只读 refs/main 和清单中的文件，不扫描目录)
+
+    Returns:
+        失效原因；有效时为 None
+    """
+    if manifest.get("version") != MANIFEST_VERSION:
+        return "manifest version changed"
+    if MODEL_REPO and manifest.get("repo") != repo_dir_name(MODEL_REPO):
+        return f"MODEL_REPO is {MODEL_REPO}"
+    ref = read_ref(manifest["repo_path"])
+    if ref and ref != manifest["snapshot"]:
+        return f"refs/main moved to {ref[:12]}"
+    names = [name for _, name in models]
+    if sorted(names) != sorted(list(manifest["models"]) + manifest["missing"]):
+        return "workflow models changed"
+    for name, entry in manifest["models"].items():
+        try:
+            if os.stat(entry["path"]).st_size != entry["size"]:
+                return f"{name} changed size"
+        except OSError:
+            return f"{name} is missing"
+    for target in set(manifest["links"].values()):
+        if not os.path.exists(target):
+            return f"{target} is missing"
+    return None
+
+
+def load_manifest() -> Optional[Dict]:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(manifest: Dict) -> None:
+    tmp = f"{MANIFEST_PATH}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, MANIFEST_PATH)
+        log(f"Manifest written to {MANIFEST_PATH}")
+    except OSError as e:
+        log(f"WARNING: could not write manifest {MANIFEST_PATH}: {e}")
+
+
+# ----------------------------------------------------------------------------
+# 链接
+# ----------------------------------------------------------------------------
+
+def _replace_with_link(link: str, target: str) -> bool:
+    """让 link 指向 target；已正确时不做修改。返回是否修改"""
+    if os.path.islink(link):
+        if os.readlink(link) == target:
+            return False
+        os.unlink(link)
+    elif os.path.isdir(link):
+        shutil.rmtree(link)
+    elif os.path.exists(link):
+        os.unlink(link)
+    os.makedirs(os.path.dirname(link), exist_ok=True)
+    os.symlink(target, link)
+    return True
+
+
+def apply_links(manifest: Dict) -> None:
+    # 需要别名的目录必须是本地真实目录
+    for category in manifest["local_dirs"]:
+        path = os.path.join(COMFY_MODELS, category)
+        if os.path.islink(path):
+            os.unlink(path)
+        os.makedirs(path, exist_ok=True)
+
+    changed = 0
+    for link, target in sorted(manifest["links"].items()):
+        parent = os.path.dirname(link)
+        # 逐文件链接时, 子目录 (如 loras/wan) 也必须是本地目录
+        if os.path.islink(parent) and parent != COMFY_MODELS:
+            os.unlink(parent)
+        changed += _replace_with_link(link, target)
+    log(f"{len(manifest['links'])} links checked, {changed} updated")
+    for name, entry in manifest["models"].items():
+        log(f"  {name} -> {entry['path']}")
+    for name in manifest["missing"]:
+        log(f"WARNING: workflow model not found in snapshot: {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve cached model snapshots and link them into ComfyUI")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the existing manifest")
+    args = parser.parse_args()
+
+    if not os.path.isdir(CACHE_HUB):
+        log(f"WARNING: Cache directory not found: {CACHE_HUB}")
+        log("Make sure you have configured Model URL in runpod endpoint settings")
+        return
+
+    start = time.time()
+    models = workflow_models(WORKFLOW_PATH)
+    manifest = None if args.rebuild else load_manifest()
+    reason = validate(manifest, models) if manifest else "no manifest"
+    if reason:
+        log(f"Rebuilding manifest: {reason}")
+        manifest = rebuild(models)
+        if manifest is None:
+            log(f"WARNING: No models--* snapshot found in {CACHE_HUB}")
+            return
+        save_manifest(manifest)
+    else:
+        log(f"Manifest valid ({manifest['repo']} @ {manifest['snapshot'][:12]})")
+
+    apply_links(manifest)
+    log(f"Model linking completed in {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        log(f"ERROR: {e}")
+        sys.exit(1)
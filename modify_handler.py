@@ -28,6 +28,9 @@ with open('/handler.py', 'r', encoding='utf-8') as f:
 oss_imports = '''
 # OSS Configuration (alibabacloud_oss_v2)
 import alibabacloud_oss_v2 as oss
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # OSS Environment Variables
@@ -44,8 +47,31 @@ OSS_REGION = os.environ.get("OSS_REGION", "cn-shanghai")
 OSS_ENDPOINT = os.environ.get("OSS_ENDPOINT", "")
 OSS_PREFIX = os.environ.get("OSS_PREFIX", "comfyui-outputs")
 
+# 大文件分片上传配置
+# - OSS_MULTIPART_THRESHOLD: 超过该大小 (字节) 的输出使用分片上传
+# - OSS_MULTIPART_PART_SIZE: 分片大小 (字节, OSS 要求至少 100 KB)
+# - OSS_MULTIPART_CONCURRENCY: 并发上传的分片数
+# - OSS_MULTIPART_PART_RETRIES: 单个分片的重试次数
+# - OSS_MULTIPART_ATTEMPTS: 整体尝试次数, 之后的尝试从断点续传
+OSS_MULTIPART_THRESHOLD = int(os.environ.get("OSS_MULTIPART_THRESHOLD", 32 * 1024 * 1024))
+OSS_MULTIPART_PART_SIZE = int(os.environ.get("OSS_MULTIPART_PART_SIZE", 8 * 1024 * 1024))
+OSS_MULTIPART_CONCURRENCY = int(os.environ.get("OSS_MULTIPART_CONCURRENCY", 4))
+OSS_MULTIPART_PART_RETRIES = int(os.environ.get("OSS_MULTIPART_PART_RETRIES", 3))
+OSS_MULTIPART_ATTEMPTS = int(os.environ.get("OSS_MULTIPART_ATTEMPTS", 2))
+OSS_MULTIPART_CHECKPOINT_DIR = os.environ.get("OSS_MULTIPART_CHECKPOINT_DIR", "/tmp/oss-multipart-checkpoints")
+
+# OSS 连接池与预热
+# - OSS_MAX_CONNECTIONS: 连接池大小, 需覆盖 OUTPUT_UPLOAD_CONCURRENCY x OSS_MULTIPART_CONCURRENCY
+# - OSS_PREWARM: worker 启动时创建 client 并建立到 bucket 的 keep-alive 连接
+# - OSS_HEALTH_CHECK_INTERVAL: 空闲时保持连接活跃的探测间隔 (秒, 0 关闭)
+OSS_MAX_CONNECTIONS = int(os.environ.get("OSS_MAX_CONNECTIONS", 32))
+OSS_PREWARM = os.environ.get("OSS_PREWARM", "true").lower() == "true"
+OSS_HEALTH_CHECK_INTERVAL = float(os.environ.get("OSS_HEALTH_CHECK_INTERVAL", 60))
+
 # 用于缓存 OSS client 实例
 _oss_client = None
+_oss_client_lock = threading.Lock()
+_oss_upload_latency = {"first": None, "count": 0, "steady_total": 0.0}
 
 
 def get_oss_client():
@@ -61,6 +87,19 @@ def get_oss_client():
     if _oss_client is not None:
         return _oss_client
 
+    with _oss_client_lock:
+        if _oss_client is None:
+            _oss_client = _create_oss_client()
+    return _oss_client
+
+
+def _create_oss_client():
+    """
+    Build the OSS client with a pooled keep-alive HTTP transport.
+
+    Returns:
+        oss.Client: The OSS client instance, or None if not configured.
+    """
     if not OSS_BUCKET_NAME:
         print("worker-comfyui - OSS not configured, missing OSS_BUCKET_NAME")
         return None
@@ -83,24 +122,258 @@ def get_oss_client():
         if OSS_ENDPOINT:
             cfg.endpoint = OSS_ENDPOINT
 
+        # 共享连接池, 分片与并发输出上传复用同一批 keep-alive 连接
+        cfg.http_client = oss.transport.RequestsHttpClient(max_connections=OSS_MAX_CONNECTIONS)
+
         # 创建 OSS 客户端
-        _oss_client = oss.Client(cfg)
+        client = oss.Client(cfg)
         print(f"worker-comfyui - OSS client initialized for region: {OSS_REGION}, bucket: {OSS_BUCKET_NAME}")
-        return _oss_client
+        return client
     except Exception as e:
         print(f"worker-comfyui - Error creating OSS client: {e}")
         return None
 
 
-def upload_to_oss(file_bytes, filename, job_id, content_type=None):
+def _ping_oss():
     """
-    Upload file bytes to OSS.
+    Send one lightweight request to the bucket to open or refresh a pooled connection.
+
+    Returns:
+        float: The round-trip time in seconds, or None if OSS is not configured
+            or the request failed.
+    """
+    client = get_oss_client()
+    if not client:
+        return None
+    start = time.monotonic()
+    try:
+        # 无 ACL 读取权限时返回 403 也说明连接已建立
+        client.is_bucket_exist(OSS_BUCKET_NAME)
+    except Exception as e:
+        print(f"worker-comfyui - OSS health check failed: {e}")
+        return None
+    return time.monotonic() - start
+
+
+def _oss_health_check_loop():
+    """Ping the bucket every OSS_HEALTH_CHECK_INTERVAL seconds to keep connections warm."""
+    while True:
+        time.sleep(OSS_HEALTH_CHECK_INTERVAL)
+        _ping_oss()
+
+
+def start_oss_prewarm():
+    """
+    Initialise the OSS client and warm its connection pool at worker boot.
+
+    Runs in a daemon thread so it never delays the worker from taking jobs,
+    then keeps the connections alive with a periodic health check.
+    """
+    if not OSS_PREWARM or not OSS_BUCKET_NAME:
+        return
+
+    def prewarm():
+        start = time.monotonic()
+        rtt = _ping_oss()
+        if rtt is not None:
+            print(f"worker-comfyui - OSS client pre-warmed in {time.monotonic() - start:.2f}s (bucket round-trip {rtt:.3f}s)")
+        if OSS_HEALTH_CHECK_INTERVAL > 0:
+            _oss_health_check_loop()
+
+    threading.Thread(target=prewarm, name="oss-prewarm", daemon=True).start()
+
+
+def _record_oss_upload_latency(seconds, size):
+    """Log an upload's latency next to the first-upload and steady-state figures."""
+    with _oss_client_lock:
+        stats = _oss_upload_latency
+        if stats["first"] is None:
+            stats["first"] = seconds
+        else:
+            stats["count"] += 1
+            stats["steady_total"] += seconds
+        first, count, total = stats["first"], stats["count"], stats["steady_total"]
+
+    steady = f"{total / count:.3f}s avg over {count}" if count else "n/a"
+    print(
+        f"worker-comfyui - OSS upload latency {seconds:.3f}s for {size / 1048576:.1f} MB "
+        f"(first upload {first:.3f}s, steady state {steady})"
+    )
+
+
+def _oss_object_url(oss_key):
+    """
+    Build the public URL of an uploaded object.
+
+    Args:
+        oss_key (str): The object key.
+
+    Returns:
+        str: The object URL.
+    """
+    # 格式: https://{bucket}.{region}.aliyuncs.com/{key}
+    if OSS_ENDPOINT:
+        endpoint_host = OSS_ENDPOINT.replace("https://", "").replace("http://", "")
+        return f"https://{OSS_BUCKET_NAME}.{endpoint_host}/{oss_key}"
+    return f"https://{OSS_BUCKET_NAME}.oss-{OSS_REGION}.aliyuncs.com/{oss_key}"
+
+
+def _multipart_checkpoint_path(job_id, filename, size):
+    """Return the checkpoint file used to resume a multipart upload of this output."""
+    digest = hashlib.sha256(f"{job_id}/{filename}/{size}".encode("utf-8")).hexdigest()
+    return os.path.join(OSS_MULTIPART_CHECKPOINT_DIR, f"{digest}.json")
+
+
+def _load_multipart_checkpoint(path):
+    """Return the saved checkpoint dict, or None if there is none."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_multipart_checkpoint(path, checkpoint):
+    """Atomically write a checkpoint dict."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def _multipart_upload_to_oss(client, oss_key, size, read_part, content_type, checkpoint_path):
+    """
+    Upload an object in parts, resuming from a checkpoint when one exists.
+
+    Parts are uploaded concurrently (OSS_MULTIPART_CONCURRENCY) and each part is
+    retried on its own (OSS_MULTIPART_PART_RETRIES). The upload ID is saved to
+    checkpoint_path as soon as it exists, so a later attempt can list the parts
+    already stored in OSS and upload only the missing ones.
+
+    Args:
+        client (oss.Client): The OSS client.
+        oss_key (str): The object key to use for a fresh upload.
+        size (int): Total object size in bytes.
+        read_part (callable): read_part(offset, length) -> bytes.
+        content_type (str): The content type of the object, or None.
+        checkpoint_path (str): Where the resume checkpoint is kept.
+
+    Returns:
+        str: The object key actually used (the checkpoint's key when resuming).
+    """
+    # OSS 最多支持 10000 个分片
+    part_size = max(OSS_MULTIPART_PART_SIZE, 100 * 1024, -(-size // 10000))
+    part_count = max(1, -(-size // part_size))
+    upload_id = None
+    uploaded = {}
+
+    checkpoint = _load_multipart_checkpoint(checkpoint_path)
+    if checkpoint and checkpoint.get("size") == size and checkpoint.get("part_size") == part_size:
+        try:
+            paginator = client.list_parts_paginator()
+            request = oss.ListPartsRequest(
+                bucket=OSS_BUCKET_NAME, key=checkpoint["oss_key"], upload_id=checkpoint["upload_id"]
+            )
+            for page in paginator.iter_page(request):
+                for part in page.parts or []:
+                    uploaded[part.part_number] = (part.etag, part.size)
+            oss_key = checkpoint["oss_key"]
+            upload_id = checkpoint["upload_id"]
+            print(f"worker-comfyui - Resuming multipart upload of {oss_key}: {len(uploaded)}/{part_count} part(s) already in OSS")
+        except Exception as e:
+            print(f"worker-comfyui - Could not resume multipart upload, starting over: {e}")
+            uploaded = {}
+
+    if upload_id is None:
+        request = oss.InitiateMultipartUploadRequest(bucket=OSS_BUCKET_NAME, key=oss_key)
+        if content_type:
+            request.content_type = content_type
+        upload_id = client.initiate_multipart_upload(request).upload_id
+        _save_multipart_checkpoint(
+            checkpoint_path,
+            {"oss_key": oss_key, "upload_id": upload_id, "size": size, "part_size": part_size},
+        )
+
+    def upload_part(part_number):
+        offset = (part_number - 1) * part_size
+        length = min(part_size, size - offset)
+        if part_number in uploaded and uploaded[part_number][1] == length:
+            return part_number, uploaded[part_number][0]
+
+        last_error = None
+        for attempt in range(1, OSS_MULTIPART_PART_RETRIES + 1):
+            try:
+                result = client.upload_part(oss.UploadPartRequest(
+                    bucket=OSS_BUCKET_NAME,
+                    key=oss_key,
+                    upload_id=upload_id,
+                    part_number=part_number,
+                    body=read_part(offset, length),
+                ))
+                return part_number, result.etag
+            except Exception as e:
+                last_error = e
+                print(f"worker-comfyui - Part {part_number}/{part_count} attempt {attempt} failed: {e}")
+                if attempt < OSS_MULTIPART_PART_RETRIES:
+                    time.sleep(min(0.5 * 2 ** attempt, 8))
+        raise RuntimeError(f"Part {part_number} failed after {OSS_MULTIPART_PART_RETRIES} attempts: {last_error}")
+
+    print(f"worker-comfyui - Multipart upload of {oss_key}: {part_count} part(s) of {part_size / 1048576:.1f} MB")
+    workers = max(1, min(OSS_MULTIPART_CONCURRENCY, part_count))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="oss-part") as pool:
+        etags = dict(pool.map(upload_part, range(1, part_count + 1)))
+
+    client.complete_multipart_upload(oss.CompleteMultipartUploadRequest(
+        bucket=OSS_BUCKET_NAME,
+        key=oss_key,
+        upload_id=upload_id,
+        complete_multipart_upload=oss.CompleteMultipartUpload(
+            parts=[oss.UploadPart(part_number=n, etag=etags[n]) for n in sorted(etags)]
+        ),
+    ))
+    try:
+        os.remove(checkpoint_path)
+    except OSError:
+        pass
+    return oss_key
+
+
+def _multipart_upload_with_resume(client, oss_key, size, read_part, content_type, checkpoint_path):
+    """
+    Run _multipart_upload_to_oss up to OSS_MULTIPART_ATTEMPTS times.
+
+    Every attempt after the first resumes from the checkpoint, so only the
+    parts that never reached OSS are sent again.
+
+    Returns:
+        str: The object key of the completed upload.
+    """
+    last_error = None
+    for attempt in range(1, OSS_MULTIPART_ATTEMPTS + 1):
+        try:
+            return _multipart_upload_to_oss(client, oss_key, size, read_part, content_type, checkpoint_path)
+        except Exception as e:
+            last_error = e
+            print(f"worker-comfyui - Multipart upload attempt {attempt}/{OSS_MULTIPART_ATTEMPTS} failed: {e}")
+    raise last_error
+
+
+def _upload_to_oss(filename, job_id, content_type, size, body, read_part):
+    """
+    Upload one object to OSS from an in-memory or on-disk source.
+
+    Objects of at least OSS_MULTIPART_THRESHOLD bytes are sent as a resumable
+    multipart upload using read_part, smaller ones with a single PutObject
+    request using body.
 
     Args:
-        file_bytes (bytes): The file content to upload.
         filename (str): The original filename.
         job_id (str): The job ID for organizing uploads.
-        content_type (str, optional): The content type of the file.
+        content_type (str): The content type of the file, or None.
+        size (int): The object size in bytes.
+        body (bytes or file): The PutObject body.
+        read_part (callable): read_part(offset, length) -> bytes, for multipart.
 
     Returns:
         str: The OSS URL of the uploaded file, or None if upload failed.
@@ -109,39 +382,45 @@ def upload_to_oss(file_bytes, filename, job_id, content_type=None):
     if not client:
         return None
 
+    start = time.monotonic()
     try:
         # Generate unique path: prefix/job_id/timestamp_filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         oss_key = f"{OSS_PREFIX}/{job_id}/{timestamp}_{filename}"
 
-        # 构建上传请求
-        request = oss.PutObjectRequest(
-            bucket=OSS_BUCKET_NAME,
-            key=oss_key,
-            body=file_bytes,
-        )
+        if size >= OSS_MULTIPART_THRESHOLD:
+            oss_key = _multipart_upload_with_resume(
+                client,
+                oss_key,
+                size,
+                read_part,
+                content_type,
+                _multipart_checkpoint_path(job_id, filename, size),
+            )
+        else:
+            # 构建上传请求
+            request = oss.PutObjectRequest(
+                bucket=OSS_BUCKET_NAME,
+                key=oss_key,
+                body=body,
+            )
 
-        # 如果有 content_type 则设置
-        if content_type:
-            request.content_type = content_type
+            # 如果有 content_type 则设置
+            if content_type:
+                request.content_type = content_type
 
-        # 执行上传
-        result = client.put_object(request)
+            # 执行上传
+            result = client.put_object(request)
 
-        if result.status_code == 200:
-            # 构造访问 URL
-            # 格式: https://{bucket}.{region}.aliyuncs.com/{key}
-            if OSS_ENDPOINT:
-                endpoint_host = OSS_ENDPOINT.replace("https://", "").replace("http://", "")
-                oss_url = f"https://{OSS_BUCKET_NAME}.{endpoint_host}/{oss_key}"
-            else:
-                oss_url = f"https://{OSS_BUCKET_NAME}.oss-{OSS_REGION}.aliyuncs.com/{oss_key}"
+            if result.status_code != 200:
+                print(f"worker-comfyui - OSS upload failed with status: {result.status_code}")
+                return None
 
-            print(f"worker-comfyui - Successfully uploaded to OSS: {oss_url}")
-            return oss_url
-        else:
-            print(f"worker-comfyui - OSS upload failed with status: {result.status_code}")
-            return None
+        # 构造访问 URL
+        oss_url = _oss_object_url(oss_key)
+        print(f"worker-comfyui - Successfully uploaded to OSS: {oss_url}")
+        _record_oss_upload_latency(time.monotonic() - start, size)
+        return oss_url
     except Exception as e:
         print(f"worker-comfyui - Error uploading to OSS: {e}")
         import traceback
@@ -149,297 +428,681 @@ def upload_to_oss(file_bytes, filename, job_id, content_type=None):
         return None
 
 
-def download_from_url(url, timeout=120):
+def upload_to_oss(file_bytes, filename, job_id, content_type=None):
     """
-    Download file from URL.
+    Upload file bytes to OSS.
 
     Args:
-        url (str): The URL to download from.
-        timeout (int): Request timeout in seconds.
+        file_bytes (bytes): The file content to upload.
+        filename (str): The original filename.
+        job_id (str): The job ID for organizing uploads.
+        content_type (str, optional): The content type of the file.
+
+    Returns:
+        str: The OSS URL of the uploaded file, or None if upload failed.
+    """
+    return _upload_to_oss(
+        filename,
+        job_id,
+        content_type,
+        len(file_bytes),
+        file_bytes,
+        lambda offset, length: file_bytes[offset:offset + length],
+    )
+
+
+def upload_file_to_oss(file_path, filename, job_id, content_type=None):
+    """
+    Stream a file on disk to OSS without loading it into memory.
+
+    Small files are passed to PutObject as an open file object; multipart
+    uploads read each part with os.pread, which is safe to call from the
+    concurrent part uploaders on a shared descriptor.
+
+    Args:
+        file_path (str): Path of the file to upload.
+        filename (str): The original filename.
+        job_id (str): The job ID for organizing uploads.
+        content_type (str, optional): The content type of the file.
 
     Returns:
-        tuple: (bytes, content_type) or (None, None) if download failed.
+        str: The OSS URL of the uploaded file, or None if upload failed.
     """
     try:
-        print(f"worker-comfyui - Downloading from URL: {url}")
-        response = requests.get(url, timeout=timeout, stream=True)
-        response.raise_for_status()
-        content_type = response.headers.get('content-type', 'application/octet-stream')
-        return response.content, content_type
-    except requests.Timeout:
-        print(f"worker-comfyui - Timeout downloading from URL: {url}")
-        return None, None
-    except requests.RequestException as e:
-        print(f"worker-comfyui - Error downloading from URL {url}: {e}")
-        return None, None
-    except Exception as e:
-        print(f"worker-comfyui - Unexpected error downloading from URL {url}: {e}")
-        return None, None
+        with open(file_path, "rb") as f:
+            fd = f.fileno()
+            return _upload_to_oss(
+                filename,
+                job_id,
+                content_type,
+                os.fstat(fd).st_size,
+                f,
+                lambda offset, length: os.pread(fd, length, offset),
+            )
+    except OSError as e:
+        print(f"worker-comfyui - Error reading {file_path} for OSS upload: {e}")
+        return None
 
-'''
 
-# 在 COMFY_HOST 定义之后插入 OSS 配置
-pattern = r'(COMFY_HOST = "[^"]*")'
-match = re.search(pattern, content)
-if match:
-    insert_pos = match.end()
-    content = content[:insert_pos] + oss_imports + content[insert_pos:]
-else:
-    # 如果找不到 COMFY_HOST，就在 import 之后添加
-    content = content.replace('import traceback', 'import traceback' + oss_imports)
+# Concurrent input staging: number of inputs downloaded/uploaded in parallel
+INPUT_STAGING_CONCURRENCY = int(os.environ.get("INPUT_STAGING_CONCURRENCY", 4))
 
-# ============================================================================
-# 2. 重写 upload_images 函数以支持 URL
-# ============================================================================
-new_upload_images = '''def upload_images(images):
+# Streaming ingest: URL inputs are piped chunk by chunk into /upload/image
+INPUT_STREAM_CHUNK_BYTES = int(os.environ.get("INPUT_STREAM_CHUNK_BYTES", 1024 * 1024))
+
+# Base64 decoding: payloads decoding to INPUT_SPILL_THRESHOLD_BYTES or more are
+# written straight to disk; smaller ones stay in memory while the job's
+# INPUT_MEMORY_BUDGET_BYTES allows, and spill to INPUT_SPILL_DIR once it is used up.
+INPUT_SPILL_THRESHOLD_BYTES = int(os.environ.get("INPUT_SPILL_THRESHOLD_BYTES", 32 * 1024 * 1024))
+INPUT_MEMORY_BUDGET_BYTES = int(os.environ.get("INPUT_MEMORY_BUDGET_BYTES", 256 * 1024 * 1024))
+INPUT_SPILL_DIR = os.environ.get("INPUT_SPILL_DIR", "/tmp/comfyui-input-spill")
+
+_input_memory_lock = threading.Lock()
+_input_memory = {"used": 0, "peak": 0}
+
+IMAGE_CONTENT_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.bmp': 'image/bmp',
+}
+
+VIDEO_CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.mov': 'video/quicktime',
+    '.avi': 'video/x-msvideo',
+    '.mkv': 'video/x-matroska',
+    '.gif': 'image/gif',
+}
+
+
+def _current_rss_bytes():
+    """
+    Return the current resident set size of this process in bytes.
+
+    Returns:
+        int: RSS in bytes, or 0 if /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _count_chunks(chunks, metrics):
+    """Yield non-empty chunks while tracking 'bytes' and 'peak_rss_bytes' in metrics."""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        metrics["bytes"] += len(chunk)
+        metrics["peak_rss_bytes"] = max(metrics["peak_rss_bytes"], _current_rss_bytes())
+        yield chunk
+
+
+def _timed_chunks(chunks, metrics, key):
+    """Yield chunks unchanged while adding the time spent producing them to metrics[key]."""
+    chunks = iter(chunks)
+    while True:
+        start = time.monotonic()
+        chunk = next(chunks, None)
+        metrics[key] = metrics.get(key, 0.0) + time.monotonic() - start
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _multipart_upload_body(boundary, name, content_type, chunks, metrics):
+    """
+    Yield a multipart/form-data body for /upload/image without buffering the file.
+
+    Args:
+        boundary (str): The multipart boundary.
+        name (str): The filename ComfyUI should store the upload under.
+        content_type (str): The content type of the file part.
+        chunks (iterable): Iterable of bytes chunks making up the file.
+        metrics (dict): Updated in place with 'bytes' and 'peak_rss_bytes'.
+    """
+    safe_name = name.replace('"', '%22')
+    yield (
+        f'--{boundary}\\r\\n'
+        f'Content-Disposition: form-data; name="overwrite"\\r\\n\\r\\n'
+        f'true\\r\\n'
+        f'--{boundary}\\r\\n'
+        f'Content-Disposition: form-data; name="image"; filename="{safe_name}"\\r\\n'
+        f'Content-Type: {content_type}\\r\\n\\r\\n'
+    ).encode("utf-8")
+    yield from _count_chunks(chunks, metrics)
+    yield f'\\r\\n--{boundary}--\\r\\n'.encode("utf-8")
+
+
+def _post_stream_to_comfy(name, content_type, chunks, metrics, timeout):
+    """
+    POST an iterable of chunks to /upload/image as a chunked multipart request.
+
+    Args:
+        name (str): The filename to store the upload under.
+        content_type (str): The content type of the file part.
+        chunks (iterable): Iterable of bytes chunks making up the file.
+        metrics (dict): Transfer metrics, updated in place.
+        timeout (int): Upload request timeout in seconds.
+    """
+    boundary = uuid.uuid4().hex
+    response = comfy_session().post(
+        f"http://{COMFY_HOST}/upload/image",
+        data=_multipart_upload_body(boundary, name, content_type, chunks, metrics),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+
+
+def _iter_file_chunks(path):
+    """Yield a file's content in INPUT_STREAM_CHUNK_BYTES chunks."""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(INPUT_STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _tee_chunks(chunks, fileobj):
+    """Yield chunks unchanged while also writing them to fileobj."""
+    for chunk in chunks:
+        fileobj.write(chunk)
+        yield chunk
+
+
+def _finish_metrics(name, metrics, start):
+    """Fill in elapsed time and throughput, log them and return the metrics."""
+    metrics["seconds"] = time.monotonic() - start
+    metrics["bytes_per_sec"] = metrics["bytes"] / metrics["seconds"] if metrics["seconds"] > 0 else 0.0
+    print(
+        f"worker-comfyui - Staged {name} (cache {metrics['cache']}, {metrics.get('placement', 'none')}): "
+        f"{metrics['bytes'] / 1048576:.1f} MB "
+        f"in {metrics['seconds']:.2f}s ({metrics['bytes_per_sec'] / 1048576:.1f} MB/s), "
+        f"peak RSS {metrics['peak_rss_bytes'] / 1048576:.1f} MB"
+    )
+    return metrics
+
+
+def stream_url_to_comfy(url, name, content_types, default_content_type, timeout=120, upload_timeout=120):
     """
-    Upload a list of images (base64 encoded or URL) to the ComfyUI server using the /upload/image endpoint.
+    Stream a remote file straight into ComfyUI's /upload/image endpoint.
+
+    The download is consumed with iter_content() and forwarded as a chunked
+    multipart request, so memory stays bounded by INPUT_STREAM_CHUNK_BYTES
+    regardless of the file size. When the server sends an ETag or
+    Last-Modified header the input cache is consulted first, and on a miss
+    the body is written to the cache while it is being forwarded. With direct
+    placement the body is written into ComfyUI's input directory instead.
 
     Args:
-        images (list): A list of dictionaries, each containing:
-                      - 'name': the filename for the image
-                      - 'image': a base64 encoded string (optional if 'url' provided)
-                      - 'url': a URL to download the image from (optional if 'image' provided)
+        url (str): The URL to download from.
+        name (str): The filename to store the upload under.
+        content_types (dict): Extension -> content type fallback map.
+        default_content_type (str): Content type used when nothing else matches.
+        timeout (int): Download request timeout in seconds.
+        upload_timeout (int): Upload request timeout in seconds.
 
     Returns:
-        dict: A dictionary indicating success or error.
+        dict: Transfer metrics ('bytes', 'seconds', 'bytes_per_sec', 'peak_rss_bytes',
+            'cache', 'download_seconds').
+
+    Raises:
+        ValueError: If the URL could not be downloaded.
+        requests.RequestException: If the upload to ComfyUI failed.
     """
-    if not images:
-        return {"status": "success", "message": "No images to upload", "details": []}
+    print(f"worker-comfyui - Streaming {name} from URL: {url}")
+    metrics = {"bytes": 0, "peak_rss_bytes": _current_rss_bytes(), "cache": "bypass"}
+    start = time.monotonic()
 
-    responses = []
-    upload_errors = []
+    try:
+        response = requests.get(url, timeout=timeout, stream=True)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise ValueError(f"Failed to download {name} from URL {url}: {e}")
+    # 下载时间 = 等待响应头 + 读取 body 的时间 (与上传交错进行, 分开累计)
+    metrics["download_seconds"] = time.monotonic() - start
+
+    with response:
+        content_type = response.headers.get('content-type', 'application/octet-stream')
+        if not content_type or content_type == 'application/octet-stream':
+            ext = os.path.splitext(name)[1].lower()
+            content_type = content_types.get(ext, default_content_type)
 
-    print(f"worker-comfyui - Uploading {len(images)} image(s)...")
+        # 命中缓存时直接关闭响应, 不读取 body
+        cache_key = url_cache_key(url, response.headers)
+        if cache_key and stage_cached_input(cache_key, name, content_type, metrics, upload_timeout):
+            return _finish_metrics(name, metrics, start)
 
-    for image in images:
+        chunks = _timed_chunks(response.iter_content(chunk_size=INPUT_STREAM_CHUNK_BYTES), metrics, "download_seconds")
+        cache_file = input_cache_open(cache_key) if cache_key else None
         try:
-            name = image["name"]
-            blob = None
-            content_type = "image/png"
-
-            # Check if image is provided as URL
-            if "url" in image and image["url"]:
-                print(f"worker-comfyui - Downloading image from URL: {image['url']}")
-                blob, content_type = download_from_url(image["url"], timeout=60)
-                if blob is None:
-                    raise ValueError(f"Failed to download image from URL: {image['url']}")
-                # Determine content type from URL or response
-                if not content_type or content_type == 'application/octet-stream':
-                    ext = os.path.splitext(name)[1].lower()
-                    content_type_map = {
-                        '.png': 'image/png',
-                        '.jpg': 'image/jpeg',
-                        '.jpeg': 'image/jpeg',
-                        '.gif': 'image/gif',
-                        '.webp': 'image/webp',
-                        '.bmp': 'image/bmp',
-                    }
-                    content_type = content_type_map.get(ext, 'image/png')
-
-            elif "image" in image and image["image"]:
-                # Handle base64 encoded image
-                image_data_uri = image["image"]
-
-                # Strip Data URI prefix if present
-                if "," in image_data_uri:
-                    # Extract content type from data URI if present
-                    prefix = image_data_uri.split(",", 1)[0]
-                    if ":" in prefix and ";" in prefix:
-                        content_type = prefix.split(":")[1].split(";")[0]
-                    base64_data = image_data_uri.split(",", 1)[1]
-                else:
-                    base64_data = image_data_uri
-
-                blob = base64.b64decode(base64_data)
+            if cache_file and direct_placement_enabled():
+                # 先完整写入缓存, 再硬链接到 ComfyUI 输入目录, 避免重复写盘
+                for chunk in _count_chunks(chunks, metrics):
+                    cache_file.write(chunk)
+                cache_file.flush()
+                place_input_from_path(name, cache_file.name, metrics)
             else:
-                raise ValueError(f"Image {name} must have either 'url' or 'image' field")
+                if cache_file:
+                    chunks = _tee_chunks(chunks, cache_file)
+                deliver_input(name, content_type, chunks, metrics, upload_timeout)
+        except Exception:
+            if cache_file:
+                input_cache_discard(cache_file)
+            raise
 
-            # Prepare the form data
-            files = {
-                "image": (name, BytesIO(blob), content_type),
-                "overwrite": (None, "true"),
-            }
+    if cache_file:
+        input_cache_commit(cache_key, cache_file)
+        metrics["cache"] = "miss"
+    mark_input_placed(name, cache_key if cache_file else None)
+    return _finish_metrics(name, metrics, start)
 
-            # POST request to upload the image
-            response = requests.post(
-                f"http://{COMFY_HOST}/upload/image", files=files, timeout=30
-            )
-            response.raise_for_status()
 
-            responses.append(f"Successfully uploaded {name}")
-            print(f"worker-comfyui - Successfully uploaded {name}")
-
-        except base64.binascii.Error as e:
-            error_msg = f"Error decoding base64 for {image.get('name', 'unknown')}: {e}"
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
-        except requests.Timeout:
-            error_msg = f"Timeout uploading {image.get('name', 'unknown')}"
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
-        except requests.RequestException as e:
-            error_msg = f"Error uploading {image.get('name', 'unknown')}: {e}"
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
-        except Exception as e:
-            error_msg = (
-                f"Unexpected error uploading {image.get('name', 'unknown')}: {e}"
-            )
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
+def _parse_data_uri(data_uri, default_content_type):
+    """
+    Locate the payload of a base64 input without copying it.
 
-    if upload_errors:
-        print(f"worker-comfyui - image(s) upload finished with errors")
-        return {
-            "status": "error",
-            "message": "Some images failed to upload",
-            "details": upload_errors,
-        }
+    Only the short 'data:<type>;base64,' prefix is sliced; the payload is
+    addressed by its start offset in the original string.
 
-    print(f"worker-comfyui - image(s) upload complete")
-    return {
-        "status": "success",
-        "message": "All images uploaded successfully",
-        "details": responses,
-    }
+    Args:
+        data_uri (str): Base64 data, optionally with a Data URI prefix.
+        default_content_type (str): Content type used when the prefix has none.
 
-'''
+    Returns:
+        tuple: (content_type, payload_start).
+    """
+    # base64 本身不含逗号, 前缀只需在开头查找
+    comma = data_uri.find(",", 0, 1024)
+    if comma == -1:
+        return default_content_type, 0
 
-# 替换原有的 upload_images 函数
-pattern = r'def upload_images\(images\):.*?return \{\s*"status": "success",\s*"message": "All images uploaded successfully",\s*"details": responses,\s*\}'
-content = re.sub(pattern, new_upload_images.strip(), content, flags=re.DOTALL)
+    prefix = data_uri[:comma]
+    content_type = default_content_type
+    if ":" in prefix and ";" in prefix:
+        content_type = prefix.split(":", 1)[1].split(";", 1)[0] or default_content_type
+    return content_type, comma + 1
 
-# ============================================================================
-# 3. 添加 upload_videos 函数
-# ============================================================================
-upload_videos_func = '''
 
-def upload_videos(videos):
+def _iter_base64_decoded(data, start):
     """
-    Upload a list of videos (base64 encoded or URL) to the ComfyUI server using the /upload/image endpoint.
-    Note: ComfyUI uses the same endpoint for videos as it does for images.
+    Decode a base64 payload chunk by chunk.
+
+    Each step slices about INPUT_STREAM_CHUNK_BYTES characters, strips
+    whitespace, and carries any partial 4-character group over to the next
+    step, so line-wrapped payloads decode the same as base64.b64decode would.
 
     Args:
-        videos (list): A list of dictionaries, each containing:
-                      - 'name': the filename for the video
-                      - 'video': a base64 encoded string (optional if 'url' provided)
-                      - 'url': a URL to download the video from (optional if 'video' provided)
+        data (str): The string holding the payload.
+        start (int): Offset of the payload in data.
+
+    Yields:
+        bytes: Decoded chunks.
+
+    Raises:
+        binascii.Error: If the payload is not valid base64.
+    """
+    step = max(4, INPUT_STREAM_CHUNK_BYTES // 4 * 4)
+    carry = ""
+    for offset in range(start, len(data), step):
+        piece = carry + "".join(data[offset:offset + step].split())
+        usable = len(piece) - len(piece) % 4
+        carry = piece[usable:]
+        if usable:
+            yield base64.b64decode(piece[:usable])
+    if carry:
+        yield base64.b64decode(carry)
+
+
+def _reserve_input_memory(nbytes):
+    """
+    Reserve nbytes of the job's in-memory decode budget.
 
     Returns:
-        dict: A dictionary indicating success or error.
+        bool: False if the reservation would exceed INPUT_MEMORY_BUDGET_BYTES.
     """
-    if not videos:
-        return {"status": "success", "message": "No videos to upload", "details": []}
+    with _input_memory_lock:
+        if _input_memory["used"] + nbytes > INPUT_MEMORY_BUDGET_BYTES:
+            return False
+        _input_memory["used"] += nbytes
+        _input_memory["peak"] = max(_input_memory["peak"], _input_memory["used"])
+        return True
 
-    responses = []
-    upload_errors = []
 
-    print(f"worker-comfyui - Uploading {len(videos)} video(s)...")
+def _release_input_memory(nbytes):
+    """Return nbytes to the job's in-memory decode budget."""
+    with _input_memory_lock:
+        _input_memory["used"] -= nbytes
 
-    for video in videos:
-        try:
-            name = video["name"]
-            blob = None
-            content_type = "video/mp4"
-
-            # Check if video is provided as URL
-            if "url" in video and video["url"]:
-                print(f"worker-comfyui - Downloading video from URL: {video['url']}")
-                blob, content_type = download_from_url(video["url"], timeout=300)
-                if blob is None:
-                    raise ValueError(f"Failed to download video from URL: {video['url']}")
-                # Determine content type from filename if not properly detected
-                if not content_type or content_type == 'application/octet-stream':
-                    ext = os.path.splitext(name)[1].lower()
-                    content_type_map = {
-                        '.mp4': 'video/mp4',
-                        '.webm': 'video/webm',
-                        '.mov': 'video/quicktime',
-                        '.avi': 'video/x-msvideo',
-                        '.mkv': 'video/x-matroska',
-                        '.gif': 'image/gif',
-                    }
-                    content_type = content_type_map.get(ext, 'video/mp4')
-
-            elif "video" in video and video["video"]:
-                # Handle base64 encoded video
-                video_data_uri = video["video"]
-
-                # Strip Data URI prefix if present
-                if "," in video_data_uri:
-                    prefix = video_data_uri.split(",", 1)[0]
-                    if ":" in prefix and ";" in prefix:
-                        content_type = prefix.split(":")[1].split(";")[0]
-                    base64_data = video_data_uri.split(",", 1)[1]
-                else:
-                    base64_data = video_data_uri
-
-                blob = base64.b64decode(base64_data)
-            else:
-                raise ValueError(f"Video {name} must have either 'url' or 'video' field")
 
-            # Prepare the form data (ComfyUI uses /upload/image for videos too)
-            files = {
-                "image": (name, BytesIO(blob), content_type),
-                "overwrite": (None, "true"),
-            }
+def reset_input_memory_peak():
+    """Start a new job's peak measurement of the decode budget; returns nothing."""
+    with _input_memory_lock:
+        _input_memory["peak"] = _input_memory["used"]
 
-            # POST request to upload the video
-            response = requests.post(
-                f"http://{COMFY_HOST}/upload/image", files=files, timeout=120
-            )
-            response.raise_for_status()
 
-            responses.append(f"Successfully uploaded {name}")
-            print(f"worker-comfyui - Successfully uploaded video {name}")
-
-        except base64.binascii.Error as e:
-            error_msg = f"Error decoding base64 for {video.get('name', 'unknown')}: {e}"
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
-        except requests.Timeout:
-            error_msg = f"Timeout uploading {video.get('name', 'unknown')}"
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
-        except requests.RequestException as e:
-            error_msg = f"Error uploading {video.get('name', 'unknown')}: {e}"
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
-        except Exception as e:
-            error_msg = f"Unexpected error uploading {video.get('name', 'unknown')}: {e}"
-            print(f"worker-comfyui - {error_msg}")
-            upload_errors.append(error_msg)
+def input_memory_peak():
+    """Return the highest number of decoded bytes held in memory since the last reset."""
+    with _input_memory_lock:
+        return _input_memory["peak"]
 
-    if upload_errors:
-        print(f"worker-comfyui - video(s) upload finished with errors")
-        return {
-            "status": "error",
-            "message": "Some videos failed to upload",
-            "details": upload_errors,
-        }
 
-    print(f"worker-comfyui - video(s) upload complete")
-    return {
-        "status": "success",
-        "message": "All videos uploaded successfully",
-        "details": responses,
+def upload_base64_to_comfy(name, data_uri, default_content_type, timeout=120):
+    """
+    Decode a base64 (optionally Data URI prefixed) input and upload it to ComfyUI.
+
+    The payload is keyed in the input cache by its content hash, so a repeated
+    input skips both the decode and the upload. Payloads are decoded in chunks
+    without copying the string. Small ones are held in memory while the job's
+    INPUT_MEMORY_BUDGET_BYTES allows; payloads of INPUT_SPILL_THRESHOLD_BYTES
+    or more, or any payload once the budget is used up, are decoded straight
+    to a file (the cache entry when caching is on) and staged from there.
+
+    Args:
+        name (str): The filename to store the upload under.
+        data_uri (str): Base64 data, optionally with a 'data:<type>;base64,' prefix.
+        default_content_type (str): Content type used when the prefix has none.
+        timeout (int): Upload request timeout in seconds.
+
+    Returns:
+        dict: Transfer metrics ('bytes', 'seconds', 'bytes_per_sec', 'peak_rss_bytes',
+            'cache', 'decode', 'memory_bytes', 'hash_seconds', 'decode_seconds').
+
+    Raises:
+        binascii.Error: If the payload is not valid base64.
+        requests.RequestException: If the upload to ComfyUI failed.
+    """
+    metrics = {
+        "bytes": 0, "peak_rss_bytes": _current_rss_bytes(), "cache": "bypass", "memory_bytes": 0, "decode_seconds": 0.0,
     }
+    start = time.monotonic()
+
+    content_type, payload_start = _parse_data_uri(data_uri, default_content_type)
+
+    cache_key = base64_cache_key(data_uri, payload_start)
+    metrics["hash_seconds"] = time.monotonic() - start
+    if cache_key and stage_cached_input(cache_key, name, content_type, metrics, timeout):
+        return _finish_metrics(name, metrics, start)
+
+    decoded_size = (len(data_uri) - payload_start) // 4 * 3
+    in_memory = decoded_size < INPUT_SPILL_THRESHOLD_BYTES and _reserve_input_memory(decoded_size)
+    cache_file = input_cache_open(cache_key) if cache_key else None
+    spill_file = None
+    try:
+        if in_memory:
+            metrics["decode"] = "memory"
+            blob = list(_timed_chunks(_iter_base64_decoded(data_uri, payload_start), metrics, "decode_seconds"))
+            metrics["memory_bytes"] = sum(len(chunk) for chunk in blob)
+            metrics["peak_rss_bytes"] = max(metrics["peak_rss_bytes"], _current_rss_bytes())
+            if cache_file:
+                for chunk in blob:
+                    cache_file.write(chunk)
+                cache_file.flush()
+            if cache_file and direct_placement_enabled():
+                place_input_from_path(name, cache_file.name, metrics)
+                metrics["bytes"] = metrics["memory_bytes"]
+            else:
+                deliver_input(name, content_type, blob, metrics, timeout)
+            del blob
+        else:
+            metrics["decode"] = "spill"
+            if not cache_file:
+                os.makedirs(INPUT_SPILL_DIR, exist_ok=True)
+                spill_file = tempfile.NamedTemporaryFile(dir=INPUT_SPILL_DIR, prefix="b64-", delete=False)
+            target = cache_file or spill_file
+            for chunk in _timed_chunks(_iter_base64_decoded(data_uri, payload_start), metrics, "decode_seconds"):
+                target.write(chunk)
+                metrics["peak_rss_bytes"] = max(metrics["peak_rss_bytes"], _current_rss_bytes())
+            target.flush()
+            deliver_input_from_path(name, content_type, target.name, metrics, timeout)
+            metrics["bytes"] = target.tell()
+    except Exception:
+        if cache_file:
+            input_cache_discard(cache_file)
+        raise
+    finally:
+        if in_memory:
+            _release_input_memory(decoded_size)
+        if spill_file:
+            spill_file.close()
+            os.remove(spill_file.name)
+
+    if cache_file:
+        input_cache_commit(cache_key, cache_file)
+        metrics["cache"] = "miss"
+    mark_input_placed(name, cache_key)
+    return _finish_metrics(name, metrics, start)
 
 '''
 
-# 在 upload_images 函数之后添加 upload_videos 函数
-# 找到 upload_images 函数结束后的下一个函数
-pattern = r'(print\(f"worker-comfyui - image\(s\) upload complete"\)\s*\n\s*return \{\s*"status": "success",\s*"message": "All images uploaded successfully",\s*"details": responses,\s*\})'
+# 在 COMFY_HOST 定义之后插入 OSS 配置
+pattern = r'(COMFY_HOST = "[^"]*")'
 match = re.search(pattern, content)
 if match:
     insert_pos = match.end()
-    content = content[:insert_pos] + upload_videos_func + content[insert_pos:]
+    content = content[:insert_pos] + oss_imports + content[insert_pos:]
+else:
+    # 如果找不到 COMFY_HOST，就在 import 之后添加
+    content = content.replace('import traceback', 'import traceback' + oss_imports)
 
 # ============================================================================
-# 4. 修改 validate_input 函数
+# 2. 用输入暂存辅助函数替换 upload_images (支持 URL); 图片与视频统一由 stage_inputs 暂存
 # ============================================================================
-new_validate_input = '''def validate_input(job_input):
+input_staging_helpers = '''def _upload_media_item(item, field, content_types, default_content_type, download_timeout, upload_timeout):
+    """
+    Upload a single input (base64 encoded or URL) to ComfyUI.
+
+    Args:
+        item (dict): A dictionary with 'name' and either the base64 field or 'url'.
+        field (str): The base64 field name, 'image' or 'video'.
+        content_types (dict): Extension -> content type fallback map for URLs.
+        default_content_type (str): Content type used when nothing else matches.
+        download_timeout (int): URL download timeout in seconds.
+        upload_timeout (int): /upload/image timeout in seconds.
+
+    Returns:
+        dict: Transfer metrics from stream_url_to_comfy / upload_base64_to_comfy.
+
+    Raises:
+        Exception: Any download, decode or upload error, handled by _stage_input.
+    """
+    name = item["name"]
+
+    # Check if the input is provided as URL (streamed straight into ComfyUI)
+    if "url" in item and item["url"]:
+        return stream_url_to_comfy(
+            item["url"],
+            name,
+            content_types,
+            default_content_type,
+            timeout=download_timeout,
+            upload_timeout=upload_timeout,
+        )
+
+    if field in item and item[field]:
+        # Handle base64 encoded input
+        return upload_base64_to_comfy(name, item[field], default_content_type, timeout=upload_timeout)
+
+    raise ValueError(f"{field.capitalize()} {name} must have either 'url' or '{field}' field")
+
+
+def _upload_image_item(image):
+    """Upload a single image (base64 encoded or URL) to ComfyUI."""
+    return _upload_media_item(image, "image", IMAGE_CONTENT_TYPES, "image/png", 60, 30)
+
+
+def _stage_input(kind, item, upload_fn):
+    """
+    Run one input upload and turn any failure into an error message.
+
+    Args:
+        kind (str): 'image' or 'video', used for logging and timings.
+        item (dict): The input entry from the job.
+        upload_fn (callable): _upload_image_item or _upload_video_item.
+
+    Returns:
+        tuple: (error_msg or None, timing dict).
+    """
+    name = item.get("name", "unknown")
+    error_msg = None
+    metrics = {}
+    start = time.monotonic()
+
+    try:
+        metrics = upload_fn(item) or {}
+    except base64.binascii.Error as e:
+        error_msg = f"Error decoding base64 for {name}: {e}"
+    except requests.Timeout:
+        error_msg = f"Timeout uploading {name}"
+    except requests.RequestException as e:
+        error_msg = f"Error uploading {name}: {e}"
+    except Exception as e:
+        error_msg = f"Unexpected error uploading {name}: {e}"
+
+    timing = {
+        "name": name,
+        "kind": kind,
+        "status": "error" if error_msg else "success",
+        "seconds": round(time.monotonic() - start, 3),
+        "bytes": metrics.get("bytes", 0),
+        "cache": metrics.get("cache"),
+        "peak_rss_bytes": metrics.get("peak_rss_bytes", 0),
+    }
+    if metrics.get("decode"):
+        timing["decode"] = metrics["decode"]
+        timing["memory_bytes"] = metrics.get("memory_bytes", 0)
+    # 分段耗时: 下载 / base64 哈希与解码, 其余为交付 (/upload/image 或写入输入目录)
+    source_seconds = 0.0
+    for key in ("download_seconds", "hash_seconds", "decode_seconds"):
+        if key in metrics:
+            timing[key] = round(metrics[key], 3)
+            source_seconds += metrics[key]
+    if not error_msg:
+        timing["deliver_seconds"] = round(max(0.0, timing["seconds"] - source_seconds), 3)
+    if error_msg:
+        print(f"worker-comfyui - {error_msg}")
+    else:
+        print(f"worker-comfyui - Successfully uploaded {kind} {name} in {timing['seconds']:.2f}s")
+    return error_msg, timing
+
+
+def _run_staging(tasks):
+    """
+    Run (kind, item, upload_fn) tasks through a bounded thread pool.
+
+    Args:
+        tasks (list): A list of (kind, item, upload_fn) tuples.
+
+    Returns:
+        tuple: (responses, upload_errors, timings), each in task order.
+    """
+    responses = []
+    upload_errors = []
+    timings = []
+
+    workers = max(1, min(INPUT_STAGING_CONCURRENCY, len(tasks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stage") as pool:
+        futures = [pool.submit(_stage_input, kind, item, fn) for kind, item, fn in tasks]
+        for (kind, item, _), future in zip(tasks, futures):
+            error_msg, timing = future.result()
+            timings.append(timing)
+            if error_msg:
+                upload_errors.append(error_msg)
+            else:
+                responses.append(f"Successfully uploaded {item['name']}")
+
+    return responses, upload_errors, timings
+'''
+
+# 替换原有的 upload_images 函数 (handler 改为调用 stage_inputs, 不再保留逐类上传的入口)
+pattern = r'def upload_images\(images\):.*?return \{\s*"status": "success",\s*"message": "All images uploaded successfully",\s*"details": responses,\s*\}'
+content = re.sub(pattern, input_staging_helpers.strip(), content, flags=re.DOTALL)
+
+# ============================================================================
+# 3. 添加视频输入 与 并发输入暂存 stage_inputs
+# ============================================================================
+stage_inputs_code = '''
+
+def _upload_video_item(video):
+    """
+    Upload a single video (base64 encoded or URL) to ComfyUI.
+    Note: ComfyUI uses the same endpoint for videos as it does for images.
+    """
+    return _upload_media_item(video, "video", VIDEO_CONTENT_TYPES, "video/mp4", 300, 120)
+
+
+def stage_inputs(images, videos):
+    """
+    Download/decode and upload all input images and videos concurrently.
+
+    Every entry is staged through one bounded thread pool
+    (INPUT_STAGING_CONCURRENCY workers), so a job pays roughly the slowest
+    transfer instead of the sum of all of them.
+
+    Args:
+        images (list): Image entries from the job input, or None.
+        videos (list): Video entries from the job input, or None.
+
+    Returns:
+        dict: {"status", "message", "details", "timings"}.
+    """
+    tasks = [("image", image, _upload_image_item) for image in images or []]
+    tasks += [("video", video, _upload_video_item) for video in videos or []]
+
+    if not tasks:
+        return {"status": "success", "message": "No inputs to upload", "details": [], "timings": []}
+
+    print(
+        f"worker-comfyui - Staging {len(tasks)} input(s) with up to "
+        f"{min(INPUT_STAGING_CONCURRENCY, len(tasks))} concurrent transfer(s)..."
+    )
+    start = time.monotonic()
+    reset_input_memory_peak()
+    responses, upload_errors, timings = _run_staging(tasks)
+    elapsed = time.monotonic() - start
+    print(
+        f"worker-comfyui - Base64 decode memory: peak {input_memory_peak() / 1048576:.1f} MB "
+        f"of {INPUT_MEMORY_BUDGET_BYTES / 1048576:.0f} MB budget"
+    )
+
+    if upload_errors:
+        print(f"worker-comfyui - input staging finished with errors in {elapsed:.2f}s")
+        return {
+            "status": "error",
+            "message": "Some inputs failed to upload",
+            "details": upload_errors,
+            "timings": timings,
+        }
+
+    print(f"worker-comfyui - input staging complete in {elapsed:.2f}s")
+    if INPUT_CACHE_MAX_BYTES > 0:
+        print(f"worker-comfyui - Input cache: {input_cache_summary()}")
+    return {
+        "status": "success",
+        "message": "All inputs uploaded successfully",
+        "details": responses,
+        "timings": timings,
+    }
+'''
+
+# 在 _run_staging 之后添加 stage_inputs
+content = content.replace(
+    "    return responses, upload_errors, timings\n",
+    "    return responses, upload_errors, timings\n" + stage_inputs_code,
+    1,
+)
+
+# ============================================================================
+# 4. 修改 validate_input 函数
+# ============================================================================
+new_validate_input = '''def validate_input(job_input):
     """
     Validates the input for the handler function.
 
@@ -515,7 +1178,7 @@ content = re.sub(pattern, new_validate_input.strip(), content, flags=re.DOTALL)
 # 5. 修改 handler 函数以支持 videos 和 OSS 上传
 # ============================================================================
 
-# 5.1 在图片上传之后添加视频上传逻辑
+# 5.1 将图片/视频上传替换为并发暂存 (stage_inputs)
 old_upload_pattern = r'''(# Upload input images if they exist
     if input_images:
         upload_result = upload_images\(input_images\)
@@ -526,143 +1189,42 @@ old_upload_pattern = r'''(# Upload input images if they exist
                 "details": upload_result\["details"\],
             \})'''
 
-new_upload_code = '''# Upload input images if they exist
-    if input_images:
-        upload_result = upload_images(input_images)
+new_upload_code = '''# Stage input images and videos concurrently
+    input_videos = validated_data.get("videos")
+    if input_images or input_videos:
+        upload_result = stage_inputs(input_images, input_videos)
         if upload_result["status"] == "error":
             # Return upload errors
             return {
-                "error": "Failed to upload one or more input images",
+                "error": "Failed to upload one or more input images/videos",
                 "details": upload_result["details"],
             }
 
-    # Upload input videos if they exist
-    input_videos = validated_data.get("videos")
-    if input_videos:
-        upload_result = upload_videos(input_videos)
-        if upload_result["status"] == "error":
-            # Return upload errors
-            return {
-                "error": "Failed to upload one or more input videos",
-                "details": upload_result["details"],
-            }'''
+    # Check limits and normalise inputs before any GPU time is spent
+    normalize_result = normalize_inputs(workflow, input_images, input_videos)
+    if normalize_result["status"] == "error":
+        return {
+            "error": "Request rejected by input limits",
+            "details": normalize_result["details"],
+        }
+
+    # Snap width/height/frame count to shared shapes for compiled-kernel reuse
+    apply_shape_buckets(workflow)'''
 
 content = re.sub(old_upload_pattern, new_upload_code, content)
 
-# 5.2 修改输出处理部分以使用 OSS
-# 找到输出处理部分并替换为 OSS 上传逻辑
-old_output_pattern = r'''if os\.environ\.get\("BUCKET_ENDPOINT_URL"\):
-                            try:
-                                with tempfile\.NamedTemporaryFile\(
-                                    suffix=file_extension, delete=False
-                                \) as temp_file:
-                                    temp_file\.write\(image_bytes\)
-                                    temp_file_path = temp_file\.name
-                                print\(
-                                    f"worker-comfyui - Wrote image bytes to temporary file: \{temp_file_path\}"
-                                \)
-
-                                print\(f"worker-comfyui - Uploading \{filename\} to S3\.\.\."\)
-                                s3_url = rp_upload\.upload_image\(job_id, temp_file_path\)
-                                os\.remove\(temp_file_path\)  # Clean up temp file
-                                print\(
-                                    f"worker-comfyui - Uploaded \{filename\} to S3: \{s3_url\}"
-                                \)
-                                # Append dictionary with filename and URL
-                                output_data\.append\(
-                                    \{
-                                        "filename": filename,
-                                        "type": "s3_url",
-                                        "data": s3_url,
-                                    \}
-                                \)
-                            except Exception as e:
-                                error_msg = f"Error uploading \{filename\} to S3: \{e\}"
-                                print\(f"worker-comfyui - \{error_msg\}"\)
-                                errors\.append\(error_msg\)
-                                if "temp_file_path" in locals\(\) and os\.path\.exists\(
-                                    temp_file_path
-                                \):
-                                    try:
-                                        os\.remove\(temp_file_path\)
-                                    except OSError as rm_err:
-                                        print\(
-                                            f"worker-comfyui - Error removing temp file \{temp_file_path\}: \{rm_err\}"
-                                        \)'''
-
-new_output_code = '''# Try OSS upload first, then fall back to S3, then base64
-                        oss_client = get_oss_client()
-                        if oss_client:
-                            try:
-                                # Determine content type
-                                ext = os.path.splitext(filename)[1].lower()
-                                content_type_map = {
-                                    '.png': 'image/png',
-                                    '.jpg': 'image/jpeg',
-                                    '.jpeg': 'image/jpeg',
-                                    '.gif': 'image/gif',
-                                    '.webp': 'image/webp',
-                                    '.mp4': 'video/mp4',
-                                    '.webm': 'video/webm',
-                                    '.mov': 'video/quicktime',
-                                }
-                                content_type = content_type_map.get(ext, 'application/octet-stream')
-
-                                print(f"worker-comfyui - Uploading {filename} to OSS...")
-                                oss_url = upload_to_oss(image_bytes, filename, job_id, content_type)
-                                if oss_url:
-                                    print(f"worker-comfyui - Uploaded {filename} to OSS: {oss_url}")
-                                    output_data.append({
-                                        "filename": filename,
-                                        "type": "oss_url",
-                                        "data": oss_url,
-                                    })
-                                else:
-                                    raise Exception("OSS upload returned None")
-                            except Exception as e:
-                                error_msg = f"Error uploading {filename} to OSS: {e}"
-                                print(f"worker-comfyui - {error_msg}")
-                                errors.append(error_msg)
-                        elif os.environ.get("BUCKET_ENDPOINT_URL"):
-                            try:
-                                with tempfile.NamedTemporaryFile(
-                                    suffix=file_extension, delete=False
-                                ) as temp_file:
-                                    temp_file.write(image_bytes)
-                                    temp_file_path = temp_file.name
-                                print(
-                                    f"worker-comfyui - Wrote image bytes to temporary file: {temp_file_path}"
-                                )
-
-                                print(f"worker-comfyui - Uploading {filename} to S3...")
-                                s3_url = rp_upload.upload_image(job_id, temp_file_path)
-                                os.remove(temp_file_path)  # Clean up temp file
-                                print(
-                                    f"worker-comfyui - Uploaded {filename} to S3: {s3_url}"
-                                )
-                                # Append dictionary with filename and URL
-                                output_data.append(
-                                    {
-                                        "filename": filename,
-                                        "type": "s3_url",
-                                        "data": s3_url,
-                                    }
-                                )
-                            except Exception as e:
-                                error_msg = f"Error uploading {filename} to S3: {e}"
-                                print(f"worker-comfyui - {error_msg}")
-                                errors.append(error_msg)
-                                if "temp_file_path" in locals() and os.path.exists(
-                                    temp_file_path
-                                ):
-                                    try:
-                                        os.remove(temp_file_path)
-                                    except OSError as rm_err:
-                                        print(
-                                            f"worker-comfyui - Error removing temp file {temp_file_path}: {rm_err}"
-                                        )'''
-
-content = re.sub(old_output_pattern, new_output_code, content, flags=re.DOTALL)
+# 5.2 将输出处理循环替换为流水线 collect_outputs (读取与 OSS/S3 上传重叠进行)
+old_output_pattern = r'''print\(f"worker-comfyui - Processing \{len\(outputs\)\} output nodes\.\.\."\)
+        for node_id, node_output in outputs\.items\(\):
+.*?adding support\."
+                \)
+'''
+
+new_output_code = '''print(f"worker-comfyui - Processing {len(outputs)} output nodes...")
+        output_data.extend(finish_output_collection(output_collection, outputs, errors))
+'''
+
+content = re.sub(old_output_pattern, lambda m: new_output_code, content, count=1, flags=re.DOTALL)
 
 # ============================================================================
 # 6. 添加 alibabacloud_oss_v2 到导入 (在文件头部)
@@ -671,6 +1233,2951 @@ content = re.sub(old_output_pattern, new_output_code, content, flags=re.DOTALL)
 if 'import alibabacloud_oss_v2' not in content:
     content = content.replace('import traceback', 'import traceback\nimport alibabacloud_oss_v2 as oss\nfrom datetime import datetime')
 
+# ============================================================================
+# 7. 添加内容寻址的本地输入缓存 (LRU 淘汰)
+# ============================================================================
+input_cache_code = '''
+# Content-addressed input cache
+# URL inputs are keyed by URL + ETag/Last-Modified, base64 inputs by content hash.
+import shutil
+from collections import OrderedDict
+
+INPUT_CACHE_DIR = os.environ.get("INPUT_CACHE_DIR", "/tmp/comfyui-input-cache")
+# Byte budget for the cache; 0 disables it
+INPUT_CACHE_MAX_BYTES = int(os.environ.get("INPUT_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+# ComfyUI's input directory, used to confirm a cached input is still in place
+COMFY_INPUT_DIR = os.environ.get("COMFY_INPUT_DIR", "/comfyui/input")
+
+_input_cache_lock = threading.Lock()
+# cache key -> size in bytes, least recently used first
+_input_cache_entries = None
+_input_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+# ComfyUI input name -> cache key of the content last staged under that name
+_placed_inputs = {}
+
+
+def _load_input_cache():
+    """
+    Build the in-memory LRU index from the cache directory. Must hold _input_cache_lock.
+
+    File mtimes carry the LRU order across worker restarts; leftover
+    temporary files from interrupted writes are removed.
+
+    Returns:
+        OrderedDict: cache key -> size in bytes, least recently used first.
+    """
+    global _input_cache_entries
+
+    if _input_cache_entries is not None:
+        return _input_cache_entries
+
+    os.makedirs(INPUT_CACHE_DIR, exist_ok=True)
+    found = []
+    for entry in os.scandir(INPUT_CACHE_DIR):
+        if not entry.is_file():
+            continue
+        if entry.name.startswith(".tmp-"):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+            continue
+        st = entry.stat()
+        found.append((st.st_mtime, entry.name, st.st_size))
+
+    _input_cache_entries = OrderedDict((key, size) for _, key, size in sorted(found))
+    print(
+        f"worker-comfyui - Input cache at {INPUT_CACHE_DIR}: {len(_input_cache_entries)} entries, "
+        f"{sum(_input_cache_entries.values()) / 1048576:.1f} MB"
+    )
+    return _input_cache_entries
+
+
+def url_cache_key(url, headers):
+    """
+    Build the cache key for a URL input from its response headers.
+
+    Args:
+        url (str): The input URL.
+        headers (Mapping): Response headers of the GET request.
+
+    Returns:
+        str: The cache key, or None if caching is disabled or the server
+             sent neither ETag nor Last-Modified.
+    """
+    if INPUT_CACHE_MAX_BYTES <= 0:
+        return None
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+    if not etag and not last_modified:
+        return None
+    return hashlib.sha256(f"url\\n{url}\\n{etag or ''}\\n{last_modified or ''}".encode("utf-8")).hexdigest()
+
+
+def base64_cache_key(data, start=0):
+    """
+    Build the cache key for a base64 input from a hash of its payload.
+
+    The payload is hashed in slices so no full-size bytes copy is made.
+
+    Args:
+        data (str): The base64 input, possibly with a Data URI prefix.
+        start (int): Offset of the payload in data.
+
+    Returns:
+        str: The cache key, or None if caching is disabled.
+    """
+    if INPUT_CACHE_MAX_BYTES <= 0:
+        return None
+    digest = hashlib.sha256(b"base64\\n")
+    for i in range(start, len(data), INPUT_STREAM_CHUNK_BYTES):
+        digest.update(data[i:i + INPUT_STREAM_CHUNK_BYTES].encode("ascii", "ignore"))
+    return digest.hexdigest()
+
+
+def input_cache_lookup(key):
+    """
+    Look up a cache entry and mark it most recently used.
+
+    Args:
+        key (str): The cache key.
+
+    Returns:
+        str: Path of the cached file, or None on a miss.
+    """
+    path = os.path.join(INPUT_CACHE_DIR, key)
+    with _input_cache_lock:
+        entries = _load_input_cache()
+        if key not in entries or not os.path.exists(path):
+            entries.pop(key, None)
+            _input_cache_stats["misses"] += 1
+            return None
+        entries.move_to_end(key)
+        _input_cache_stats["hits"] += 1
+
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return path
+
+
+def input_cache_open(key):
+    """
+    Open a temporary file in the cache directory for a new entry.
+
+    Args:
+        key (str): The cache key the file will be committed under.
+
+    Returns:
+        file: A binary file object, to be passed to input_cache_commit or input_cache_discard.
+    """
+    os.makedirs(INPUT_CACHE_DIR, exist_ok=True)
+    tmp_path = os.path.join(INPUT_CACHE_DIR, f".tmp-{key}-{uuid.uuid4().hex}")
+    return open(tmp_path, "wb")
+
+
+def input_cache_discard(cache_file):
+    """Close and remove a temporary cache file that will not be committed."""
+    cache_file.close()
+    try:
+        os.remove(cache_file.name)
+    except OSError:
+        pass
+
+
+def input_cache_commit(key, cache_file):
+    """
+    Atomically publish a written cache entry and evict LRU entries over budget.
+
+    Args:
+        key (str): The cache key.
+        cache_file (file): The file returned by input_cache_open.
+
+    Returns:
+        str: Path of the committed entry, or None if it is larger than the whole budget.
+    """
+    cache_file.close()
+    size = os.path.getsize(cache_file.name)
+    if size > INPUT_CACHE_MAX_BYTES:
+        os.remove(cache_file.name)
+        return None
+
+    path = os.path.join(INPUT_CACHE_DIR, key)
+    os.replace(cache_file.name, path)
+
+    with _input_cache_lock:
+        entries = _load_input_cache()
+        entries[key] = size
+        entries.move_to_end(key)
+        total = sum(entries.values())
+        while total > INPUT_CACHE_MAX_BYTES and len(entries) > 1:
+            old_key, old_size = entries.popitem(last=False)
+            try:
+                os.remove(os.path.join(INPUT_CACHE_DIR, old_key))
+            except OSError:
+                pass
+            total -= old_size
+            _input_cache_stats["evictions"] += 1
+    return path
+
+
+def mark_input_placed(name, key):
+    """Record which cache entry (or None) is now stored in ComfyUI under name."""
+    with _input_cache_lock:
+        if key:
+            _placed_inputs[name] = key
+        else:
+            _placed_inputs.pop(name, None)
+
+
+def _input_already_placed(name, key, size):
+    """Return True if ComfyUI's input directory already holds this entry under name."""
+    with _input_cache_lock:
+        if _placed_inputs.get(name) != key:
+            return False
+    try:
+        return os.path.getsize(comfy_input_path(name)) == size
+    except (OSError, ValueError):
+        return False
+
+
+def stage_cached_input(key, name, content_type, metrics, timeout):
+    """
+    Stage an input from the cache, skipping the download.
+
+    If ComfyUI already holds the same entry under the same name the upload is
+    skipped as well; otherwise the cached file is streamed to /upload/image.
+
+    Args:
+        key (str): The cache key.
+        name (str): The filename ComfyUI should store the input under.
+        content_type (str): The content type of the file part.
+        metrics (dict): Transfer metrics, updated in place.
+        timeout (int): Upload request timeout in seconds.
+
+    Returns:
+        bool: True on a cache hit, False on a miss.
+    """
+    path = input_cache_lookup(key)
+    if not path:
+        return False
+
+    metrics["cache"] = "hit"
+    size = os.path.getsize(path)
+    if _input_already_placed(name, key, size):
+        print(f"worker-comfyui - Input cache hit for {name}, already in ComfyUI input dir")
+        return True
+
+    print(f"worker-comfyui - Input cache hit for {name}, staging cached copy")
+    deliver_input_from_path(name, content_type, path, metrics, timeout)
+    mark_input_placed(name, key)
+    return True
+
+
+def input_cache_summary():
+    """Return a one-line summary of the cache counters for logging."""
+    with _input_cache_lock:
+        stats = dict(_input_cache_stats)
+        used = sum(_input_cache_entries.values()) if _input_cache_entries else 0
+    return (
+        f"{stats['hits']} hit(s), {stats['misses']} miss(es), {stats['evictions']} eviction(s), "
+        f"{used / 1048576:.1f}/{INPUT_CACHE_MAX_BYTES / 1048576:.0f} MB used"
+    )
+
+'''
+
+# 在 validate_input 之前插入输入缓存
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    input_cache_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# ============================================================================
+# 8. 同容器部署时直接写入 ComfyUI 输入目录, 绕过 /upload/image 回环上传
+# ============================================================================
+direct_placement_code = '''
+# Input placement: 'auto' writes straight into COMFY_INPUT_DIR when ComfyUI runs
+# in this container, 'direct' always does, 'http' always uses /upload/image.
+INPUT_PLACEMENT = os.environ.get("INPUT_PLACEMENT", "auto").lower()
+
+_LOCAL_COMFY_HOSTS = ("127.0.0.1", "localhost", "0.0.0.0", "::1")
+_direct_placement = None
+
+
+def direct_placement_enabled():
+    """
+    Decide (once per worker) whether inputs are written straight to disk.
+
+    Returns:
+        bool: True if inputs go directly into COMFY_INPUT_DIR.
+    """
+    global _direct_placement
+
+    if _direct_placement is None:
+        host = COMFY_HOST.rsplit(":", 1)[0].strip("[]")
+        writable = os.path.isdir(COMFY_INPUT_DIR) and os.access(COMFY_INPUT_DIR, os.W_OK)
+        if INPUT_PLACEMENT == "http":
+            _direct_placement = False
+        elif INPUT_PLACEMENT == "direct":
+            _direct_placement = True
+        else:
+            _direct_placement = host in _LOCAL_COMFY_HOSTS and writable
+        mode = f"direct to {COMFY_INPUT_DIR}" if _direct_placement else "HTTP /upload/image"
+        print(f"worker-comfyui - Input placement: {mode}")
+    return _direct_placement
+
+
+def comfy_input_path(name):
+    """
+    Resolve an input name to its path inside COMFY_INPUT_DIR.
+
+    Raises:
+        ValueError: If the name would escape the input directory.
+    """
+    base = os.path.abspath(COMFY_INPUT_DIR)
+    path = os.path.abspath(os.path.join(base, name))
+    if path == base or os.path.commonpath([base, path]) != base:
+        raise ValueError(f"Invalid input name: {name}")
+    return path
+
+
+def _placement_tmp_path(path):
+    """Return a hidden temporary path next to path for an atomic rename."""
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp-{uuid.uuid4().hex}")
+
+
+def place_input_file(name, chunks, metrics):
+    """
+    Write chunks to a temporary file next to the target and rename it into place.
+
+    The rename is atomic, so LoadImage/VHS_LoadVideoFFmpeg never see a partial file.
+
+    Args:
+        name (str): The filename inside COMFY_INPUT_DIR.
+        chunks (iterable): Iterable of bytes chunks making up the file.
+        metrics (dict): Transfer metrics, updated in place.
+    """
+    path = comfy_input_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _placement_tmp_path(path)
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in _count_chunks(chunks, metrics):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    metrics["placement"] = "direct"
+
+
+def place_input_from_path(name, src_path, metrics):
+    """
+    Place an existing local file into COMFY_INPUT_DIR under name.
+
+    A hard link is used when source and target share a filesystem (no data
+    copy at all), otherwise the file is copied; either way the last step is
+    an atomic rename.
+
+    Args:
+        name (str): The filename inside COMFY_INPUT_DIR.
+        src_path (str): The local file to place.
+        metrics (dict): Transfer metrics, updated in place.
+    """
+    path = comfy_input_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _placement_tmp_path(path)
+    try:
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    metrics["placement"] = "direct"
+
+
+def deliver_input(name, content_type, chunks, metrics, timeout):
+    """
+    Hand an input to ComfyUI: on disk when co-located, otherwise over HTTP.
+
+    Args:
+        name (str): The filename ComfyUI should store the input under.
+        content_type (str): The content type (used for the HTTP upload).
+        chunks (iterable): Iterable of bytes chunks making up the file.
+        metrics (dict): Transfer metrics, updated in place.
+        timeout (int): Upload request timeout in seconds.
+    """
+    if direct_placement_enabled():
+        place_input_file(name, chunks, metrics)
+    else:
+        _post_stream_to_comfy(name, content_type, chunks, metrics, timeout)
+        metrics["placement"] = "http"
+
+
+def deliver_input_from_path(name, content_type, path, metrics, timeout):
+    """
+    Hand a local file to ComfyUI: linked into place when co-located, otherwise streamed over HTTP.
+
+    Args:
+        name (str): The filename ComfyUI should store the input under.
+        content_type (str): The content type (used for the HTTP upload).
+        path (str): The local file.
+        metrics (dict): Transfer metrics, updated in place.
+        timeout (int): Upload request timeout in seconds.
+    """
+    if direct_placement_enabled():
+        place_input_from_path(name, path, metrics)
+    else:
+        _post_stream_to_comfy(name, content_type, _iter_file_chunks(path), metrics, timeout)
+        metrics["placement"] = "http"
+
+'''
+
+# 在 validate_input 之前插入直接写盘逻辑
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    direct_placement_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# ============================================================================
+# 9. 输出流水线: 读取下一个输出的同时上传之前的输出
+# ============================================================================
+output_pipeline_code = '''
+# Output pipeline: files are fetched from ComfyUI on the handler thread and
+# uploaded on a bounded pool, so reading the next output overlaps the uploads.
+OUTPUT_UPLOAD_CONCURRENCY = int(os.environ.get("OUTPUT_UPLOAD_CONCURRENCY", 3))
+
+# History keys that carry files: SaveImage/SaveVideo use "images",
+# VHS_VideoCombine uses "gifs"
+OUTPUT_MEDIA_KEYS = ("images", "gifs")
+
+# Output source: 'auto' reads files straight from ComfyUI's output directory when
+# ComfyUI runs in this container, 'disk' always does, 'http' always uses /view.
+OUTPUT_READ_MODE = os.environ.get("OUTPUT_READ_MODE", "auto").lower()
+COMFY_OUTPUT_DIR = os.environ.get("COMFY_OUTPUT_DIR", "/comfyui/output")
+
+OUTPUT_CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".mov": "video/quicktime",
+}
+
+
+def _iter_output_files(outputs, errors, quiet=False):
+    """
+    Yield every output file that should be returned, in history order.
+
+    Temp files are skipped, entries without a filename are reported in errors.
+
+    Args:
+        outputs (dict): The "outputs" section of the prompt history.
+        errors (list): Error list to append warnings to.
+        quiet (bool): Skip the per-node log lines.
+
+    Yields:
+        tuple: (node_id, file_info) where file_info is the history entry
+            (filename, subfolder, type) of one file.
+    """
+    for node_id, node_output in outputs.items():
+        for key in OUTPUT_MEDIA_KEYS:
+            files = node_output.get(key) or []
+            if files and not quiet:
+                print(f"worker-comfyui - Node {node_id} contains {len(files)} {key} file(s)")
+            for file_info in files:
+                filename = file_info.get("filename")
+
+                # skip temp images
+                if file_info.get("type") == "temp":
+                    if not quiet:
+                        print(f"worker-comfyui - Skipping image {filename} because type is 'temp'")
+                    continue
+
+                if not filename:
+                    warn_msg = f"Skipping image in node {node_id} due to missing filename: {file_info}"
+                    errors.append(warn_msg)
+                    if not quiet:
+                        print(f"worker-comfyui - {warn_msg}")
+                    continue
+
+                yield node_id, file_info
+
+        # Check for other output types
+        other_keys = [k for k in node_output.keys() if k not in OUTPUT_MEDIA_KEYS]
+        if other_keys and not quiet:
+            warn_msg = f"Node {node_id} produced unhandled output keys: {other_keys}."
+            print(f"worker-comfyui - WARNING: {warn_msg}")
+
+
+def comfy_output_path(file_info):
+    """
+    Resolve a history file entry to the file ComfyUI wrote on disk.
+
+    Args:
+        file_info (dict): The history entry (filename, subfolder, type).
+
+    Returns:
+        str: The local path, or None if the file should be fetched over /view.
+    """
+    if OUTPUT_READ_MODE == "http":
+        return None
+    if OUTPUT_READ_MODE != "disk" and COMFY_HOST.rsplit(":", 1)[0].strip("[]") not in _LOCAL_COMFY_HOSTS:
+        return None
+
+    base_dir = {
+        "output": COMFY_OUTPUT_DIR,
+        "input": COMFY_INPUT_DIR,
+    }.get(file_info.get("type"))
+    if not base_dir:
+        return None
+
+    base = os.path.abspath(base_dir)
+    path = os.path.abspath(os.path.join(base, file_info.get("subfolder") or "", file_info["filename"]))
+    if os.path.commonpath([base, path]) != base or not os.path.isfile(path):
+        return None
+    return path
+
+
+def _store_output(filename, job_id, file_bytes=None, file_path=None):
+    """
+    Store one output file: OSS first, then S3 (BUCKET_ENDPOINT_URL), then base64.
+
+    Exactly one of file_bytes and file_path is given. Files on disk are
+    streamed to OSS/S3 directly; they are only read into memory for base64.
+
+    Args:
+        filename (str): The output filename.
+        job_id (str): The job ID, used in the object key.
+        file_bytes (bytes, optional): The file content fetched over /view.
+        file_path (str, optional): The file's path in ComfyUI's output directory.
+
+    Returns:
+        tuple: (entry, error_msg). entry is the output_data dict with its
+            "upload_seconds", or None when error_msg is set.
+    """
+    start = time.time()
+    file_extension = os.path.splitext(filename)[1] or ".png"
+
+    if get_oss_client():
+        try:
+            content_type = OUTPUT_CONTENT_TYPES.get(file_extension.lower(), "application/octet-stream")
+            print(f"worker-comfyui - Uploading {filename} to OSS...")
+            if file_path:
+                oss_url = upload_file_to_oss(file_path, filename, job_id, content_type)
+            else:
+                oss_url = upload_to_oss(file_bytes, filename, job_id, content_type)
+            if not oss_url:
+                raise Exception("OSS upload returned None")
+            print(f"worker-comfyui - Uploaded {filename} to OSS: {oss_url}")
+            entry = {"filename": filename, "type": "oss_url", "data": oss_url}
+        except Exception as e:
+            return None, f"Error uploading {filename} to OSS: {e}"
+    elif os.environ.get("BUCKET_ENDPOINT_URL"):
+        temp_file_path = None
+        try:
+            if file_path:
+                # upload_file_to_bucket streams the file with boto's managed transfer;
+                # the key mirrors upload_image's {job_id}/{random}{ext} layout
+                print(f"worker-comfyui - Uploading {filename} to S3 from {file_path}...")
+                s3_url = rp_upload.upload_file_to_bucket(
+                    file_name=f"{uuid.uuid4().hex[:8]}{file_extension}",
+                    file_location=file_path,
+                    prefix=job_id,
+                )
+            else:
+                with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_file:
+                    temp_file.write(file_bytes)
+                    temp_file_path = temp_file.name
+                print(f"worker-comfyui - Uploading {filename} to S3...")
+                s3_url = rp_upload.upload_image(job_id, temp_file_path)
+            print(f"worker-comfyui - Uploaded {filename} to S3: {s3_url}")
+            entry = {"filename": filename, "type": "s3_url", "data": s3_url}
+        except Exception as e:
+            return None, f"Error uploading {filename} to S3: {e}"
+        finally:
+            if temp_file_path and os.path.exists(temp_file_path):
+                try:
+                    os.remove(temp_file_path)
+                except OSError as rm_err:
+                    print(f"worker-comfyui - Error removing temp file {temp_file_path}: {rm_err}")
+    else:
+        try:
+            if file_path:
+                with open(file_path, "rb") as f:
+                    file_bytes = f.read()
+            entry = {
+                "filename": filename,
+                "type": "base64",
+                "data": base64.b64encode(file_bytes).decode("utf-8"),
+            }
+            print(f"worker-comfyui - Encoded {filename} as base64")
+        except Exception as e:
+            return None, f"Error encoding {filename} to base64: {e}"
+
+    entry["upload_seconds"] = round(time.time() - start, 3)
+    return entry, None
+
+
+def begin_output_collection(job_id, selector=None, skipped=None):
+    """
+    Start collecting a job's outputs.
+
+    Files can be submitted while the workflow is still running (from the
+    websocket "executed" events) and again from the final history; each file
+    is uploaded once.
+
+    Args:
+        job_id (str): The job ID.
+        selector (dict, optional): Output selector from validate_input(); files
+            it does not select are never read or uploaded.
+        skipped (list, optional): List that unselected files are recorded in.
+
+    Returns:
+        dict: The collection state passed to submit_node_outputs() and
+            finish_output_collection().
+    """
+    concurrency = max(1, OUTPUT_UPLOAD_CONCURRENCY)
+    return {
+        "job_id": job_id,
+        "pool": ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="output-upload"),
+        "slots": threading.BoundedSemaphore(concurrency + 1),
+        "submitted": {},
+        "start": time.time(),
+        "selector": selector,
+        "skipped": skipped if skipped is not None else [],
+    }
+
+
+def _selected_output_files(collection, files):
+    """Filter (node_id, file_info) pairs by the collection's output selector, recording the rest once."""
+    for node_id, file_info in files:
+        if output_selected(collection["selector"], node_id, file_info):
+            yield node_id, file_info
+            continue
+        entry = {"node_id": node_id, "filename": file_info.get("filename"), "reason": "not selected"}
+        if entry not in collection["skipped"]:
+            print(f"worker-comfyui - Skipping {entry['filename']} from node {node_id}: not selected")
+            collection["skipped"].append(entry)
+
+
+def _submit_output_file(collection, node_id, file_info):
+    """
+    Hand one output file to the upload pool unless it was already submitted.
+
+    Files in ComfyUI's output directory are streamed from disk; others are
+    fetched over /view on the calling thread, and at most
+    OUTPUT_UPLOAD_CONCURRENCY + 1 of those are held in memory at once.
+
+    Returns:
+        tuple: The file's key in collection["submitted"].
+    """
+    filename = file_info.get("filename")
+    key = (file_info.get("type"), file_info.get("subfolder", ""), filename)
+    if key in collection["submitted"]:
+        return key
+
+    job_id = collection["job_id"]
+    slots = collection["slots"]
+
+    def upload(file_bytes=None, file_path=None):
+        try:
+            entry, error_msg = _store_output(filename, job_id, file_bytes=file_bytes, file_path=file_path)
+            if entry:
+                publish_output(job_id, node_id, entry)
+            return entry, error_msg
+        finally:
+            slots.release()
+
+    slots.acquire()
+    file_path = comfy_output_path(file_info)
+    if file_path:
+        print(f"worker-comfyui - Reading {filename} from disk: {file_path}")
+        collection["submitted"][key] = (collection["pool"].submit(upload, file_path=file_path), None)
+        return key
+
+    fetch_start = time.time()
+    file_bytes = get_image_data(filename, file_info.get("subfolder", ""), file_info.get("type"))
+    if not file_bytes:
+        slots.release()
+        collection["submitted"][key] = (None, f"Failed to fetch image data for {filename} from /view endpoint.")
+        return key
+    print(f"worker-comfyui - Fetched {filename} ({len(file_bytes) / 1048576:.1f} MB) in {time.time() - fetch_start:.2f}s")
+    collection["submitted"][key] = (collection["pool"].submit(upload, file_bytes), None)
+    return key
+
+
+def submit_node_outputs(collection, node_id, node_output):
+    """
+    Start uploading a node's files as soon as ComfyUI reports it executed.
+
+    Warnings about skipped files are left to finish_output_collection(),
+    which walks the full history.
+
+    Args:
+        collection (dict): State from begin_output_collection().
+        node_id (str): The node that finished.
+        node_output (dict): The "output" payload of the "executed" event.
+    """
+    files = _iter_output_files({node_id: node_output}, [], quiet=True)
+    for node_id, file_info in _selected_output_files(collection, files):
+        _submit_output_file(collection, node_id, file_info)
+
+
+def finish_output_collection(collection, outputs, errors):
+    """
+    Submit any remaining history outputs and wait for every upload.
+
+    Args:
+        collection (dict): State from begin_output_collection().
+        outputs (dict): The "outputs" section of the prompt history.
+        errors (list): Error list; fetch and upload failures are appended in order.
+
+    Returns:
+        list: The output_data entries, in history order (files reported only
+            by "executed" events come last).
+    """
+    try:
+        order = [
+            _submit_output_file(collection, node_id, file_info)
+            for node_id, file_info in _selected_output_files(collection, _iter_output_files(outputs, errors))
+        ]
+        order += [key for key in collection["submitted"] if key not in order]
+
+        output_data = []
+        for key in order:
+            future, error_msg = collection["submitted"][key]
+            entry, error_msg = future.result() if future else (None, error_msg)
+            if error_msg:
+                print(f"worker-comfyui - {error_msg}")
+                errors.append(error_msg)
+                continue
+            print(f"worker-comfyui - Stored {entry['filename']} ({entry['type']}) in {entry['upload_seconds']:.2f}s")
+            output_data.append(entry)
+    finally:
+        collection["pool"].shutdown(wait=True)
+
+    print(f"worker-comfyui - Collected {len(output_data)} output file(s) in {time.time() - collection['start']:.2f}s")
+    return output_data
+
+
+def collect_outputs(outputs, job_id, errors):
+    """
+    Fetch and store all output files, overlapping reads with uploads.
+
+    Args:
+        outputs (dict): The "outputs" section of the prompt history.
+        job_id (str): The job ID.
+        errors (list): Error list; fetch and upload failures are appended in order.
+
+    Returns:
+        list: The output_data entries, in history order.
+    """
+    return finish_output_collection(begin_output_collection(job_id), outputs, errors)
+
+
+# Streaming mode: STREAM_OUTPUTS=true starts the worker with stream_handler, a
+# generator that yields each output as soon as it is stored.
+STREAM_OUTPUTS = os.environ.get("STREAM_OUTPUTS", "false").lower() == "true"
+
+_output_streams = {}
+_STREAM_END = object()
+
+
+def publish_output(job_id, node_id, entry):
+    """Send a stored output to the job's stream, if the job is being streamed."""
+    stream = _output_streams.get(job_id)
+    if stream is not None:
+        stream.put({"type": "output", "node_id": node_id, "output": entry})
+
+
+def stream_handler(job):
+    """
+    Generator variant of handler() for RunPod streaming.
+
+    Runs handler() on a worker thread and yields one partial result per
+    output file the moment it has been uploaded (preview VHS_VideoCombine
+    files arrive before the final SaveVideo result), then a final summary
+    with the same content handler() would have returned.
+
+    Args:
+        job (dict): The RunPod job.
+
+    Yields:
+        dict: {"type": "output", "node_id": ..., "output": <output_data entry>}
+            per file, then {"type": "summary", "result": <handler result>}.
+    """
+    job_id = job["id"]
+    stream = queue.Queue()
+    _output_streams[job_id] = stream
+    result = {}
+
+    def run():
+        try:
+            result["value"] = handler(job)
+        except Exception as e:
+            print(f"worker-comfyui - Unexpected Handler Error: {e}")
+            result["value"] = {"error": f"An unexpected error occurred: {e}"}
+        finally:
+            stream.put(_STREAM_END)
+
+    threading.Thread(target=run, name=f"job-{job_id}", daemon=True).start()
+    try:
+        while True:
+            item = stream.get()
+            if item is _STREAM_END:
+                break
+            print(f"worker-comfyui - Streaming output {item['output']['filename']} from node {item['node_id']}")
+            yield item
+    finally:
+        _output_streams.pop(job_id, None)
+
+    yield {"type": "summary", "result": result.get("value")}
+
+'''
+
+# 在 validate_input 之前插入输出流水线
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    output_pipeline_code + "\ndef validate_input(job_input):",
+    1,
+)
+if "import queue\n" not in content:
+    content = content.replace("import traceback\n", "import traceback\nimport queue\n", 1)
+
+# 在等待执行前创建输出收集状态, 节点执行完成 ("executed" 事件) 后立即开始上传其输出
+content = content.replace(
+    "        execution_done = False\n        while True:\n",
+    "        execution_done = False\n"
+    "        output_collection = begin_output_collection(job_id)\n"
+    "        while True:\n",
+    1,
+)
+content = content.replace(
+    '''                    elif message.get("type") == "execution_error":''',
+    '''                    elif message.get("type") == "executed":
+                        data = message.get("data", {})
+                        if data.get("prompt_id") == prompt_id and data.get("output"):
+                            submit_node_outputs(output_collection, data.get("node"), data["output"])
+                    elif message.get("type") == "execution_error":''',
+    1,
+)
+content = content.replace(
+    "    output_data = []\n    errors = []\n",
+    "    output_data = []\n    errors = []\n    output_collection = None\n",
+    1,
+)
+content = content.replace(
+    "    finally:\n        if ws and ws.connected:\n",
+    "    finally:\n"
+    "        if output_collection:\n"
+    "            output_collection[\"pool\"].shutdown(wait=False)\n"
+    "        if ws and ws.connected:\n",
+    1,
+)
+
+# STREAM_OUTPUTS=true 时以生成器 handler 启动, 每个输出上传完成即返回
+content = content.replace(
+    '    runpod.serverless.start({"handler": handler})',
+    '    if STREAM_OUTPUTS:\n'
+    '        runpod.serverless.start({"handler": stream_handler, "return_aggregate_stream": True})\n'
+    '    else:\n'
+    '        runpod.serverless.start({"handler": handler})',
+    1,
+)
+
+# ============================================================================
+# 10. worker 启动时预热 OSS client
+# ============================================================================
+content = content.replace(
+    'print("worker-comfyui - Starting handler...")',
+    'print("worker-comfyui - Starting handler...")\n    start_oss_prewarm()',
+    1,
+)
+
+# ============================================================================
+# 11. ComfyUI 回环请求统一走共享连接池 (requests.Session), 并统计每个 job 新建的连接数
+# ============================================================================
+comfy_session_code = '''
+# Shared HTTP session for all loopback calls to ComfyUI
+# - COMFY_HTTP_POOL_SIZE: keep-alive connections kept per host
+# - COMFY_HTTP_RETRIES / COMFY_HTTP_BACKOFF: retries for connection errors and
+#   502/503/504 on idempotent requests (POST /prompt is never retried)
+COMFY_HTTP_POOL_SIZE = int(os.environ.get("COMFY_HTTP_POOL_SIZE", 16))
+COMFY_HTTP_RETRIES = int(os.environ.get("COMFY_HTTP_RETRIES", 3))
+COMFY_HTTP_BACKOFF = float(os.environ.get("COMFY_HTTP_BACKOFF", 0.2))
+
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_comfy_sessions = {}
+_comfy_sessions_lock = threading.Lock()
+_comfy_connections_opened = 0
+
+
+class _CountingHTTPConnection(urllib3.connection.HTTPConnection):
+    """HTTPConnection that counts every TCP connection it opens."""
+
+    def connect(self):
+        global _comfy_connections_opened
+        with _comfy_sessions_lock:
+            _comfy_connections_opened += 1
+        super().connect()
+
+
+class _CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+def _build_comfy_session(retries):
+    """
+    Create a pooled session whose plain-HTTP connections are counted.
+
+    Args:
+        retries (Retry or int): The urllib3 retry policy for the adapter.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=COMFY_HTTP_POOL_SIZE,
+        max_retries=retries,
+    )
+    adapter.poolmanager.pool_classes_by_scheme = {
+        "http": _CountingHTTPConnectionPool,
+        "https": urllib3.HTTPSConnectionPool,
+    }
+    session = requests.Session()
+    session.mount("http://", adapter)
+    return session
+
+
+def comfy_session():
+    """
+    Return the shared session used for ComfyUI API calls.
+
+    Returns:
+        requests.Session: Session with keep-alive pooling and retry/backoff.
+    """
+    session = _comfy_sessions.get("api")
+    if session is None:
+        with _comfy_sessions_lock:
+            if "api" not in _comfy_sessions:
+                _comfy_sessions["api"] = _build_comfy_session(Retry(
+                    total=COMFY_HTTP_RETRIES,
+                    connect=COMFY_HTTP_RETRIES,
+                    read=COMFY_HTTP_RETRIES,
+                    status=COMFY_HTTP_RETRIES,
+                    backoff_factor=COMFY_HTTP_BACKOFF,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(["GET", "HEAD"]),
+                    raise_on_status=False,
+                ))
+            session = _comfy_sessions["api"]
+    return session
+
+
+def comfy_probe_session():
+    """
+    Return the shared session used for readiness probes.
+
+    Probes are retried by their caller, so this session never retries itself.
+
+    Returns:
+        requests.Session: Session with keep-alive pooling and no retries.
+    """
+    session = _comfy_sessions.get("probe")
+    if session is None:
+        with _comfy_sessions_lock:
+            if "probe" not in _comfy_sessions:
+                _comfy_sessions["probe"] = _build_comfy_session(0)
+            session = _comfy_sessions["probe"]
+    return session
+
+
+def comfy_connections_opened():
+    """Return how many TCP connections to ComfyUI this worker has opened so far."""
+    with _comfy_sessions_lock:
+        return _comfy_connections_opened
+
+'''
+
+# 在 validate_input 之前插入共享会话
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    comfy_session_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# ComfyUI 请求使用带重试的共享会话 (就绪探测由 wait_for_comfy_ready 使用不重试的 comfy_probe_session)
+content = re.sub(
+    r'requests\.(get|post)\((\s*)f"http://\{COMFY_HOST\}',
+    lambda m: f'comfy_session().{m.group(1)}({m.group(2)}f"http://{{COMFY_HOST}}',
+    content,
+)
+
+# 每个 job 结束时输出本次新建的 ComfyUI 连接数
+content = content.replace(
+    '    job_input = job["input"]\n    job_id = job["id"]\n',
+    '    job_input = job["input"]\n    job_id = job["id"]\n    comfy_connections_start = comfy_connections_opened()\n',
+    1,
+)
+content = content.replace(
+    "    final_result = {}\n",
+    "    print(\n"
+    "        f\"worker-comfyui - ComfyUI connections opened during job {job_id}: \"\n"
+    "        f\"{comfy_connections_opened() - comfy_connections_start}\"\n"
+    "    )\n"
+    "\n"
+    "    final_result = {}\n",
+    1,
+)
+
+# ============================================================================
+# 12. 自适应就绪检测: 快速探测 + 指数退避, 检测 ComfyUI 进程提前退出, 记录启动时间线
+# ============================================================================
+readiness_code = '''
+# Readiness gate: probe fast while ComfyUI is coming up, then back off.
+# - COMFY_READY_INITIAL_INTERVAL_MS: first probe interval
+# - COMFY_READY_MAX_INTERVAL_MS: cap for the exponentially growing interval
+# - COMFY_READY_TIMEOUT_S: overall budget (defaults to the Dockerfile's
+#   COMFY_API_AVAILABLE_INTERVAL_MS x COMFY_API_AVAILABLE_MAX_RETRIES)
+# - COMFY_PROCESS_MATCH: command line fragment identifying the ComfyUI process
+COMFY_READY_INITIAL_INTERVAL_MS = float(os.environ.get("COMFY_READY_INITIAL_INTERVAL_MS", 10))
+COMFY_READY_MAX_INTERVAL_MS = float(os.environ.get("COMFY_READY_MAX_INTERVAL_MS", 250))
+COMFY_READY_TIMEOUT_S = float(os.environ.get(
+    "COMFY_READY_TIMEOUT_S",
+    COMFY_API_AVAILABLE_INTERVAL_MS * COMFY_API_AVAILABLE_MAX_RETRIES / 1000,
+))
+COMFY_PROCESS_MATCH = os.environ.get("COMFY_PROCESS_MATCH", "/comfyui/main.py")
+
+# 启动时间线 (epoch 秒): process_start / custom_nodes_loaded / api_up / first_prompt_accepted
+_boot_timeline = {"handler_start": time.time()}
+_comfy_pid = None
+
+
+def _find_comfy_pid():
+    """
+    Find the ComfyUI server process by its command line.
+
+    Returns:
+        int: The PID, or None if no matching process is running.
+    """
+    own_pid = os.getpid()
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit() or int(entry) == own_pid:
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\\0", b" ").decode("utf-8", "replace")
+        except OSError:
+            continue
+        if COMFY_PROCESS_MATCH in cmdline:
+            return int(entry)
+    return None
+
+
+def _process_start_time(pid):
+    """Return the start time of a process as epoch seconds, or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        # starttime 为开机后的 clock ticks, 换算为距今的秒数
+        return time.time() - (uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _process_alive(pid):
+    """Return True if the process exists and is not a zombie."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return False
+
+
+def _mark_boot_event(name):
+    """Record a boot timeline event the first time it happens."""
+    if name not in _boot_timeline:
+        _boot_timeline[name] = time.time()
+        return True
+    return False
+
+
+def boot_timeline():
+    """
+    Return the boot timeline as seconds relative to the earliest known event.
+
+    Returns:
+        dict: Event name -> seconds since ComfyUI process start (or handler start).
+    """
+    origin = min(_boot_timeline.values())
+    return {name: round(ts - origin, 3) for name, ts in sorted(_boot_timeline.items(), key=lambda kv: kv[1])}
+
+
+def _log_boot_timeline():
+    """Print the boot timeline as one line."""
+    parts = ", ".join(f"{name} +{seconds:.2f}s" for name, seconds in boot_timeline().items())
+    print(f"worker-comfyui - Boot timeline: {parts}")
+
+
+def _port_open(host, port):
+    """Return True if a TCP connection to host:port succeeds."""
+    try:
+        with socket.create_connection((host, port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_comfy_ready(url):
+    """
+    Wait until the ComfyUI HTTP API answers, failing fast if ComfyUI has died.
+
+    Probes start every COMFY_READY_INITIAL_INTERVAL_MS and back off exponentially
+    up to COMFY_READY_MAX_INTERVAL_MS, within COMFY_READY_TIMEOUT_S overall. While
+    waiting, the ComfyUI process is watched through /proc; if it exits, the
+    wait ends immediately. The first successful wait logs the boot timeline.
+    ComfyUI binds its port only after importing custom nodes, so the port
+    opening marks "custom_nodes_loaded".
+
+    Args:
+        url (str): The URL to probe.
+
+    Returns:
+        str: An error message, or None once ComfyUI is ready.
+    """
+    global _comfy_pid
+
+    host, port = COMFY_HOST.rsplit(":", 1)
+    start = time.monotonic()
+    interval = COMFY_READY_INITIAL_INTERVAL_MS / 1000
+    attempts = 0
+
+    while True:
+        attempts += 1
+        if _comfy_pid is None:
+            _comfy_pid = _find_comfy_pid()
+            if _comfy_pid is not None and "process_start" not in _boot_timeline:
+                started = _process_start_time(_comfy_pid)
+                if started:
+                    _boot_timeline["process_start"] = started
+
+        if "custom_nodes_loaded" not in _boot_timeline and _port_open(host.strip("[]"), int(port)):
+            _mark_boot_event("custom_nodes_loaded")
+
+        try:
+            response = comfy_probe_session().get(url, timeout=5)
+            if response.status_code == 200:
+                if _mark_boot_event("api_up"):
+                    print(f"worker-comfyui - API is reachable after {attempts} probe(s)")
+                    _log_boot_timeline()
+                return None
+        except requests.RequestException:
+            pass
+
+        if _comfy_pid is not None and not _process_alive(_comfy_pid):
+            message = f"ComfyUI process (pid {_comfy_pid}) exited before its API became available."
+            print(f"worker-comfyui - {message}")
+            _comfy_pid = None
+            return message
+
+        elapsed = time.monotonic() - start
+        if elapsed >= COMFY_READY_TIMEOUT_S:
+            message = f"ComfyUI server ({COMFY_HOST}) not reachable after {elapsed:.0f}s ({attempts} probes)."
+            print(f"worker-comfyui - {message}")
+            return message
+
+        time.sleep(min(interval, max(0.0, COMFY_READY_TIMEOUT_S - elapsed)))
+        interval = min(interval * 2, COMFY_READY_MAX_INTERVAL_MS / 1000)
+
+'''
+
+# 在 validate_input 之前插入就绪检测
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    readiness_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# handler 中用自适应就绪检测替换固定间隔的 check_server 轮询
+old_ready_pattern = r'''    if not check_server\(
+        f"http://\{COMFY_HOST\}/",
+        COMFY_API_AVAILABLE_MAX_RETRIES,
+        COMFY_API_AVAILABLE_INTERVAL_MS,
+    \):
+        return \{
+            "error": f"ComfyUI server \(\{COMFY_HOST\}\) not reachable after multiple retries\."
+        \}
+'''
+
+new_ready_code = '''    ready_error = wait_for_comfy_ready(f"http://{COMFY_HOST}/")
+    if ready_error:
+        return {"error": ready_error}
+'''
+
+content = re.sub(old_ready_pattern, lambda m: new_ready_code, content, count=1)
+
+# 原有的 check_server 已无调用方, 一并删除
+content = re.sub(
+    r'def check_server\(url, retries=\d+, delay=\d+\):.*?\n    return False\n\n\n',
+    "",
+    content,
+    count=1,
+    flags=re.DOTALL,
+)
+
+# 第一次成功提交 prompt 时补全启动时间线
+content = content.replace(
+    "    response.raise_for_status()\n    return response.json()\n\n\ndef get_history(",
+    "    response.raise_for_status()\n"
+    "    if _mark_boot_event(\"first_prompt_accepted\"):\n"
+    "        _log_boot_timeline()\n"
+    "    return response.json()\n\n\ndef get_history(",
+    1,
+)
+
+# ============================================================================
+# 13. 输入规范化 (ffmpeg): 探测、裁剪时长、限制帧率、缩放、密集关键帧、缩小参考图, 超限请求提前拒绝
+# ============================================================================
+normalize_code = '''
+# Input normalisation with ffmpeg, run after staging and before queueing.
+# Only applies when inputs are placed directly in COMFY_INPUT_DIR, and each step
+# only runs when the input exceeds what the workflow will use.
+# - INPUT_NORMALIZE: enable the stage (needs ffmpeg/ffprobe on PATH)
+# - INPUT_SECONDS_NODE / INPUT_SHORT_SIDE_NODE: workflow nodes holding the
+#   requested duration (MaxSecond) and target short side
+# - INPUT_MAX_FPS: videos above this frame rate are resampled to it
+# - INPUT_KEYFRAME_INTERVAL_S: keyframe spacing of re-encoded videos
+# - INPUT_MAX_IMAGE_SIDE: reference images with a longer side are shrunk
+# - INPUT_LIMIT_SECONDS / INPUT_LIMIT_SHORT_SIDE / INPUT_LIMIT_FRAMES: reject
+#   requests above these values (0 disables a limit)
+INPUT_NORMALIZE = os.environ.get("INPUT_NORMALIZE", "true").lower() == "true"
+INPUT_SECONDS_NODE = os.environ.get("INPUT_SECONDS_NODE", "165")
+INPUT_SHORT_SIDE_NODE = os.environ.get("INPUT_SHORT_SIDE_NODE", "228")
+INPUT_MAX_FPS = float(os.environ.get("INPUT_MAX_FPS", 30))
+INPUT_KEYFRAME_INTERVAL_S = float(os.environ.get("INPUT_KEYFRAME_INTERVAL_S", 1))
+INPUT_MAX_IMAGE_SIDE = int(os.environ.get("INPUT_MAX_IMAGE_SIDE", 2048))
+INPUT_LIMIT_SECONDS = float(os.environ.get("INPUT_LIMIT_SECONDS", 0))
+INPUT_LIMIT_SHORT_SIDE = int(os.environ.get("INPUT_LIMIT_SHORT_SIDE", 0))
+INPUT_LIMIT_FRAMES = int(os.environ.get("INPUT_LIMIT_FRAMES", 0))
+INPUT_NORMALIZE_CONCURRENCY = int(os.environ.get("INPUT_NORMALIZE_CONCURRENCY", 2))
+
+
+def _workflow_number(workflow, node_id):
+    """Return the literal numeric 'value' input of a workflow node, or None."""
+    value = (workflow.get(node_id) or {}).get("inputs", {}).get("value")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def _parse_rate(rate):
+    """Turn an ffprobe rate such as '30000/1001' into a float (0.0 if unknown)."""
+    try:
+        num, _, den = str(rate).partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def probe_media(path):
+    """
+    Probe a media file with ffprobe.
+
+    Args:
+        path (str): The file to probe.
+
+    Returns:
+        dict: {"width", "height", "fps", "duration"}; fps/duration are 0 for images.
+
+    Raises:
+        ValueError: If ffprobe cannot read a video stream from the file.
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate:format=duration",
+        "-of", "json",
+        path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+    try:
+        data = json.loads(result.stdout or "{}")
+        stream = data["streams"][0]
+        return {
+            "width": int(stream["width"]),
+            "height": int(stream["height"]),
+            "fps": _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate")),
+            "duration": float(data.get("format", {}).get("duration") or 0),
+        }
+    except (ValueError, KeyError, IndexError, TypeError):
+        raise ValueError(f"ffprobe could not read {os.path.basename(path)}: {result.stderr.strip()[:200]}")
+
+
+def _run_ffmpeg(args, path):
+    """
+    Run ffmpeg writing to a temp file next to path, then atomically replace path.
+
+    Replacing (instead of rewriting in place) also detaches the input from a
+    hard-linked cache entry, so the cached original stays untouched.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = os.path.join(os.path.dirname(path), f".norm-{uuid.uuid4().hex}{ext}")
+    cmd = ["ffmpeg", "-v", "error", "-y", "-i", path] + args + [tmp_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[:300]}")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _even(value):
+    """Round down to an even number (required by yuv420p encoders), minimum 2."""
+    return max(2, int(value) // 2 * 2)
+
+
+def normalize_video_input(path, seconds, short_side):
+    """
+    Trim, resample and downscale a staged video to what the workflow will use.
+
+    Args:
+        path (str): The video in COMFY_INPUT_DIR.
+        seconds (float): Requested duration, or None.
+        short_side (int): Target short side, or None.
+
+    Returns:
+        dict: {"before", "after", "changes"} describing what was done.
+
+    Raises:
+        ValueError: If the video would load more than INPUT_LIMIT_FRAMES frames.
+    """
+    info = probe_media(path)
+    fps = info["fps"]
+    filters = []
+    changes = []
+    args = []
+
+    if seconds and info["duration"] > seconds + 1:
+        # 多保留两帧, 避免 frame_load_cap 取整时不足
+        keep = seconds + 2 / max(fps, 1)
+        args += ["-t", f"{keep:.3f}"]
+        changes.append(f"trim {info['duration']:.1f}s->{keep:.1f}s")
+
+    if fps > INPUT_MAX_FPS > 0:
+        filters.append(f"fps={INPUT_MAX_FPS:g}")
+        changes.append(f"fps {fps:.2f}->{INPUT_MAX_FPS:g}")
+        fps = INPUT_MAX_FPS
+
+    # 在转码前检查帧数上限, 超限的请求不浪费任何转码时间
+    frames = min(seconds or info["duration"], info["duration"]) * fps
+    if INPUT_LIMIT_FRAMES > 0 and frames > INPUT_LIMIT_FRAMES:
+        raise ValueError(f"would load {frames:.0f} frames, limit is {INPUT_LIMIT_FRAMES}")
+
+    width, height = info["width"], info["height"]
+    if short_side and min(width, height) > short_side:
+        scale = short_side / min(width, height)
+        width, height = _even(width * scale), _even(height * scale)
+        filters.append(f"scale={width}:{height}:flags=lanczos")
+        changes.append(f"scale {info['width']}x{info['height']}->{width}x{height}")
+
+    if not changes:
+        return {"before": info, "after": info, "changes": []}
+
+    gop = max(1, int(round(fps * INPUT_KEYFRAME_INTERVAL_S)))
+    args += ["-map", "0:v:0", "-map", "0:a:0?"]
+    if filters:
+        args += ["-vf", ",".join(filters)]
+    args += [
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "17", "-pix_fmt", "yuv420p",
+        "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+        "-c:a", "aac", "-b:a", "128k",
+        "-movflags", "+faststart",
+    ]
+    _run_ffmpeg(args, path)
+    return {"before": info, "after": probe_media(path), "changes": changes}
+
+
+def normalize_image_input(path):
+    """
+    Shrink a staged reference image whose longer side exceeds INPUT_MAX_IMAGE_SIDE.
+
+    Args:
+        path (str): The image in COMFY_INPUT_DIR.
+
+    Returns:
+        dict: {"before", "after", "changes"} describing what was done.
+    """
+    info = probe_media(path)
+    longest = max(info["width"], info["height"])
+    if INPUT_MAX_IMAGE_SIDE <= 0 or longest <= INPUT_MAX_IMAGE_SIDE:
+        return {"before": info, "after": info, "changes": []}
+
+    scale = INPUT_MAX_IMAGE_SIDE / longest
+    width, height = max(1, round(info["width"] * scale)), max(1, round(info["height"] * scale))
+    _run_ffmpeg(["-vf", f"scale={width}:{height}:flags=lanczos", "-frames:v", "1", "-update", "1"], path)
+    return {
+        "before": info,
+        "after": dict(info, width=width, height=height),
+        "changes": [f"scale {info['width']}x{info['height']}->{width}x{height}"],
+    }
+
+
+def check_request_limits(workflow):
+    """
+    Reject requests whose requested duration or resolution exceeds the limits.
+
+    Args:
+        workflow (dict): The workflow from the job input.
+
+    Returns:
+        list: Error messages; empty if the request is within limits.
+    """
+    errors = []
+    seconds = _workflow_number(workflow, INPUT_SECONDS_NODE)
+    short_side = _workflow_number(workflow, INPUT_SHORT_SIDE_NODE)
+    if INPUT_LIMIT_SECONDS > 0 and seconds and seconds > INPUT_LIMIT_SECONDS:
+        errors.append(f"Requested duration {seconds}s (node {INPUT_SECONDS_NODE}) exceeds limit {INPUT_LIMIT_SECONDS:g}s")
+    if INPUT_LIMIT_SHORT_SIDE > 0 and short_side and short_side > INPUT_LIMIT_SHORT_SIDE:
+        errors.append(f"Requested short side {short_side} (node {INPUT_SHORT_SIDE_NODE}) exceeds limit {INPUT_LIMIT_SHORT_SIDE}")
+    return errors
+
+
+def _normalize_one(kind, name, seconds, short_side):
+    """Normalise one staged input; returns (error_msg or None, timing dict)."""
+    start = time.monotonic()
+    timing = {"name": name, "kind": kind, "changes": []}
+    try:
+        path = comfy_input_path(name)
+        if kind == "video":
+            result = normalize_video_input(path, seconds, short_side)
+        else:
+            result = normalize_image_input(path)
+        timing["changes"] = result["changes"]
+        if result["changes"]:
+            # 文件已变化, 让下一次缓存命中重新放置原始文件
+            with _input_cache_lock:
+                _placed_inputs.pop(name, None)
+        error_msg = None
+    except Exception as e:
+        error_msg = f"Input {name} rejected: {e}"
+    timing["seconds"] = round(time.monotonic() - start, 3)
+    if error_msg:
+        print(f"worker-comfyui - {error_msg}")
+    elif timing["changes"]:
+        print(f"worker-comfyui - Normalised {kind} {name} in {timing['seconds']:.2f}s: {', '.join(timing['changes'])}")
+    return error_msg, timing
+
+
+def normalize_inputs(workflow, images, videos):
+    """
+    Check request limits and normalise staged inputs before the prompt is queued.
+
+    Args:
+        workflow (dict): The workflow from the job input.
+        images (list): Image entries from the job input, or None.
+        videos (list): Video entries from the job input, or None.
+
+    Returns:
+        dict: {"status": "success"|"error", "details": [...], "timings": [...]}.
+    """
+    limit_errors = check_request_limits(workflow)
+    if limit_errors:
+        return {"status": "error", "details": limit_errors, "timings": []}
+
+    tasks = [("image", item["name"]) for item in images or []]
+    tasks += [("video", item["name"]) for item in videos or []]
+    if not tasks or not INPUT_NORMALIZE:
+        return {"status": "success", "details": [], "timings": []}
+    if not direct_placement_enabled():
+        print("worker-comfyui - Skipping input normalisation: inputs are not on local disk")
+        return {"status": "success", "details": [], "timings": []}
+    if not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        print("worker-comfyui - Skipping input normalisation: ffmpeg/ffprobe not found")
+        return {"status": "success", "details": [], "timings": []}
+
+    seconds = _workflow_number(workflow, INPUT_SECONDS_NODE)
+    short_side = _workflow_number(workflow, INPUT_SHORT_SIDE_NODE)
+    start = time.monotonic()
+    workers = max(1, min(INPUT_NORMALIZE_CONCURRENCY, len(tasks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="normalize") as pool:
+        results = list(pool.map(lambda task: _normalize_one(task[0], task[1], seconds, short_side), tasks))
+
+    errors = [error_msg for error_msg, _ in results if error_msg]
+    timings = [timing for _, timing in results]
+    print(f"worker-comfyui - Input normalisation finished in {time.monotonic() - start:.2f}s")
+    return {"status": "error" if errors else "success", "details": errors, "timings": timings}
+
+'''
+
+# 在 validate_input 之前插入输入规范化
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    normalize_code + "\ndef validate_input(job_input):",
+    1,
+)
+if "import subprocess\n" not in content:
+    content = content.replace("import traceback\n", "import traceback\nimport subprocess\n", 1)
+
+# ============================================================================
+# 14. 分辨率与帧数分桶: 将节点 181/183 (宽/高) 与 166 (帧数) 对齐到少量固定形状, 提高编译 kernel 缓存复用率
+# ============================================================================
+bucketing_code = '''
+# Shape bucketing: snap the workflow's width/height/frame count to a small set
+# of shapes so compiled Triton/Inductor kernels are reused across requests.
+# - SHAPE_BUCKETING: enable bucketing
+# - BUCKET_SIDES: allowed widths/heights (nearest is used; the loader crops/pads)
+# - BUCKET_FRAMES: allowed frame counts (largest one not above the request is used)
+# - BUCKET_*_NODE: the workflow nodes holding width, height, frame count and the video loader
+SHAPE_BUCKETING = os.environ.get("SHAPE_BUCKETING", "true").lower() == "true"
+BUCKET_SIDES = sorted(int(v) for v in os.environ.get("BUCKET_SIDES", "480,576,640,720,848,960,1088,1280").split(",") if v.strip())
+BUCKET_FRAMES = sorted(int(v) for v in os.environ.get(
+    "BUCKET_FRAMES", "17,33,49,65,81,97,113,129,145,161,177,193,209,225,241"
+).split(",") if v.strip())
+BUCKET_WIDTH_NODE = os.environ.get("BUCKET_WIDTH_NODE", "181")
+BUCKET_HEIGHT_NODE = os.environ.get("BUCKET_HEIGHT_NODE", "183")
+BUCKET_FRAMES_NODE = os.environ.get("BUCKET_FRAMES_NODE", "166")
+BUCKET_VIDEO_NODE = os.environ.get("BUCKET_VIDEO_NODE", "240")
+
+_bucket_lock = threading.Lock()
+_bucket_stats = {"jobs": 0, "hits": 0}
+_bucket_shapes_seen = set()
+
+
+def _snap_side(value):
+    """Snap a width/height to the nearest BUCKET_SIDES entry."""
+    return min(BUCKET_SIDES, key=lambda side: (abs(side - value), side)) if BUCKET_SIDES else value
+
+
+def _snap_frames(value):
+    """Snap a frame count down to the largest BUCKET_FRAMES entry not above it."""
+    fitting = [frames for frames in BUCKET_FRAMES if frames <= value]
+    return fitting[-1] if fitting else value
+
+
+def _source_shape(workflow):
+    """
+    Compute the width, height and frame count the workflow would derive itself.
+
+    Literal values (e.g. 'easy int' nodes set by the client) are used as-is;
+    the SimpleMath+ formulas of nodes 181/183/166 are evaluated from an
+    ffprobe of the staged video, exactly as ComfyUI would.
+
+    Returns:
+        tuple: (width, height, frames), or None if the shape cannot be determined.
+    """
+    width = _workflow_number(workflow, BUCKET_WIDTH_NODE)
+    height = _workflow_number(workflow, BUCKET_HEIGHT_NODE)
+    frames = _workflow_number(workflow, BUCKET_FRAMES_NODE)
+    if None not in (width, height, frames):
+        return int(width), int(height), int(frames)
+
+    video_name = (workflow.get(BUCKET_VIDEO_NODE) or {}).get("inputs", {}).get("video")
+    short_side = _workflow_number(workflow, INPUT_SHORT_SIDE_NODE)
+    seconds = _workflow_number(workflow, INPUT_SECONDS_NODE)
+    if not isinstance(video_name, str) or not direct_placement_enabled() or not shutil.which("ffprobe"):
+        return None
+
+    try:
+        info = probe_media(comfy_input_path(video_name))
+    except (ValueError, OSError, subprocess.SubprocessError) as e:
+        print(f"worker-comfyui - Shape bucketing: could not probe {video_name}: {e}")
+        return None
+
+    short, long = min(info["width"], info["height"]), max(info["width"], info["height"])
+    if width is None and short_side:
+        # 181: (min(a,b)*c//min(a,b))//16*16
+        width = (short * short_side // short) // 16 * 16
+    if height is None and short_side:
+        # 183: (max(a,b)*c//min(a,b))//16*16
+        height = (long * short_side // short) // 16 * 16
+    if frames is None and seconds:
+        # 166: a*b (seconds x fps), capped by what the video holds
+        frames = min(seconds * info["fps"], info["duration"] * info["fps"])
+    if None in (width, height, frames):
+        return None
+    return int(width), int(height), int(frames)
+
+
+def apply_shape_buckets(workflow):
+    """
+    Replace the width/height/frame-count nodes with bucketed 'easy int' constants.
+
+    Args:
+        workflow (dict): The workflow, modified in place.
+
+    Returns:
+        dict: {"source": (w, h, frames), "bucket": (w, h, frames), "hit": bool},
+            or None when bucketing is disabled or the shape is unknown.
+    """
+    if not SHAPE_BUCKETING:
+        return None
+    source = _source_shape(workflow)
+    if source is None:
+        print("worker-comfyui - Shape bucketing skipped: shape could not be determined")
+        return None
+
+    bucket = (_snap_side(source[0]), _snap_side(source[1]), _snap_frames(source[2]))
+    for node_id, value, title in zip(
+        (BUCKET_WIDTH_NODE, BUCKET_HEIGHT_NODE, BUCKET_FRAMES_NODE),
+        bucket,
+        ("Bucketed Width", "Bucketed Height", "Bucketed Frames"),
+    ):
+        workflow[node_id] = {"inputs": {"value": value}, "class_type": "easy int", "_meta": {"title": title}}
+
+    with _bucket_lock:
+        _bucket_stats["jobs"] += 1
+        hit = bucket in _bucket_shapes_seen
+        if hit:
+            _bucket_stats["hits"] += 1
+        _bucket_shapes_seen.add(bucket)
+        jobs, hits = _bucket_stats["jobs"], _bucket_stats["hits"]
+        shapes = len(_bucket_shapes_seen)
+
+    print(
+        f"worker-comfyui - Shape bucket {bucket[0]}x{bucket[1]}x{bucket[2]} "
+        f"(from {source[0]}x{source[1]}x{source[2]}, {'hit' if hit else 'new shape'}); "
+        f"bucket hit rate {hits}/{jobs} ({hits / jobs:.0%}), {shapes} distinct shape(s)"
+    )
+    return {"source": source, "bucket": bucket, "hit": hit}
+
+'''
+
+# 在 validate_input 之前插入分桶逻辑
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    bucketing_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# ============================================================================
+# 15. Triton/Inductor 编译缓存持久化: 启动时记录恢复结果, 每个 job 结束后在后台发布新编译的条目
+# ============================================================================
+kernel_cache_code = '''
+# Kernel cache persistence (see /kernel_cache.py). The cache is restored from
+# the network volume by /start.sh before ComfyUI starts; after every job newly
+# compiled entries are published back in a background process.
+# - KERNEL_CACHE_PUBLISH: publish new entries after each job
+# - KERNEL_CACHE_SCRIPT: path of the sync script
+# - KERNEL_CACHE_STATS: stats file written by the script
+KERNEL_CACHE_PUBLISH = os.environ.get("KERNEL_CACHE_PUBLISH", "true").lower() == "true"
+KERNEL_CACHE_SCRIPT = os.environ.get("KERNEL_CACHE_SCRIPT", "/kernel_cache.py")
+KERNEL_CACHE_STATS = os.environ.get("KERNEL_CACHE_STATS", "/tmp/kernel-cache-stats.json")
+
+_kernel_cache_publisher = None
+_kernel_cache_lock = threading.Lock()
+
+
+def log_kernel_cache_restore():
+    """Log how many kernel cache entries were restored at boot and the cache sizes."""
+    try:
+        with open(KERNEL_CACHE_STATS, "r", encoding="utf-8") as f:
+            stats = json.load(f).get("restore")
+    except (OSError, ValueError):
+        stats = None
+    if not stats:
+        print("worker-comfyui - Kernel cache: no restore stats recorded")
+        return
+    if stats.get("skipped"):
+        print(f"worker-comfyui - Kernel cache restore skipped: {stats['skipped']}")
+        return
+    for name in ("triton", "inductor"):
+        entry = stats.get(name)
+        if entry:
+            print(
+                f"worker-comfyui - Kernel cache {name}: restored {entry['copied']} entries "
+                f"({entry['bytes'] / 1024 / 1024:.1f} MB) in {stats.get('seconds', 0):.2f}s; "
+                f"cache now {entry['local']['files']} files, {entry['local']['bytes'] / 1024 / 1024:.1f} MB"
+            )
+
+
+def publish_kernel_cache():
+    """
+    Publish newly compiled kernels to the network volume in the background.
+
+    At most one publish runs at a time; a job finishing while the previous
+    publish is still copying skips its turn, the next one picks the entries up.
+    """
+    global _kernel_cache_publisher
+    if not KERNEL_CACHE_PUBLISH or not os.path.isfile(KERNEL_CACHE_SCRIPT):
+        return
+    with _kernel_cache_lock:
+        if _kernel_cache_publisher is not None and _kernel_cache_publisher.poll() is None:
+            print("worker-comfyui - Kernel cache publish still running, skipping")
+            return
+        try:
+            _kernel_cache_publisher = subprocess.Popen(
+                ["python3", KERNEL_CACHE_SCRIPT, "publish"],
+                stdin=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            print(f"worker-comfyui - Failed to start kernel cache publish: {e}")
+
+'''
+
+# 在 validate_input 之前插入编译缓存逻辑
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    kernel_cache_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# 启动时记录编译缓存恢复情况
+content = content.replace(
+    "    start_oss_prewarm()",
+    "    start_oss_prewarm()\n    log_kernel_cache_restore()",
+    1,
+)
+
+# job 结束后 (无论成功与否) 发布新编译的 kernel
+content = content.replace(
+    '''            print(f"worker-comfyui - Closing websocket connection.")
+            ws.close()
+''',
+    '''            print(f"worker-comfyui - Closing websocket connection.")
+            ws.close()
+        publish_kernel_cache()
+''',
+    1,
+)
+
+# ============================================================================
+# 16. Workflow 图优化: 解析常量开关, 合并重复加载节点, 裁剪不影响输出的节点
+# ============================================================================
+graph_optimizer_code = '''
+# Workflow graph pass run right before the prompt is queued.
+# - WORKFLOW_OPTIMIZE: enable the pass
+# - WORKFLOW_OUTPUT_CLASSES: node classes whose results are returned to the caller, used
+#   only until ComfyUI's /object_info (``output_node`` flag) can be read
+# - WORKFLOW_DISPLAY_ONLY_CLASSES: UI-only nodes that are always dropped
+WORKFLOW_OPTIMIZE = os.environ.get("WORKFLOW_OPTIMIZE", "true").lower() == "true"
+WORKFLOW_OUTPUT_CLASSES = set(os.environ.get(
+    "WORKFLOW_OUTPUT_CLASSES", "SaveImage,SaveVideo,SaveAnimatedWEBP,SaveAnimatedPNG,VHS_VideoCombine"
+).split(","))
+WORKFLOW_DISPLAY_ONLY_CLASSES = set(os.environ.get(
+    "WORKFLOW_DISPLAY_ONLY_CLASSES", "easy showAnything,PreviewAny,PreviewImage,ShowText|pysssss"
+).split(","))
+
+_output_classes_lock = threading.Lock()
+_output_classes = None
+
+# 常量节点: 其 "value" 输入即为输出
+_CONSTANT_CLASSES = {"easy boolean", "easy string", "easy int", "easy float", "PrimitiveNode"}
+_VIDEO_INFO_OUTPUT = 3
+
+
+
+def workflow_output_classes():
+    """
+    Node classes whose results are returned to the caller.
+
+    Read once from ComfyUI's /object_info (every class with ``output_node``
+    set, minus WORKFLOW_DISPLAY_ONLY_CLASSES), so custom save nodes are never
+    pruned. Falls back to WORKFLOW_OUTPUT_CLASSES, without caching, while
+    /object_info cannot be read.
+    """
+    global _output_classes
+    with _output_classes_lock:
+        if _output_classes is not None:
+            return _output_classes
+        try:
+            response = comfy_session().get(f"http://{COMFY_HOST}/object_info", timeout=10)
+            response.raise_for_status()
+            object_info = response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"worker-comfyui - Output classes: /object_info unavailable ({e}), using WORKFLOW_OUTPUT_CLASSES")
+            return WORKFLOW_OUTPUT_CLASSES
+        classes = {
+            name for name, info in object_info.items() if isinstance(info, dict) and info.get("output_node")
+        } - WORKFLOW_DISPLAY_ONLY_CLASSES
+        if not classes:
+            print("worker-comfyui - Output classes: /object_info lists no output nodes, using WORKFLOW_OUTPUT_CLASSES")
+            classes = WORKFLOW_OUTPUT_CLASSES
+        else:
+            print(f"worker-comfyui - Output classes: {len(classes)} output node class(es) from /object_info")
+        _output_classes = classes
+        return _output_classes
+
+def _is_link(value):
+    """Whether an API-format input value is a [node_id, output_index] link."""
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def _constant_value(workflow, value):
+    """
+    Resolve an input to a literal if it is one or comes from a constant node.
+
+    Returns:
+        tuple: (True, value) when constant, otherwise (False, None).
+    """
+    if not _is_link(value):
+        return True, value
+    node = workflow.get(value[0])
+    if node and node.get("class_type") in _CONSTANT_CLASSES and value[1] == 0:
+        literal = node.get("inputs", {}).get("value")
+        if not _is_link(literal):
+            return True, literal
+    return False, None
+
+
+def _switch_choice(workflow, node):
+    """
+    Return the input link a switch forwards, or None if it is not constant.
+
+    FL_Switch forwards on_true/on_false; FL_Switch_Big forwards input_N for the
+    first case_N equal to switch_condition, else input_default.
+    """
+    inputs = node.get("inputs", {})
+    if node.get("class_type") == "FL_Switch":
+        known, flag = _constant_value(workflow, inputs.get("switch"))
+        if not known:
+            return None
+        choice = inputs.get("on_true" if flag else "on_false")
+    elif node.get("class_type") == "FL_Switch_Big":
+        known, condition = _constant_value(workflow, inputs.get("switch_condition"))
+        if not known:
+            return None
+        choice = inputs.get("input_default")
+        for i in range(1, 6):
+            case = inputs.get(f"case_{i}")
+            if case not in (None, "") and str(case) == str(condition):
+                choice = inputs.get(f"input_{i}")
+                break
+    else:
+        return None
+    return choice if _is_link(choice) else None
+
+
+def _rewire(workflow, old, new):
+    """Point every input linked to output `old` ([id, index]) at `new` instead."""
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        for name, value in inputs.items():
+            if _is_link(value) and value[0] == old[0] and value[1] == old[1]:
+                inputs[name] = list(new)
+
+
+def _depends_on(workflow, node_id, target):
+    """Whether node_id (transitively) consumes an output of target."""
+    seen, stack = set(), [node_id]
+    while stack:
+        current = stack.pop()
+        if current == target:
+            return True
+        if current in seen or current not in workflow:
+            continue
+        seen.add(current)
+        stack.extend(v[0] for v in workflow[current].get("inputs", {}).values() if _is_link(v))
+    return False
+
+
+def _merge_loaders(workflow):
+    """
+    Merge loader nodes that load the same thing.
+
+    Loaders with identical class and inputs are merged outright. For VHS video
+    loaders reading the same file, a loader only used for its video_info output
+    (source fps/frame count, independent of the load settings) is replaced by
+    the other loader unless that would create a cycle.
+
+    Returns:
+        list: Human-readable notes about merged and kept loaders.
+    """
+    notes = []
+    seen = {}
+    for node_id in sorted(workflow, key=lambda n: (len(n), n)):
+        node = workflow[node_id]
+        class_type = node.get("class_type", "")
+        if "Load" not in class_type:
+            continue
+        key = (class_type, json.dumps(node.get("inputs", {}), sort_keys=True))
+        if key in seen:
+            for index in range(8):
+                _rewire(workflow, [node_id, index], [seen[key], index])
+            del workflow[node_id]
+            notes.append(f"{node_id} merged into {seen[key]}")
+        else:
+            seen[key] = node_id
+
+    video_loaders = {}
+    for node_id, node in workflow.items():
+        if node.get("class_type", "").startswith("VHS_LoadVideo"):
+            video_loaders.setdefault(node["inputs"].get("video"), []).append(node_id)
+    for video, loaders in video_loaders.items():
+        for node_id in loaders:
+            consumers = [
+                (cid, name)
+                for cid, c in workflow.items()
+                for name, v in c.get("inputs", {}).items()
+                if _is_link(v) and v[0] == node_id
+            ]
+            if not consumers or any(workflow[cid]["inputs"][name][1] != _VIDEO_INFO_OUTPUT for cid, name in consumers):
+                continue
+            for other in loaders:
+                if other == node_id:
+                    continue
+                blocker = next((cid for cid, _ in consumers if _depends_on(workflow, other, cid)), None)
+                if blocker:
+                    notes.append(f"{node_id} kept: {other} depends on its video_info via {blocker}")
+                    continue
+                _rewire(workflow, [node_id, _VIDEO_INFO_OUTPUT], [other, _VIDEO_INFO_OUTPUT])
+                notes.append(f"{node_id} merged into {other} (video_info)")
+                break
+    return notes
+
+
+def optimize_workflow(workflow, output_nodes=None):
+    """
+    Simplify the workflow graph in place before it is queued.
+
+    Resolves switches with constant selectors, merges duplicate loaders and
+    drops every node that does not feed an output node.
+
+    Args:
+        workflow (dict): API-format workflow, modified in place.
+        output_nodes (iterable, optional): Node IDs to keep as outputs.
+            Defaults to all nodes of workflow_output_classes(); an explicit empty
+            list prunes the whole graph.
+
+    Returns:
+        dict: {"nodes_before", "nodes_after", "removed", "switches", "loaders"},
+            or None when the pass is disabled.
+    """
+    if not WORKFLOW_OPTIMIZE:
+        return None
+    start = time.time()
+    nodes_before = len(workflow)
+
+    switches = 0
+    resolved = True
+    while resolved:
+        resolved = False
+        for node_id, node in list(workflow.items()):
+            choice = _switch_choice(workflow, node)
+            if choice is None or choice[0] == node_id:
+                continue
+            _rewire(workflow, [node_id, 0], choice)
+            del workflow[node_id]
+            switches += 1
+            resolved = True
+
+    loader_notes = _merge_loaders(workflow)
+
+    detect_outputs = output_nodes is None
+    if detect_outputs:
+        output_classes = workflow_output_classes()
+        output_nodes = [n for n, node in workflow.items() if node.get("class_type") in output_classes]
+    keep, stack = set(), [n for n in output_nodes if n in workflow]
+    while stack:
+        node_id = stack.pop()
+        if node_id in keep or node_id not in workflow:
+            continue
+        if workflow[node_id].get("class_type") in WORKFLOW_DISPLAY_ONLY_CLASSES:
+            continue
+        keep.add(node_id)
+        stack.extend(v[0] for v in workflow[node_id].get("inputs", {}).values() if _is_link(v))
+    pruned = sorted(set(workflow) - keep, key=lambda n: (len(n), n))
+    if keep or not detect_outputs:
+        for node_id in pruned:
+            del workflow[node_id]
+    else:
+        # 没有可识别的输出节点时不做裁剪, 避免提交空图
+        pruned = []
+
+    removed = nodes_before - len(workflow)
+    print(
+        f"worker-comfyui - Workflow optimised in {time.time() - start:.3f}s: "
+        f"{nodes_before} -> {len(workflow)} nodes ({removed} removed; "
+        f"{switches} constant switch(es) resolved, {len(pruned)} pruned: {', '.join(pruned) or 'none'})"
+    )
+    for note in loader_notes:
+        print(f"worker-comfyui - Loader merge: {note}")
+    return {
+        "nodes_before": nodes_before,
+        "nodes_after": len(workflow),
+        "removed": removed,
+        "switches": switches,
+        "loaders": loader_notes,
+    }
+
+'''
+
+# 在 validate_input 之前插入图优化逻辑
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    graph_optimizer_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# 分桶之后、提交之前优化 workflow
+content = content.replace(
+    "    apply_shape_buckets(workflow)",
+    "    apply_shape_buckets(workflow)\n\n    # Drop dead switch branches, duplicate loaders and nodes that feed no output\n    optimize_workflow(workflow)",
+    1,
+)
+
+# ============================================================================
+# 17. 输出选择: 请求中的 outputs 字段 (节点 ID 和/或媒体类型) 决定哪些输出被执行、读取和上传
+# ============================================================================
+output_selector_code = '''
+# Media types accepted in the "outputs" selector; anything else is a node ID.
+OUTPUT_SELECTOR_TYPES = ("image", "video")
+
+# Output node classes whose media type is known before the workflow runs
+_OUTPUT_NODE_MEDIA = {
+    "SaveImage": "image",
+    "SaveAnimatedWEBP": "image",
+    "SaveAnimatedPNG": "image",
+    "SaveVideo": "video",
+}
+
+
+def parse_output_selector(outputs, workflow):
+    """
+    Validate the request's "outputs" selector.
+
+    Args:
+        outputs: A list of node IDs and/or media types ("image", "video").
+        workflow (dict): The workflow, used to check node IDs.
+
+    Returns:
+        tuple: (selector, error_message) where selector is
+            {"nodes": set, "types": set} or None when every output is wanted.
+    """
+    if outputs is None:
+        return None, None
+    if isinstance(outputs, (str, int)):
+        outputs = [outputs]
+    if not isinstance(outputs, list) or not outputs:
+        return None, "'outputs' must be a non-empty list of node IDs and/or media types"
+    selector = {"nodes": set(), "types": set()}
+    for item in outputs:
+        if not isinstance(item, (str, int)) or isinstance(item, bool):
+            return None, f"Invalid output selector {item!r}: expected a node ID or one of {', '.join(OUTPUT_SELECTOR_TYPES)}"
+        item = str(item)
+        if item in OUTPUT_SELECTOR_TYPES:
+            selector["types"].add(item)
+        elif isinstance(workflow, dict) and item not in workflow:
+            return None, f"Unknown output node '{item}'"
+        else:
+            selector["nodes"].add(item)
+    if isinstance(workflow, dict) and not _selector_output_nodes(selector, workflow):
+        output_classes = workflow_output_classes()
+        available = ", ".join(
+            f"{node_id} ({_output_node_media(node) or 'unknown'})"
+            for node_id, node in workflow.items()
+            if node.get("class_type") in output_classes
+        )
+        return None, f"'outputs' selects no output node of this workflow (output nodes: {available or 'none'})"
+    return selector, None
+
+
+def _selector_output_nodes(selector, workflow):
+    """Output nodes picked by ID, or whose media type is known and selected."""
+    output_classes = workflow_output_classes()
+    return [
+        node_id
+        for node_id, node in workflow.items()
+        if node.get("class_type") in output_classes
+        and (node_id in selector["nodes"] or _output_node_media(node) in selector["types"])
+    ]
+
+
+def _output_file_media(filename):
+    """Media type ("image"/"video") of an output file, from its extension."""
+    content_type = OUTPUT_CONTENT_TYPES.get(os.path.splitext(filename or "")[1].lower(), "")
+    return content_type.split("/")[0] or None
+
+
+def _output_node_media(node):
+    """Media type an output node will produce, or None if it cannot be told up front."""
+    class_type = node.get("class_type")
+    if class_type == "VHS_VideoCombine":
+        fmt = node.get("inputs", {}).get("format")
+        return fmt.split("/")[0] if isinstance(fmt, str) and "/" in fmt else None
+    return _OUTPUT_NODE_MEDIA.get(class_type)
+
+
+def output_selected(selector, node_id, file_info):
+    """Whether an output file is wanted by the selector (None selects everything)."""
+    if selector is None:
+        return True
+    return str(node_id) in selector["nodes"] or _output_file_media(file_info.get("filename")) in selector["types"]
+
+
+def plan_outputs(workflow, selector):
+    """
+    Split the workflow's output nodes into selected and unselected ones.
+
+    Output nodes whose media type cannot be determined up front are kept so
+    their files can still be filtered after execution.
+
+    Returns:
+        dict: {"nodes": list of output node IDs to keep, or None for all,
+            "unselected": {node_id: class_type}}.
+    """
+    if selector is None:
+        return {"nodes": None, "unselected": {}}
+    nodes, unselected = [], {}
+    output_classes = workflow_output_classes()
+    for node_id, node in workflow.items():
+        if node.get("class_type") not in output_classes:
+            continue
+        media = _output_node_media(node)
+        if node_id in selector["nodes"] or media is None or media in selector["types"]:
+            nodes.append(node_id)
+        else:
+            unselected[node_id] = node.get("class_type")
+    print(f"worker-comfyui - Output selection: keeping node(s) {', '.join(nodes) or 'none'}; not executing {', '.join(unselected) or 'none'}")
+    return {"nodes": nodes, "unselected": unselected}
+
+
+def unexecuted_outputs(plan, workflow):
+    """List the unselected output nodes that were removed from the workflow."""
+    return [
+        {"node_id": node_id, "class_type": class_type, "reason": "not selected; node not executed"}
+        for node_id, class_type in plan["unselected"].items()
+        if node_id not in workflow
+    ]
+
+'''
+
+# 在 validate_input 之前插入输出选择逻辑
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    output_selector_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# validate_input 校验并返回 outputs 选择器
+content = content.replace(
+    "    # Optional: API key for Comfy.org API Nodes, passed per-request\n",
+    '''    # Optional: which outputs to fetch and upload (node IDs and/or media types)
+    outputs, outputs_error = parse_output_selector(job_input.get("outputs"), workflow)
+    if outputs_error:
+        return None, outputs_error
+
+    # Optional: API key for Comfy.org API Nodes, passed per-request
+''',
+    1,
+)
+content = content.replace(
+    '''        "comfy_org_api_key": comfy_org_api_key,
+    }, None''',
+    '''        "comfy_org_api_key": comfy_org_api_key,
+        "outputs": outputs,
+    }, None''',
+    1,
+)
+
+# 只为被选中的输出节点保留上游图, 未选中的输出节点不执行
+content = content.replace(
+    "    optimize_workflow(workflow)",
+    '''    output_plan = plan_outputs(workflow, validated_data.get("outputs"))
+    optimize_workflow(workflow, output_plan["nodes"])
+    skipped_outputs = unexecuted_outputs(output_plan, workflow)
+    if not workflow:
+        return {"error": "None of the selected outputs can be produced by this workflow"}''',
+    1,
+)
+content = content.replace(
+    "        output_collection = begin_output_collection(job_id)\n",
+    '        output_collection = begin_output_collection(job_id, validated_data.get("outputs"), skipped_outputs)\n',
+    1,
+)
+
+# 响应中列出被跳过的输出
+content = content.replace(
+    '''    if output_data:
+        final_result["images"] = output_data
+''',
+    '''    if output_data:
+        final_result["images"] = output_data
+
+    if skipped_outputs:
+        final_result["skipped_outputs"] = skipped_outputs
+''',
+    1,
+)
+
+# ============================================================================
+# 18. 启动预热: ComfyUI 就绪后提交一个极小的合成 prompt, 在接单前把模型权重加载进显存
+# ============================================================================
+warmup_code = '''
+# Boot-time warm-up: a tiny synthetic prompt built from the bundled workflow is
+# run once ComfyUI is ready and before the worker starts taking jobs, so the
+# first real job does not pay for loading the models.
+# - WARMUP_ON_BOOT: enable the warm-up
+# - WARMUP_WORKFLOW: API-format workflow to warm up with
+# - WARMUP_SECONDS / WARMUP_SHORT_SIDE: clip length and short side of the synthetic input
+# - WARMUP_TIMEOUT_S: give up waiting for the warm-up prompt after this long
+WARMUP_ON_BOOT = os.environ.get("WARMUP_ON_BOOT", "false").lower() == "true"
+WARMUP_WORKFLOW = os.environ.get("WARMUP_WORKFLOW", "/warmup_workflow.json")
+WARMUP_SECONDS = int(os.environ.get("WARMUP_SECONDS", 1))
+WARMUP_SHORT_SIDE = int(os.environ.get("WARMUP_SHORT_SIDE", 128))
+WARMUP_FPS = int(os.environ.get("WARMUP_FPS", 8))
+WARMUP_TIMEOUT_S = int(os.environ.get("WARMUP_TIMEOUT_S", 1200))
+
+WARMUP_VIDEO_NAME = "warmup_input.mp4"
+WARMUP_IMAGE_NAME = "warmup_input.png"
+
+
+def _make_warmup_inputs(workdir):
+    """
+    Generate a short synthetic test video and reference image with ffmpeg.
+
+    Returns:
+        tuple: (video_path, image_path)
+    """
+    short = _even(WARMUP_SHORT_SIDE)
+    size = f"{_even(short * 16 // 9)}x{short}"
+    video_path = os.path.join(workdir, WARMUP_VIDEO_NAME)
+    image_path = os.path.join(workdir, WARMUP_IMAGE_NAME)
+    for cmd in (
+        ["-f", "lavfi", "-i", f"testsrc2=size={size}:rate={WARMUP_FPS}", "-t", str(WARMUP_SECONDS),
+         "-c:v", "libx264", "-pix_fmt", "yuv420p", video_path],
+        ["-f", "lavfi", "-i", f"testsrc2=size={short}x{short}", "-frames:v", "1", image_path],
+    ):
+        result = subprocess.run(["ffmpeg", "-v", "error", "-y"] + cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[:300]}")
+    return video_path, image_path
+
+
+def build_warmup_prompt(workflow):
+    """
+    Turn a workflow into a minimal warm-up prompt.
+
+    Every video/image loader reads the synthetic inputs, the clip length and
+    short side nodes are set to the warm-up values, and the graph pass drops
+    display-only nodes.
+
+    Args:
+        workflow (dict): API-format workflow, modified in place.
+
+    Returns:
+        dict: The warm-up prompt.
+    """
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        class_type = node.get("class_type", "")
+        if class_type.startswith("VHS_LoadVideo") and isinstance(inputs.get("video"), str):
+            inputs["video"] = WARMUP_VIDEO_NAME
+        elif class_type == "LoadImage" and isinstance(inputs.get("image"), str):
+            inputs["image"] = WARMUP_IMAGE_NAME
+    for node_id, value in ((INPUT_SECONDS_NODE, WARMUP_SECONDS), (INPUT_SHORT_SIDE_NODE, WARMUP_SHORT_SIDE)):
+        if node_id in workflow and not _is_link(workflow[node_id].get("inputs", {}).get("value")):
+            workflow[node_id]["inputs"]["value"] = value
+    optimize_workflow(workflow)
+    return workflow
+
+
+def _remove_warmup_outputs(prompt_id):
+    """Delete the files the warm-up prompt saved, when they are on local disk."""
+    try:
+        outputs = get_history(prompt_id).get(prompt_id, {}).get("outputs", {})
+    except (requests.RequestException, ValueError):
+        return
+    for _, file_info in _iter_output_files(outputs, [], quiet=True):
+        path = comfy_output_path(file_info)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def run_warmup():
+    """
+    Run the warm-up prompt and log how long each model loader took.
+
+    Failures are logged and never prevent the worker from starting.
+
+    Returns:
+        dict: Node ID -> seconds for every node that executed, or None if the
+            warm-up was disabled or failed.
+    """
+    if not WARMUP_ON_BOOT:
+        return None
+    start = time.monotonic()
+    try:
+        with open(WARMUP_WORKFLOW, "r", encoding="utf-8") as f:
+            workflow = json.load(f)
+        workflow = workflow.get("input", {}).get("workflow", workflow)
+    except (OSError, ValueError) as e:
+        print(f"worker-comfyui - Warm-up skipped: cannot read {WARMUP_WORKFLOW}: {e}")
+        return None
+
+    ready_error = wait_for_comfy_ready(f"http://{COMFY_HOST}/")
+    if ready_error:
+        print(f"worker-comfyui - Warm-up skipped: {ready_error}")
+        return None
+
+    ws = None
+    try:
+        with tempfile.TemporaryDirectory(prefix="warmup-") as workdir:
+            video_path, image_path = _make_warmup_inputs(workdir)
+            for name, content_type, path in (
+                (WARMUP_VIDEO_NAME, "video/mp4", video_path),
+                (WARMUP_IMAGE_NAME, "image/png", image_path),
+            ):
+                metrics = {"bytes": 0, "peak_rss_bytes": _current_rss_bytes()}
+                deliver_input_from_path(name, content_type, path, metrics, 60)
+
+        prompt = build_warmup_prompt(workflow)
+        client_id = str(uuid.uuid4())
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://{COMFY_HOST}/ws?clientId={client_id}", timeout=10)
+        prompt_id = queue_workflow(prompt, client_id)["prompt_id"]
+        print(f"worker-comfyui - Warm-up prompt {prompt_id} queued ({len(prompt)} nodes)")
+
+        node_times = {}
+        current, current_start = None, None
+        deadline = time.monotonic() + WARMUP_TIMEOUT_S
+        error = None
+        while True:
+            ws.settimeout(max(1, deadline - time.monotonic()))
+            message = ws.recv()
+            if not isinstance(message, str):
+                continue
+            message = json.loads(message)
+            data = message.get("data", {})
+            if data.get("prompt_id") not in (None, prompt_id):
+                continue
+            now = time.monotonic()
+            if message.get("type") in ("executing", "execution_success", "execution_error"):
+                if current is not None:
+                    node_times[current] = round(now - current_start, 3)
+                current, current_start = data.get("node"), now
+            if message.get("type") == "execution_error":
+                error = data.get("exception_message", "unknown error")
+                break
+            if message.get("type") == "execution_success" or (
+                message.get("type") == "executing" and data.get("node") is None
+            ):
+                break
+            if now > deadline:
+                error = f"timed out after {WARMUP_TIMEOUT_S}s"
+                break
+    except Exception as e:
+        print(f"worker-comfyui - Warm-up failed after {time.monotonic() - start:.1f}s: {e}")
+        return None
+    finally:
+        if ws and ws.connected:
+            ws.close()
+
+    for node_id, seconds in sorted(node_times.items(), key=lambda kv: -kv[1]):
+        class_type = prompt.get(node_id, {}).get("class_type", "")
+        if "Load" in class_type:
+            print(f"worker-comfyui - Warm-up loader {node_id} ({class_type}): {seconds:.2f}s")
+    _remove_warmup_outputs(prompt_id)
+    _mark_boot_event("warmup_done")
+    if error:
+        # 加载节点在出错前通常已执行, 权重仍已驻留
+        print(f"worker-comfyui - Warm-up prompt failed ({error}); models loaded before the failure stay resident")
+    print(
+        f"worker-comfyui - Warm-up finished in {time.monotonic() - start:.1f}s "
+        f"({len(node_times)} node(s) executed)"
+    )
+    return node_times
+
+'''
+
+# 在 validate_input 之前插入预热逻辑
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    warmup_code + "\ndef validate_input(job_input):",
+    1,
+)
+
+# 开始接单前执行预热
+content = content.replace(
+    "    log_kernel_cache_restore()",
+    "    log_kernel_cache_restore()\n    run_warmup()",
+    1,
+)
+
+# ============================================================================
+# 19. 批量模式: 一次调用中用同一 workflow 处理多个动作视频, 输入只暂存一次, prompt 连续排队
+# ============================================================================
+batch_code = '''
+# Batch mode: "batch" runs the workflow once per item (a motion video plus
+# optional prompt/seconds/seed overrides) in a single job. Shared inputs and
+# every item video are staged once, then all prompts are queued back to back
+# so ComfyUI keeps the loaded models and reuses cached nodes between items.
+# - BATCH_MAX_ITEMS: largest accepted batch
+# - BATCH_PROMPT_NODE / BATCH_PROMPT_INPUT: node and input receiving "prompt"
+# - BATCH_SEED_NODE / BATCH_SEED_INPUT: node and input receiving "seed"
+# "seconds" goes to INPUT_SECONDS_NODE.
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 16))
+BATCH_PROMPT_NODE = os.environ.get("BATCH_PROMPT_NODE", "154")
+BATCH_PROMPT_INPUT = os.environ.get("BATCH_PROMPT_INPUT", "text")
+BATCH_SEED_NODE = os.environ.get("BATCH_SEED_NODE", "86")
+BATCH_SEED_INPUT = os.environ.get("BATCH_SEED_INPUT", "seed")
+
+
+def parse_batch(batch):
+    """
+    Validate the "batch" job input.
+
+    Args:
+        batch: The raw "batch" value, or None.
+
+    Returns:
+        tuple: (items or None, error message or None). Every item gets an "id"
+            (its index unless one was given).
+    """
+    if batch is None:
+        return None, None
+    if not isinstance(batch, list) or not batch:
+        return None, "'batch' must be a non-empty list"
+    if len(batch) > BATCH_MAX_ITEMS:
+        return None, f"'batch' has {len(batch)} items, the limit is {BATCH_MAX_ITEMS}"
+
+    items, sources, ids = [], {}, set()
+    for index, item in enumerate(batch):
+        if not isinstance(item, dict):
+            return None, "Each batch item must be an object"
+        video = item.get("video")
+        if not isinstance(video, dict) or "name" not in video:
+            return None, "Each batch item must have a 'video' object with a 'name' field"
+        if "video" not in video and "url" not in video:
+            return None, "Each batch video must have either 'video' (base64) or 'url' field"
+        # 同名视频只暂存一次, 因此必须来自同一来源
+        source = (video.get("url"), video.get("video"))
+        if sources.setdefault(video["name"], source) != source:
+            return None, f"Batch items use the video name '{video['name']}' for different sources"
+        if "prompt" in item and not isinstance(item["prompt"], str):
+            return None, "Batch item 'prompt' must be a string"
+        seconds = item.get("seconds")
+        if seconds is not None and (isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or seconds <= 0):
+            return None, "Batch item 'seconds' must be a positive number"
+        seed = item.get("seed")
+        if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+            return None, "Batch item 'seed' must be an integer"
+        item_id = str(item.get("id", index))
+        if item_id in ids:
+            return None, f"Duplicate batch item id '{item_id}'"
+        ids.add(item_id)
+        items.append(dict(item, id=item_id))
+    return items, None
+
+
+def build_batch_workflow(workflow, item):
+    """
+    Apply one batch item to a copy of the workflow.
+
+    Every video loader reads the item's video; prompt, seconds and seed
+    overrides are written to their nodes when those hold literal values.
+
+    Returns:
+        dict: The item's workflow.
+    """
+    workflow = copy.deepcopy(workflow)
+    for node in workflow.values():
+        inputs = node.get("inputs", {})
+        if node.get("class_type", "").startswith("VHS_LoadVideo") and isinstance(inputs.get("video"), str):
+            inputs["video"] = item["video"]["name"]
+    for key, node_id, input_name in (
+        ("prompt", BATCH_PROMPT_NODE, BATCH_PROMPT_INPUT),
+        ("seconds", INPUT_SECONDS_NODE, "value"),
+        ("seed", BATCH_SEED_NODE, BATCH_SEED_INPUT),
+    ):
+        if item.get(key) is None:
+            continue
+        inputs = (workflow.get(node_id) or {}).get("inputs")
+        if inputs is None or _is_link(inputs.get(input_name)):
+            print(f"worker-comfyui - Batch item {item['id']}: node {node_id} has no literal '{input_name}', ignoring '{key}'")
+            continue
+        inputs[input_name] = item[key]
+    return workflow
+
+
+def _normalize_batch_videos(items):
+    """
+    Normalise each distinct batch video once.
+
+    A video shared by several items is trimmed for the longest of them.
+
+    Returns:
+        dict: Video name -> error message, for the videos that were rejected.
+    """
+    longest = {}
+    for item in items:
+        if item["workflow"] is None:
+            continue
+        name = item["video"]["name"]
+        seconds = _workflow_number(item["workflow"], INPUT_SECONDS_NODE) or 0
+        if name not in longest or seconds > longest[name][0]:
+            longest[name] = (seconds, item)
+    rejected = {}
+    for name, (_, item) in longest.items():
+        result = normalize_inputs(item["workflow"], None, [item["video"]])
+        if result["status"] == "error":
+            rejected[name] = "; ".join(result["details"])
+    return rejected
+
+
+def _finish_batch_item(item, job_id):
+    """Fetch an item's history and collect its outputs (runs on the finisher thread)."""
+    try:
+        outputs = get_history(item["prompt_id"]).get(item["prompt_id"], {}).get("outputs", {})
+    except (requests.RequestException, ValueError) as e:
+        item["errors"].append(f"Failed to fetch history: {e}")
+        outputs = {}
+    if not outputs and not item["errors"]:
+        item["errors"].append(f"No outputs found in history for prompt {item['prompt_id']}.")
+    item["images"] = finish_output_collection(item["collection"], outputs, item["errors"])
+    item["collected_at"] = time.monotonic()
+
+
+def _batch_item_result(item, batch_start):
+    """Build the response entry of one batch item."""
+    def since(start, end):
+        return round(end - start, 3) if start is not None and end is not None else None
+
+    result = {
+        "id": item["id"],
+        "video": item["video"]["name"],
+        "prompt_id": item.get("prompt_id"),
+        "images": item.get("images", []),
+        "timings": {
+            "queued_at": since(batch_start, item.get("queued_at")),
+            "wait": since(item.get("queued_at"), item.get("started_at")),
+            "execution": since(item.get("started_at"), item.get("done_at")),
+            "outputs": since(item.get("done_at"), item.get("collected_at")),
+            "total": since(item.get("queued_at"), item.get("collected_at")),
+        },
+    }
+    if item.get("cached_nodes"):
+        result["cached_nodes"] = item["cached_nodes"]
+    if item.get("skipped_outputs"):
+        result["skipped_outputs"] = item["skipped_outputs"]
+    if item["errors"]:
+        result["errors"] = item["errors"]
+    return result
+
+
+def run_batch(job_id, validated_data):
+    """
+    Run every batch item through the workflow within one job.
+
+    Inputs are staged once, each item's prompt is queued right after the
+    previous one, and each item's outputs are collected on a finisher thread
+    as soon as its prompt completes, while the next prompt runs.
+
+    Args:
+        job_id (str): The job ID.
+        validated_data (dict): Output of validate_input() with a "batch".
+
+    Returns:
+        dict: {"batch": [per-item results]}, or {"error": ...} if no item could
+            be run. Job-level stage timings are added by handler().
+    """
+    batch_start = time.monotonic()
+    job_timings = _job_timings.get(job_id) or begin_job_timings(job_id)
+    items = [dict(item, errors=[], workflow=None) for item in validated_data["batch"]]
+
+    ready_error = wait_for_comfy_ready(f"http://{COMFY_HOST}/")
+    if ready_error:
+        return {"error": ready_error}
+    mark_stage(job_timings, "comfy_ready")
+
+    # 共享输入与所有条目的视频只暂存一次
+    input_images = validated_data.get("images")
+    shared_videos = validated_data.get("videos") or []
+    batch_videos = list({item["video"]["name"]: item["video"] for item in items}.values())
+    upload_result = stage_inputs(input_images, shared_videos + batch_videos)
+    job_timings["inputs"] = upload_result["timings"]
+    mark_stage(job_timings, "input_staging")
+    if upload_result["status"] == "error":
+        return {
+            "error": "Failed to upload one or more input images/videos",
+            "details": upload_result["details"],
+        }
+
+    base_workflow = validated_data["workflow"]
+    normalize_result = normalize_inputs(base_workflow, input_images, shared_videos)
+    if normalize_result["status"] == "error":
+        return {
+            "error": "Request rejected by input limits",
+            "details": normalize_result["details"],
+        }
+    for item in items:
+        workflow = build_batch_workflow(base_workflow, item)
+        limit_errors = check_request_limits(workflow)
+        if limit_errors:
+            item["errors"].extend(limit_errors)
+        else:
+            item["workflow"] = workflow
+    rejected = _normalize_batch_videos(items)
+    mark_stage(job_timings, "input_normalize")
+    for item in items:
+        if item["workflow"] is None:
+            continue
+        if item["video"]["name"] in rejected:
+            item["errors"].append(rejected[item["video"]["name"]])
+            item["workflow"] = None
+            continue
+        apply_shape_buckets(item["workflow"])
+        output_plan = plan_outputs(item["workflow"], validated_data.get("outputs"))
+        optimize_workflow(item["workflow"], output_plan["nodes"])
+        item["skipped_outputs"] = unexecuted_outputs(output_plan, item["workflow"])
+        if not item["workflow"]:
+            item["errors"].append("None of the selected outputs can be produced by this workflow")
+            item["workflow"] = None
+    job_timings["workflow"] = base_workflow
+    mark_stage(job_timings, "prepare_workflow")
+
+    runnable = [item for item in items if item["workflow"] is not None]
+    ws = None
+    client_id = str(uuid.uuid4())
+    finisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-finish")
+    pending = {}
+    try:
+        ws_url = f"ws://{COMFY_HOST}/ws?clientId={client_id}"
+        ws = websocket.WebSocket()
+        ws.connect(ws_url, timeout=10)
+        mark_stage(job_timings, "ws_connect")
+
+        for item in runnable:
+            try:
+                queued = queue_workflow(
+                    item["workflow"],
+                    client_id,
+                    comfy_org_api_key=validated_data.get("comfy_org_api_key"),
+                )
+            except (requests.RequestException, ValueError) as e:
+                item["errors"].append(f"Error queuing workflow: {e}")
+                continue
+            item["prompt_id"] = queued.get("prompt_id")
+            item["queued_at"] = time.monotonic()
+            item["collection"] = begin_output_collection(job_id, validated_data.get("outputs"), item["skipped_outputs"])
+            pending[item["prompt_id"]] = item
+        print(f"worker-comfyui - Batch: queued {len(pending)} of {len(items)} item(s) back to back")
+        mark_stage(job_timings, "queue")
+
+        finishing = []
+        while pending:
+            try:
+                out = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                print(f"worker-comfyui - Websocket receive timed out. {len(pending)} batch item(s) still running...")
+                continue
+            except websocket.WebSocketConnectionClosedException as closed_err:
+                ws = _attempt_websocket_reconnect(
+                    ws_url, WEBSOCKET_RECONNECT_ATTEMPTS, WEBSOCKET_RECONNECT_DELAY_S, closed_err
+                )
+                continue
+            if not isinstance(out, str):
+                continue
+            try:
+                message = json.loads(out)
+            except json.JSONDecodeError:
+                continue
+            data = message.get("data", {})
+            item = pending.get(data.get("prompt_id"))
+            if item is None:
+                continue
+            message_type = message.get("type")
+            if message_type in ("execution_start", "executing"):
+                item.setdefault("started_at", time.monotonic())
+            if message_type == "execution_cached":
+                item["cached_nodes"] = len(data.get("nodes", []))
+            elif message_type == "executed" and data.get("output"):
+                submit_node_outputs(item["collection"], data.get("node"), data["output"])
+            elif message_type == "execution_error":
+                item["errors"].append(
+                    f"Workflow execution error: Node Type: {data.get('node_type')}, "
+                    f"Node ID: {data.get('node_id')}, Message: {data.get('exception_message')}"
+                )
+            if message_type == "execution_error" or (message_type == "executing" and data.get("node") is None):
+                item["done_at"] = time.monotonic()
+                item.setdefault("started_at", item["queued_at"])
+                del pending[item["prompt_id"]]
+                print(
+                    f"worker-comfyui - Batch item {item['id']} finished in "
+                    f"{item['done_at'] - item['started_at']:.2f}s ({len(pending)} remaining)"
+                )
+                finishing.append(finisher.submit(_finish_batch_item, item, job_id))
+        mark_stage(job_timings, "execution")
+        for future in finishing:
+            future.result()
+        mark_stage(job_timings, "outputs")
+    except websocket.WebSocketException as e:
+        print(f"worker-comfyui - WebSocket Error during batch: {e}")
+        for item in pending.values():
+            item["errors"].append(f"WebSocket communication error: {e}")
+    finally:
+        finisher.shutdown(wait=True)
+        for item in pending.values():
+            item["collection"]["pool"].shutdown(wait=False)
+        if ws and ws.connected:
+            ws.close()
+        publish_kernel_cache()
+
+    results = [_batch_item_result(item, batch_start) for item in items]
+    succeeded = sum(1 for result in results if result["images"] and "errors" not in result)
+    print(
+        f"worker-comfyui - Batch finished: {succeeded}/{len(results)} item(s) succeeded "
+        f"in {time.monotonic() - batch_start:.2f}s"
+    )
+    if not any(result["images"] for result in results):
+        return {"error": "All batch items failed", "batch": results}
+    return {"batch": results}
+
+'''
+
+# 在 validate_input 之前插入批量模式
+content = content.replace(
+    "\ndef validate_input(job_input):",
+    batch_code + "\ndef validate_input(job_input):",
+    1,
+)
+if "import copy\n" not in content:
+    content = content.replace("import traceback\n", "import traceback\nimport copy\n", 1)
+
+# validate_input 校验 batch; 使用 batch 时不再需要顶层 videos
+content = content.replace(
+    "    # Optional: API key for Comfy.org API Nodes, passed per-request\n",
+    '''    # Optional: run the workflow once per batch item (video + overrides)
+    batch, batch_error = parse_batch(job_input.get("batch"))
+    if batch_error:
+        return None, batch_error
+
+    # Optional: API key for Comfy.org API Nodes, passed per-request
+''',
+    1,
+)
+content = content.replace(
+    '''        "outputs": outputs,
+    }, None''',
+    '''        "outputs": outputs,
+        "batch": batch,
+    }, None''',
+    1,
+)
+
+# 带 batch 的任务交给 run_batch
+content = content.replace(
+    '''    input_images = validated_data.get("images")
+
+    # Make sure that the ComfyUI HTTP API is available before proceeding''',
+    '''    input_images = validated_data.get("images")
+
+    if validated_data.get("batch"):
+        return run_batch(job_id, validated_data)
+
+    # Make sure that the ComfyUI HTTP API is available before proceeding''',
+    1,
+)
+
+# ============================================================================
+# 20. 分阶段耗时: 每个 job 的各阶段单调计时与节点执行时间, 随结果返回并输出一行结构化日志
+# ============================================================================
+job_timings_code = '''
+# Per-job timing breakdown. Every handler stage is timed with time.monotonic();
+# node execution times come from ComfyUI's websocket events. The breakdown is
+# returned as "timings" in the job output and logged as one JSON line
+# ("worker-comfyui - timings {...}").
+# - JOB_TIMINGS_LOG: emit the structured log line
+JOB_TIMINGS_LOG = os.environ.get("JOB_TIMINGS_LOG", "true").lower() == "true"
+
+_job_timings = {}
+
+
+def begin_job_timings(job_id):
+    """
+    Start timing a job.
+
+    Returns:
+        dict: Timing state passed to mark_stage() and track_execution_event().
+    """
+    now = time.monotonic()
+    timings = {
+        "start": now,
+        "last": now,
+        "stages": {},
+        "inputs": [],
+        "outputs": [],
+        "nodes": {},
+        "cached_nodes": [],
+        "current_node": None,
+        "workflow": {},
+    }
+    _job_timings[job_id] = timings
+    return timings
+
+
+def mark_stage(timings, name):
+    """Record the time since the previous mark as stage 'name' (repeated stages add up)."""
+    now = time.monotonic()
+    timings["stages"][name] = round(timings["stages"].get(name, 0.0) + now - timings["last"], 3)
+    timings["last"] = now
+
+
+def track_execution_event(timings, message, prompt_id):
+    """
+    Update node timings from one websocket message.
+
+    A node runs from its "executing" event until the next "executing",
+    "execution_success" or "execution_error" event of the same prompt.
+
+    Args:
+        timings (dict): State from begin_job_timings().
+        message (dict): The decoded websocket message.
+        prompt_id (str): The prompt being timed; other prompts are ignored.
+    """
+    data = message.get("data") or {}
+    if data.get("prompt_id") != prompt_id:
+        return
+    message_type = message.get("type")
+    now = time.monotonic()
+    if message_type == "execution_cached":
+        timings["cached_nodes"].extend(data.get("nodes") or [])
+    if message_type not in ("execution_start", "executing", "execution_success", "execution_error", "execution_interrupted"):
+        return
+    timings.setdefault("execution_start", now)
+    current = timings["current_node"]
+    if current is not None:
+        node_id, node_start = current
+        timings["nodes"][node_id] = timings["nodes"].get(node_id, 0.0) + now - node_start
+    node_id = data.get("node") if message_type == "executing" else None
+    timings["current_node"] = (node_id, now) if node_id is not None else None
+
+
+def mark_execution(timings):
+    """
+    Close the execution stage, split into the wait in ComfyUI's queue
+    ("execution_wait") and the run itself ("execution").
+    """
+    started = timings.get("execution_start")
+    if started is not None and started >= timings["last"]:
+        timings["stages"]["execution_wait"] = round(started - timings["last"], 3)
+        timings["last"] = started
+    mark_stage(timings, "execution")
+
+
+def finish_job_timings(job_id):
+    """
+    Summarise and log a job's timings.
+
+    Returns:
+        dict: {"total", "stages", "inputs", "outputs", "nodes", "cached_nodes"}, or None if
+            the job was never timed.
+    """
+    timings = _job_timings.pop(job_id, None)
+    if timings is None:
+        return None
+    workflow = timings["workflow"] or {}
+    summary = {
+        "total": round(time.monotonic() - timings["start"], 3),
+        "stages": timings["stages"],
+        "inputs": timings["inputs"],
+        "outputs": [
+            {"filename": entry.get("filename"), "upload_seconds": entry.get("upload_seconds")}
+            for entry in timings["outputs"]
+        ],
+        "nodes": [
+            {
+                "node_id": node_id,
+                "class_type": (workflow.get(node_id) or {}).get("class_type"),
+                "seconds": round(seconds, 3),
+            }
+            for node_id, seconds in timings["nodes"].items()
+        ],
+        "cached_nodes": len(timings["cached_nodes"]),
+    }
+    if JOB_TIMINGS_LOG:
+        line = json.dumps(dict(job_id=job_id, **summary), ensure_ascii=False, separators=(",", ":"))
+        print(f"worker-comfyui - timings {line}")
+    return summary
+
+
+def handler(job):
+    """
+    Run a job and attach its timing breakdown to the result.
+
+    Args:
+        job (dict): A dictionary containing job details and input parameters.
+
+    Returns:
+        dict: The result of _run_job() with "timings" added.
+    """
+    try:
+        result = _run_job(job)
+    finally:
+        summary = finish_job_timings(job["id"])
+    if isinstance(result, dict) and summary is not None:
+        result["timings"] = summary
+    return result
+
+'''
+
+# 原 handler 改名为 _run_job, 由带计时的 handler 包装
+content = content.replace("\ndef handler(job):\n", "\ndef _run_job(job):\n", 1)
+content = content.replace(
+    '\nif __name__ == "__main__":',
+    job_timings_code + '\nif __name__ == "__main__":',
+    1,
+)
+
+# 在 _run_job 的各阶段之间打点
+for anchor, mark in (
+    (
+        '    job_input = job["input"]\n    job_id = job["id"]\n    comfy_connections_start = comfy_connections_opened()\n',
+        '    job_timings = begin_job_timings(job_id)\n',
+    ),
+    ("    validated_data, error_message = validate_input(job_input)\n", '    mark_stage(job_timings, "validate")\n'),
+    (
+        '''    if input_images or input_videos:
+        upload_result = stage_inputs(input_images, input_videos)
+''',
+        '        job_timings["inputs"] = upload_result["timings"]\n',
+    ),
+    ("    skipped_outputs = unexecuted_outputs(output_plan, workflow)\n", '    job_timings["workflow"] = workflow\n    mark_stage(job_timings, "prepare_workflow")\n'),
+    ('        print(f"worker-comfyui - Websocket connected")\n', '        mark_stage(job_timings, "ws_connect")\n'),
+    ('            print(f"worker-comfyui - Queued workflow with ID: {prompt_id}")\n', '            mark_stage(job_timings, "queue")\n'),
+    ("\n                    message = json.loads(out)\n", "                    track_execution_event(job_timings, message, prompt_id)\n"),
+    ("        history = get_history(prompt_id)\n", '        mark_stage(job_timings, "history")\n'),
+    (
+        "        output_data.extend(finish_output_collection(output_collection, outputs, errors))\n",
+        '        mark_stage(job_timings, "outputs")\n        job_timings["outputs"] = output_data\n',
+    ),
+):
+    content = content.replace(anchor, anchor + mark, 1)
+
+for anchor, mark in (
+    ("\n    # Stage input images and videos concurrently\n", '    mark_stage(job_timings, "comfy_ready")\n'),
+    ("\n    # Check limits and normalise inputs before any GPU time is spent\n", '    mark_stage(job_timings, "input_staging")\n'),
+    ("\n    # Snap width/height/frame count to shared shapes for compiled-kernel reuse\n", '    mark_stage(job_timings, "input_normalize")\n'),
+    ("\n        if not execution_done and not errors:\n", "        mark_execution(job_timings)\n"),
+):
+    content = content.replace(anchor, "\n" + mark + anchor, 1)
+
 # 写回文件
 with open('/handler.py', 'w', encoding='utf-8') as f:
     f.write(content)
@@ -682,11 +4189,30 @@ print("Changes made:")
 print("1. Added OSS upload functionality using alibabacloud_oss_v2 SDK")
 print("   - get_oss_client(): Creates OSS client with V4 signature")
 print("   - upload_to_oss(): Uploads file bytes to OSS")
-print("2. Added download_from_url helper function")
-print("3. Updated upload_images to support URL downloads")
-print("4. Added upload_videos function for video uploads")
+print("   - upload_file_to_oss(): Streams a file on disk to OSS")
+print("   - start_oss_prewarm(): pooled client warmed at boot with periodic health check")
+print("   - Resumable parallel multipart upload above OSS_MULTIPART_THRESHOLD")
+print("2. Added streaming URL ingest (stream_url_to_comfy), no full-file buffering")
+print("   - Chunked base64 decoding with a per-job memory budget and spill-to-disk")
+print("3. Replaced upload_images with stage_inputs(): images/videos (base64 or URL) staged concurrently")
+print("4. Added video inputs (INPUT_STAGING_CONCURRENCY bounds concurrent transfers)")
+print("   - Content-addressed input cache with LRU eviction (INPUT_CACHE_DIR, INPUT_CACHE_MAX_BYTES)")
+print("   - Direct-to-disk input placement when ComfyUI is co-located (INPUT_PLACEMENT)")
 print("5. Updated validate_input to support images URL and videos")
 print("6. Updated handler to use OSS for output uploads (with S3 fallback)")
+print("7. Routed all ComfyUI HTTP calls through a shared pooled session (comfy_session)")
+print("8. Adaptive readiness gate with process-death detection and boot timeline (wait_for_comfy_ready)")
+print("9. ffmpeg input normalisation and request limits before queueing (normalize_inputs)")
+print("10. Resolution/frame-count bucketing of nodes 181/183/166 (apply_shape_buckets)")
+print("11. Kernel cache restore stats at boot and background publish after each job (publish_kernel_cache)")
+print("12. Workflow graph pass: constant switches, duplicate loaders, output pruning (optimize_workflow)")
+print("13. outputs selector: unselected outputs are not executed, read or uploaded (skipped_outputs)")
+print("14. Optional boot-time warm-up prompt with per-loader timing (run_warmup)")
+print("15. Batch mode: one job runs the workflow per batch item, prompts queued back to back (run_batch)")
+print("16. Per-stage and per-node timings returned as 'timings' and logged as one JSON line")
+print("   - collect_outputs(): fetches next output while earlier ones upload (OUTPUT_UPLOAD_CONCURRENCY)")
+print("   - Outputs start uploading on each node's 'executed' event")
+print("   - stream_handler(): generator mode yielding each output as it is stored (STREAM_OUTPUTS)")
 print("")
 print("Required environment variables for OSS:")
 print("  - OSS_ACCESS_KEY_ID (or ALIBABA_CLOUD_ACCESS_KEY_ID)")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+启动时在后台预读模型文件到页缓存
+
+setup_model_links.sh 只把 /comfyui/models/* 链接到网络卷上的快照目录，第一次加载
+safetensors 时才会通过网络文件系统同步读取几十 GB。本脚本在 ComfyUI 启动的同时并行读取
+模型文件，使 ComfyUI 加载时命中页缓存：
+
+- 先按 workflow 中加载节点的顺序读取其引用的模型，再读取其余模型文件
+- 大文件切分为多个区段，由 PREFETCH_CONCURRENCY 个线程并行读取
+- 总读取量不超过 PREFETCH_MAX_BYTES (默认为可用内存的 80%)，避免把先读入的文件挤出页缓存
+- 每隔 PREFETCH_PROGRESS_INTERVAL 秒输出一次进度
+
+使用方法 (在 /start.sh 中后台执行，不阻塞就绪检测):
+   python3 /prefetch_models.py &
+
+环境变量:
+  PREFETCH_MODELS: 是否启用 (默认 true)
+  PREFETCH_MODELS_DIR: 模型目录 (默认 /comfyui/models)
+  PREFETCH_WORKFLOW: 决定读取顺序的 workflow (默认 /warmup_workflow.json)
+  PREFETCH_CONCURRENCY: 并行读取线程数 (默认 8)
+  PREFETCH_SEGMENT_MB: 每个读取区段的大小 (默认 256)
+  PREFETCH_MAX_BYTES: 最多预读的字节数，0 表示按可用内存决定
+  PREFETCH_PROGRESS_INTERVAL: 进度输出间隔秒数 (默认 10)
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+ENABLED = os.environ.get("PREFETCH_MODELS", "true").lower() == "true"
+MODELS_DIR = os.environ.get("PREFETCH_MODELS_DIR", "/comfyui/models")
+WORKFLOW = os.environ.get("PREFETCH_WORKFLOW", "/warmup_workflow.json")
+CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", 8))
+SEGMENT_BYTES = int(os.environ.get("PREFETCH_SEGMENT_MB", 256)) * 1024 * 1024
+MAX_BYTES = int(os.environ.get("PREFETCH_MAX_BYTES", 0))
+PROGRESS_INTERVAL = float(os.environ.get("PREFETCH_PROGRESS_INTERVAL", 10))
+
+MODEL_EXTENSIONS = (".safetensors", ".sft", ".ckpt", ".pt", ".pth", ".bin", ".onnx", ".gguf")
+READ_CHUNK = 8 * 1024 * 1024
+
+_log_lock = threading.Lock()
+
+
+def log(message: str) -> None:
+    with _log_lock:
+        print(f"prefetch-models - {message}", flush=True)
+
+
+def index_models(root: str) -> Dict[str, str]:
+    """
+    建立模型文件索引 (跟随符号链接)
+
+    Args:
+        root: 模型根目录
+
+    Returns:
+        {相对于类别目录的路径 (如 "wan/x.safetensors") 或文件名: 真实路径}
+    """
+    index = {}
+    for dirpath, _, filenames in os.walk(root, followlinks=True):
+        for name in filenames:
+            if not name.endswith(MODEL_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root).split(os.sep, 1)
+            real = os.path.realpath(path)
+            if len(rel) == 2:
+                index.setdefault(rel[1].replace(os.sep, "/"), real)
+            index.setdefault(name, real)
+    return index
+
+
+def workflow_model_names(path: str) -> List[str]:
+    """
+    按加载顺序列出 workflow 引用的模型文件名
+
+    ComfyUI 先执行没有上游依赖的节点，所以按依赖深度、再按节点 ID 排序。
+
+    Args:
+        path: API 格式的 workflow 文件
+
+    Returns:
+        模型文件名列表 (可能包含子目录，如 "wan/x.safetensors")
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            workflow = json.load(f)
+    except (OSError, ValueError) as e:
+        log(f"No workflow order ({path}: {e}); reading models in directory order")
+        return []
+    workflow = workflow.get("input", {}).get("workflow", workflow)
+
+    depth = {}
+
+    def node_depth(node_id, seen=()):
+        if node_id in depth:
+            return depth[node_id]
+        if node_id in seen or node_id not in workflow:
+            return 0
+        links = [
+            v[0] for v in workflow[node_id].get("inputs", {}).values()
+            if isinstance(v, list) and len(v) == 2 and isinstance(v[0], str)
+        ]
+        depth[node_id] = 1 + max((node_depth(l, seen + (node_id,)) for l in links), default=-1)
+        return depth[node_id]
+
+    def id_key(node_id):
+        return (0, int(node_id)) if node_id.isdigit() else (1, node_id)
+
+    names = []
+    for node_id in sorted(workflow, key=lambda n: (node_depth(n), id_key(n))):
+        for value in workflow[node_id].get("inputs", {}).values():
+            if isinstance(value, str) and value.endswith(MODEL_EXTENSIONS) and value not in names:
+                names.append(value)
+    return names
+
+
+def plan(index: Dict[str, str], names: List[str]) -> List[Tuple[str, int]]:
+    """
+    确定读取顺序：workflow 引用的模型在前，其余模型在后，按真实路径去重
+
+    Returns:
+        [(真实路径, 大小)]
+    """
+    ordered, seen = [], set()
+    for name in names:
+        real = index.get(name.replace("\\", "/")) or index.get(os.path.basename(name))
+        if real is None:
+            log(f"Model referenced by workflow not found: {name}")
+        elif real not in seen:
+            seen.add(real)
+            ordered.append(real)
+    ordered += sorted(p for p in set(index.values()) if p not in seen)
+
+    files = []
+    for path in ordered:
+        try:
+            files.append((path, os.path.getsize(path)))
+        except OSError as e:
+            log(f"Skipping {path}: {e}")
+    return files
+
+
+def available_memory() -> int:
+    """读取 /proc/meminfo 中的 MemAvailable (字节)，读取失败时返回 0"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class Progress:
+    """线程安全的进度统计，定期输出一行日志"""
+
+    def __init__(self, total_bytes: int, total_files: int):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.done_bytes = 0
+        self.done_files = 0
+        self.start = time.monotonic()
+        self.last = self.start
+        self.lock = threading.Lock()
+
+    def add(self, nbytes: int, file_done: bool = False) -> None:
+        with self.lock:
+            self.done_bytes += nbytes
+            self.done_files += int(file_done)
+            now = time.monotonic()
+            if now - self.last < PROGRESS_INTERVAL:
+                return
+            self.last = now
+        self.report()
+
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        log(
+            f"{'Done' if final else 'Progress'}: {self.done_bytes / 1024 ** 3:.1f}/{self.total_bytes / 1024 ** 3:.1f} GB "
+            f"({self.done_bytes / max(self.total_bytes, 1):.0%}), {self.done_files}/{self.total_files} files, "
+            f"{self.done_bytes / elapsed / 1024 ** 2:.0f} MB/s, {elapsed:.0f}s"
+        )
+
+
+def read_segment(path: str, offset: int, length: int, progress: Progress, remaining: Dict[str, int]) -> None:
+    """顺序读取文件的一个区段，数据直接丢弃，只留在页缓存中"""
+    try:
+        with open(path, "rb", buffering=0) as f:
+            buf = bytearray(min(READ_CHUNK, length))
+            view = memoryview(buf)
+            f.seek(offset)
+            left = length
+            while left > 0:
+                n = f.readinto(view[: min(len(buf), left)])
+                if not n:
+                    break
+                left -= n
+                progress.add(n)
+    except OSError as e:
+        log(f"Failed to read {path} at {offset}: {e}")
+    with progress.lock:
+        remaining[path] -= 1
+        finished = remaining[path] == 0
+    if finished:
+        progress.add(0, file_done=True)
+
+
+def prefetch() -> None:
+    if not ENABLED:
+        log("Disabled (PREFETCH_MODELS=false)")
+        return
+    if not os.path.isdir(MODELS_DIR):
+        log(f"Models directory not found: {MODELS_DIR}")
+        return
+
+    files = plan(index_models(MODELS_DIR), workflow_model_names(WORKFLOW))
+    budget = MAX_BYTES or int(available_memory() * 0.8)
+    selected, total = [], 0
+    for path, size in files:
+        if budget and total + size > budget:
+            log(f"Budget of {budget / 1024 ** 3:.1f} GB reached; not prefetching {path} and later files")
+            break
+        selected.append((path, size))
+        total += size
+    if not selected:
+        log("Nothing to prefetch")
+        return
+
+    log(f"Prefetching {len(selected)} files ({total / 1024 ** 3:.1f} GB) with {CONCURRENCY} threads")
+    progress = Progress(total, len(selected))
+    remaining = {}
+    segments = []
+    for path, size in selected:
+        offsets = range(0, max(size, 1), SEGMENT_BYTES)
+        remaining[path] = len(offsets)
+        segments += [(path, offset, min(SEGMENT_BYTES, size - offset)) for offset in offsets]
+
+    # 区段按顺序提交，线程池按提交顺序取任务，先引用的模型先读完
+    with ThreadPoolExecutor(max_workers=max(1, CONCURRENCY), thread_name_prefix="prefetch") as pool:
+        for path, offset, length in segments:
+            pool.submit(read_segment, path, offset, length, progress, remaining)
+    progress.report(final=True)
+
+
+if __name__ == "__main__":
+    try:
+        prefetch()
+    except Exception as e:
+        log(f"Prefetch aborted: {e}")
+        sys.exit(0)
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+RunPod Endpoint 负载与延迟基准测试
+
+复用 batch_test.py 的 build_request / submit_job / check_status，支持两种负载模式:
+
+- closed (闭环): 固定 --concurrency 个并发客户端，每个任务完成后才提交下一个
+- open (开环): 按 --rate (任务/秒) 提交，不等待之前的任务完成；默认为泊松到达
+
+所有进行中的任务由一个轮询线程每隔 --poll-interval 秒并发查询状态。
+报告统计排队时间 (delayTime)、执行时间 (executionTime)、端到端延迟 (提交到观测到完成)
+的 p50/p95/p99 以及吞吐量，并写入 JSON 文件，便于比较不同 worker 镜像版本。
+
+使用方法:
+   python3 benchmark.py --mode closed --concurrency 2 --jobs 10 --label v1.4
+   python3 benchmark.py --mode open --rate 0.05 --duration 600 --label v1.5
+   python3 benchmark.py --compare benchmark_v1.4.json benchmark_v1.5.json
+
+环境变量:
+  RUNPOD_API_KEY: RunPod API Key
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import batch_test
+from batch_test import REF_IMAGE, TEST_DIR, VIDEOS, build_request, check_status, submit_job
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED", "CANCELLED", "TIMED_OUT")
+PERCENTILES = (50, 95, 99)
+METRICS = ("queue", "execution", "e2e", "submit")
+
+_log_lock = threading.Lock()
+
+
+def log(message: str) -> None:
+    with _log_lock:
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """线性插值的百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: List[float]) -> Dict:
+    """统计一组延迟 (秒)"""
+    summary = {"count": len(values)}
+    if values:
+        summary.update({f"p{p}": round(percentile(values, p), 3) for p in PERCENTILES})
+        summary.update({
+            "mean": round(sum(values) / len(values), 3),
+            "min": round(min(values), 3),
+            "max": round(max(values), 3),
+        })
+    return summary
+
+
+class Job:
+    """一个基准任务的提交与状态记录"""
+
+    def __init__(self, index: int, video: str):
+        self.index = index
+        self.video = video
+        self.job_id: Optional[str] = None
+        self.status = "PENDING"
+        self.error: Optional[str] = None
+        self.submit_start: Optional[float] = None
+        self.submitted_at: Optional[float] = None
+        self.started_seen_at: Optional[float] = None
+        self.finished_seen_at: Optional[float] = None
+        self.delay_ms: Optional[float] = None
+        self.execution_ms: Optional[float] = None
+        self.output_timings: Optional[Dict] = None
+        self.done = threading.Event()
+
+    def record(self, bench_start: float) -> Dict:
+        def rel(t):
+            return round(t - bench_start, 3) if t is not None else None
+
+        return {
+            "index": self.index,
+            "video": self.video,
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "submit_at": rel(self.submit_start),
+            "submit_seconds": self.submit_seconds,
+            "queue_seconds": self.delay_ms / 1000 if self.delay_ms is not None else None,
+            "execution_seconds": self.execution_ms / 1000 if self.execution_ms is not None else None,
+            "e2e_seconds": self.e2e_seconds,
+            "started_seen_at": rel(self.started_seen_at),
+            "finished_seen_at": rel(self.finished_seen_at),
+            "timings": self.output_timings,
+        }
+
+    @property
+    def submit_seconds(self) -> Optional[float]:
+        if self.submit_start is None or self.submitted_at is None:
+            return None
+        return round(self.submitted_at - self.submit_start, 3)
+
+    @property
+    def e2e_seconds(self) -> Optional[float]:
+        if self.submit_start is None or self.finished_seen_at is None:
+            return None
+        return round(self.finished_seen_at - self.submit_start, 3)
+
+
+class Poller:
+    """
+    后台轮询所有进行中的任务
+
+    每一轮对所有未结束的任务并发调用 check_status，端到端延迟的分辨率为 poll_interval。
+    """
+
+    def __init__(self, interval: float, workers: int, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="poll")
+        self.active: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+
+    def watch(self, job: Job) -> None:
+        with self.lock:
+            self.active[job.job_id] = job
+
+    def _check(self, job: Job) -> None:
+        try:
+            result = check_status(job.job_id) or {}
+        except Exception as e:
+            now = time.monotonic()
+            if now - job.submit_start > self.timeout:
+                # 状态始终无法获取 (如 401/404) 时也要结束任务, 否则 job.done 永远不会被设置
+                self._finish(job, "STATUS_FAILED", now, error=f"status check failing after {self.timeout:.0f}s: {e}")
+            else:
+                log(f"#{job.index} status check failed: {e}")
+            return
+        now = time.monotonic()
+        status = result.get("status", "UNKNOWN")
+        if status == "IN_PROGRESS" and job.started_seen_at is None:
+            job.started_seen_at = now
+        if status not in TERMINAL_STATUSES:
+            if now - job.submit_start > self.timeout:
+                self._finish(job, "TIMEOUT", now, error=f"no terminal status after {self.timeout:.0f}s")
+            return
+        job.delay_ms = result.get("delayTime")
+        job.execution_ms = result.get("executionTime")
+        output = result.get("output")
+        if isinstance(output, dict):
+            job.output_timings = output.get("timings")
+            error = output.get("error")
+        else:
+            error = None
+        self._finish(job, status, now, error=result.get("error") or error)
+
+    def _finish(self, job: Job, status: str, now: float, error: Optional[str] = None) -> None:
+        job.status = status
+        job.error = str(error) if error else None
+        job.finished_seen_at = now
+        with self.lock:
+            self.active.pop(job.job_id, None)
+        log(f"#{job.index} {job.video}: {status} (e2e {job.e2e_seconds:.1f}s)" + (f" - {job.error}" if job.error else ""))
+        job.done.set()
+
+    def _loop(self) -> None:
+        while not self.stopped.is_set() or self.active:
+            round_start = time.monotonic()
+            with self.lock:
+                jobs = list(self.active.values())
+            if jobs:
+                list(self.pool.map(self._check, jobs))
+            self.stopped.wait(max(0.0, self.interval - (time.monotonic() - round_start)))
+
+
+class Benchmark:
+    """负载生成: 构建 (缓存) 请求、提交任务并交给 Poller 跟踪"""
+
+    def __init__(self, args):
+        self.args = args
+        self.videos = [v for v in (args.videos or VIDEOS) if (TEST_DIR / v).exists()]
+        if not self.videos:
+            raise SystemExit("错误: 没有可用的测试视频")
+        self.payloads: Dict[str, Dict] = {}
+        self.payload_lock = threading.Lock()
+        self.jobs: List[Job] = []
+        self.jobs_lock = threading.Lock()
+        self.poller = Poller(args.poll_interval, args.poll_workers, args.timeout)
+        self.start = 0.0
+        self.stop_at = None
+
+    def payload(self, video: str) -> Dict:
+        """每个视频只构建一次请求 (读取文件与 base64 编码不计入延迟)"""
+        with self.payload_lock:
+            if video not in self.payloads:
+                log(f"Building request for {video}")
+                self.payloads[video] = build_request(TEST_DIR / video, REF_IMAGE, self.args.prompt)
+            return self.payloads[video]
+
+    def _next_job(self) -> Optional[Job]:
+        with self.jobs_lock:
+            if self.args.jobs and len(self.jobs) >= self.args.jobs:
+                return None
+            if self.stop_at is not None and time.monotonic() >= self.stop_at:
+                return None
+            job = Job(len(self.jobs), self.videos[len(self.jobs) % len(self.videos)])
+            self.jobs.append(job)
+            return job
+
+    def submit(self, job: Job) -> None:
+        payload = self.payload(job.video)
+        job.submit_start = time.monotonic()
+        try:
+            job.job_id = submit_job(payload)
+            job.submitted_at = time.monotonic()
+        except Exception as e:
+            job.status, job.error = "SUBMIT_FAILED", str(e)
+            job.finished_seen_at = time.monotonic()
+            log(f"#{job.index} {job.video}: submit failed: {e}")
+            job.done.set()
+            return
+        if not job.job_id:
+            job.status, job.error = "SUBMIT_FAILED", "no job id in response"
+            job.finished_seen_at = time.monotonic()
+            job.done.set()
+            return
+        job.status = "IN_QUEUE"
+        log(f"#{job.index} {job.video}: submitted {job.job_id} in {job.submit_seconds:.2f}s")
+        self.poller.watch(job)
+
+    def run_closed(self) -> None:
+        """闭环: concurrency 个客户端，各自完成一个任务后再提交下一个"""
+        def client():
+            while True:
+                job = self._next_job()
+                if job is None:
+                    return
+                self.submit(job)
+                job.done.wait()
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(self.args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open(self) -> None:
+        """开环: 按到达率提交，不等待之前的任务"""
+        rng = random.Random(self.args.seed)
+        with ThreadPoolExecutor(max_workers=max(1, self.args.submit_workers), thread_name_prefix="submit") as pool:
+            next_at = time.monotonic()
+            while True:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                job = self._next_job()
+                if job is None:
+                    break
+                pool.submit(self.submit, job)
+                gap = rng.expovariate(self.args.rate) if self.args.arrival == "poisson" else 1 / self.args.rate
+                next_at += gap
+        for job in self.jobs:
+            job.done.wait()
+
+    def run(self) -> Dict:
+        # 先构建请求，避免第一个任务的提交时间包含编码耗时
+        for video in self.videos[: self.args.jobs or None]:
+            self.payload(video)
+        self.poller.start()
+        self.start = time.monotonic()
+        if self.args.duration:
+            self.stop_at = self.start + self.args.duration
+        started_at = datetime.now().isoformat(timespec="seconds")
+        try:
+            if self.args.mode == "closed":
+                self.run_closed()
+            else:
+                self.run_open()
+        finally:
+            self.poller.stop()
+        return self.report(started_at)
+
+    def report(self, started_at: str) -> Dict:
+        measured = [job for job in self.jobs if job.index >= self.args.warmup]
+        completed = [job for job in measured if job.status == "COMPLETED"]
+        statuses: Dict[str, int] = {}
+        for job in measured:
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+
+        first_submit = min((job.submit_start for job in measured if job.submit_start), default=self.start)
+        last_finish = max((job.finished_seen_at for job in measured if job.finished_seen_at), default=first_submit)
+        wall = max(last_finish - first_submit, 1e-9)
+
+        latencies = {
+            "queue": [job.delay_ms / 1000 for job in completed if job.delay_ms is not None],
+            "execution": [job.execution_ms / 1000 for job in completed if job.execution_ms is not None],
+            "e2e": [job.e2e_seconds for job in completed if job.e2e_seconds is not None],
+            "submit": [job.submit_seconds for job in measured if job.submit_seconds is not None],
+        }
+        args = self.args
+        return {
+            "label": args.label,
+            "endpoint_id": batch_test.RUNPOD_ENDPOINT_ID,
+            "started_at": started_at,
+            "config": {
+                "mode": args.mode,
+                "concurrency": args.concurrency if args.mode == "closed" else None,
+                "rate": args.rate if args.mode == "open" else None,
+                "arrival": args.arrival if args.mode == "open" else None,
+                "jobs": args.jobs,
+                "duration": args.duration,
+                "warmup": args.warmup,
+                "poll_interval": args.poll_interval,
+                "videos": self.videos,
+            },
+            "counts": {"total": len(measured), **statuses},
+            "wall_seconds": round(wall, 3),
+            "throughput": {
+                "completed_per_second": round(len(completed) / wall, 5),
+                "completed_per_hour": round(len(completed) / wall * 3600, 2),
+            },
+            "latency": {name: summarize(latencies[name]) for name in METRICS},
+            "notes": f"e2e is submit start to first poll that saw a terminal status (resolution {args.poll_interval}s); "
+                     "queue/execution are RunPod delayTime/executionTime",
+            "jobs": [job.record(self.start) for job in self.jobs],
+        }
+
+
+def print_report(report: Dict) -> None:
+    print("\n" + "=" * 60)
+    print(f"基准测试结果: {report['label']} ({report['config']['mode']})")
+    print("=" * 60)
+    print(f"任务: {report['counts']}")
+    print(f"耗时: {report['wall_seconds']:.1f}s, 吞吐量: {report['throughput']['completed_per_hour']:.2f} 任务/小时")
+    print(f"{'指标':<12}{'count':>7}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES) + f"{'mean':>10}")
+    for name in METRICS:
+        stats = report["latency"][name]
+        cells = "".join(
+            f"{stats[key]:>10.2f}" if stats.get(key) is not None else f"{'-':>10}"
+            for key in [f"p{p}" for p in PERCENTILES] + ["mean"]
+        )
+        print(f"{name:<12}{stats['count']:>7}{cells}")
+
+
+def compare(paths: List[str]) -> None:
+    """并排比较多个报告的 p50/p95/p99 与吞吐量"""
+    reports = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            reports.append(json.load(f))
+    width = max(14, *(len(r["label"]) + 2 for r in reports))
+    print(f"{'':<20}" + "".join(f"{r['label']:>{width}}" for r in reports))
+    for name in METRICS:
+        for p in PERCENTILES:
+            row = [r["latency"][name].get(f"p{p}") for r in reports]
+            print(f"{name + ' p' + str(p):<20}" + "".join(
+                f"{v:>{width}.2f}" if v is not None else f"{'-':>{width}}" for v in row
+            ))
+    print(f"{'jobs/hour':<20}" + "".join(f"{r['throughput']['completed_per_hour']:>{width}.2f}" for r in reports))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the RunPod endpoint")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed")
+    parser.add_argument("--concurrency", type=int, default=1, help="closed loop: concurrent clients")
+    parser.add_argument("--rate", type=float, default=0.05, help="open loop: arrival rate in jobs/second")
+    parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson", help="open loop inter-arrival times")
+    parser.add_argument("--jobs", type=int, default=0, help="number of jobs to submit (0 = until --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="stop submitting after this many seconds")
+    parser.add_argument("--warmup", type=int, default=0, help="first N jobs are run but excluded from statistics")
+    parser.add_argument("--videos", nargs="*", help="test videos to cycle through (default: batch_test.VIDEOS)")
+    parser.add_argument("--prompt", default="一个少女正在跳舞")
+    parser.add_argument("--poll-interval", type=float, default=2)
+    parser.add_argument("--poll-workers", type=int, default=16)
+    parser.add_argument("--submit-workers", type=int, default=8, help="open loop: concurrent submit requests")
+    parser.add_argument("--timeout", type=float, default=1800, help="give up on a job after this many seconds")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for poisson arrivals")
+    parser.add_argument("--label", default="", help="worker image version or other tag stored in the report")
+    parser.add_argument("--output", help="report path (default: benchmark_<label>_<time>.json next to this script)")
+    parser.add_argument("--compare", nargs="+", metavar="REPORT", help="compare existing reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+    if not batch_test.RUNPOD_API_KEY:
+        print("错误: 请设置 RUNPOD_API_KEY 环境变量")
+        sys.exit(1)
+    if not args.jobs and not args.duration:
+        parser.error("one of --jobs or --duration is required")
+    if args.mode == "open" and args.rate <= 0:
+        parser.error("--rate must be positive")
+    args.label = args.label or datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    report = Benchmark(args).run()
+    print_report(report)
+
+    output = Path(args.output) if args.output else TEST_DIR / f"benchmark_{args.label}_{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"报告已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
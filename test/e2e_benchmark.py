@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+端到端 handler 基准测试 (不需要 GPU)
+
+在进程内启动 ComfyUI 替身 (fake_comfyui.py) 与 OSS 替身 (fake_oss.py)，加载经
+modify_handler.py 修改后的 handler.py，并用 test/ 中的真实视频与参考图构建请求
+(batch_test.build_request)，逐个调用 handler(job)。测得的是 handler 自身的开销:
+输入解码与暂存、排队、websocket 等待、history 查询、输出读取 (/view) 与 OSS 上传。
+
+每个任务的 overhead = 端到端耗时 - 替身服务器上的"执行"时间 (节点数 x --node-delay)。
+
+需要 handler 的运行依赖 (runpod、websocket-client、requests、alibabacloud-oss-v2)
+以及 ffprobe，最简单的方式是在 worker 镜像中运行:
+   docker run --rm -v $PWD/test:/test <image> python3 /test/e2e_benchmark.py --jobs 10
+
+使用方法:
+   python3 e2e_benchmark.py --handler /handler.py --jobs 10 --label v1.5
+   python3 e2e_benchmark.py --inputs url --output-bytes 67108864 --oss-bandwidth 100
+"""
+
+import argparse
+import contextlib
+import copy
+import functools
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List
+
+from batch_test import REF_IMAGE, TEST_DIR, VIDEOS, build_request
+from benchmark import summarize
+from fake_comfyui import FakeComfyUI
+from fake_oss import FakeOSS
+
+
+def serve_test_dir() -> ThreadingHTTPServer:
+    """在后台线程中用 HTTP 提供 test/ 目录 (URL 输入模式)"""
+
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(TEST_DIR)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="test-files").start()
+    return server
+
+
+def configure_environment(args, comfy: FakeComfyUI, oss_server: FakeOSS, work_dir: str) -> None:
+    """在导入 handler 之前设置环境变量 (handler 在导入时读取配置)"""
+    os.environ.update({
+        "OSS_ENDPOINT": oss_server.endpoint,
+        "OSS_BUCKET_NAME": "bench",
+        "OSS_REGION": "cn-shanghai",
+        "OSS_ACCESS_KEY_ID": "bench",
+        "OSS_ACCESS_KEY_SECRET": "bench",
+        "OSS_MULTIPART_CHECKPOINT_DIR": os.path.join(work_dir, "oss-checkpoints"),
+        # 走 HTTP 接口，测量 /upload/image 与 /view 的完整路径
+        "INPUT_PLACEMENT": "http",
+        "OUTPUT_READ_MODE": "http",
+        "INPUT_NORMALIZE": "false",
+        "INPUT_CACHE_DIR": os.path.join(work_dir, "input-cache"),
+        "INPUT_CACHE_MAX_BYTES": "0" if not args.input_cache else os.environ.get("INPUT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)),
+        "WARMUP_ON_BOOT": "false",
+        "KERNEL_CACHE_PUBLISH": "false",
+    })
+
+
+def load_handler(path: str):
+    """按路径导入 handler.py"""
+    spec = importlib.util.spec_from_file_location("handler", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["handler"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_payloads(args, file_server) -> List[Dict]:
+    """为每个测试视频构建一次请求；URL 模式下把 base64 数据替换为本地 URL"""
+    payloads = []
+    for video in args.videos or VIDEOS:
+        path = TEST_DIR / video
+        if not path.exists():
+            continue
+        payload = build_request(path, REF_IMAGE, args.prompt)
+        if file_server is not None:
+            base = f"http://127.0.0.1:{file_server.server_address[1]}"
+            payload["input"]["videos"] = [{"name": "motion_video.mp4", "url": f"{base}/{video}"}]
+            payload["input"]["images"] = [{"name": "ref_image.png", "url": f"{base}/{REF_IMAGE.name}"}]
+        payloads.append({"video": video, "bytes": len(json.dumps(payload)), "payload": payload})
+    if not payloads:
+        raise SystemExit("错误: 没有可用的测试视频")
+    return payloads
+
+
+def run_job(handler, index: int, entry: Dict, comfy: FakeComfyUI, oss_server: FakeOSS, log_file) -> Dict:
+    """调用一次 handler，返回该任务的记录"""
+    execute_before = comfy.stats.snapshot().get("execute", {}).get("seconds", 0.0)
+    oss_before = oss_server.snapshot()
+    job = {"id": f"bench-{index}", "input": copy.deepcopy(entry["payload"]["input"])}
+
+    start = time.monotonic()
+    with contextlib.redirect_stdout(log_file):
+        result = handler.handler(job)
+    e2e = time.monotonic() - start
+
+    execute = comfy.stats.snapshot().get("execute", {}).get("seconds", 0.0) - execute_before
+    oss_after = oss_server.snapshot()
+    errors = [result["error"]] if result.get("error") else []
+    errors += result.get("errors") or []
+    record = {
+        "index": index,
+        "video": entry["video"],
+        "payload_bytes": entry["bytes"],
+        "e2e_seconds": round(e2e, 3),
+        "execute_seconds": round(execute, 3),
+        "overhead_seconds": round(e2e - execute, 3),
+        "outputs": len(result.get("images") or []),
+        "oss_bytes": oss_after["bytes"] - oss_before["bytes"],
+        "errors": errors,
+    }
+    if result.get("timings"):
+        record["timings"] = result["timings"]
+    status = "FAILED" if errors else "OK"
+    print(f"#{index} {entry['video']}: {status} e2e {e2e:.2f}s, overhead {e2e - execute:.2f}s, {record['outputs']} output(s)")
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU-free end-to-end benchmark of the patched handler")
+    parser.add_argument("--handler", default="/handler.py", help="patched handler.py to benchmark")
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1, help="first N jobs are excluded from statistics")
+    parser.add_argument("--videos", nargs="*", help="test videos to cycle through (default: batch_test.VIDEOS)")
+    parser.add_argument("--prompt", default="一个少女正在跳舞")
+    parser.add_argument("--inputs", choices=("base64", "url"), default="base64", help="how inputs are sent")
+    parser.add_argument("--input-cache", action="store_true", help="keep the handler's input cache enabled")
+    parser.add_argument("--node-delay", type=float, default=0.02, help="fake ComfyUI seconds per node")
+    parser.add_argument("--view-delay", type=float, default=0)
+    parser.add_argument("--upload-delay", type=float, default=0)
+    parser.add_argument("--output-bytes", type=int, default=0, help="size of each fake output (default: a test video)")
+    parser.add_argument("--oss-latency", type=float, default=0, help="fake OSS seconds per request")
+    parser.add_argument("--oss-bandwidth", type=float, default=0, help="fake OSS MB/s per connection (0 = unlimited)")
+    parser.add_argument("--label", default="", help="tag stored in the report")
+    parser.add_argument("--output", help="report path (default: e2e_benchmark_<label>.json next to this script)")
+    args = parser.parse_args()
+
+    label = args.label or datetime.now().strftime("%Y%m%d-%H%M%S")
+    work_dir = tempfile.mkdtemp(prefix="e2e-bench-")
+    comfy = FakeComfyUI(node_delay=args.node_delay, view_delay=args.view_delay, upload_delay=args.upload_delay,
+                        output_bytes=args.output_bytes, work_dir=os.path.join(work_dir, "comfyui")).start()
+    oss_server = FakeOSS(latency=args.oss_latency, bandwidth=args.oss_bandwidth).start()
+    file_server = serve_test_dir() if args.inputs == "url" else None
+    configure_environment(args, comfy, oss_server, work_dir)
+    handler = load_handler(args.handler)
+    # handler.py 中的 COMFY_HOST 是常量 (127.0.0.1:8188)，改为指向替身
+    handler.COMFY_HOST = comfy.address
+
+    payloads = build_payloads(args, file_server)
+    log_path = os.path.join(work_dir, "handler.log")
+    print(f"Benchmarking {args.handler} with {args.jobs} job(s); handler log: {log_path}")
+
+    records = []
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        for index in range(args.jobs):
+            records.append(run_job(handler, index, payloads[index % len(payloads)], comfy, oss_server, log_file))
+
+    measured = [r for r in records if r["index"] >= args.warmup and not r["errors"]]
+    report = {
+        "label": label,
+        "handler": args.handler,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "label")},
+        "counts": {"total": len(records), "measured": len(measured), "failed": sum(1 for r in records if r["errors"])},
+        "latency": {
+            "e2e": summarize([r["e2e_seconds"] for r in measured]),
+            "execute": summarize([r["execute_seconds"] for r in measured]),
+            "overhead": summarize([r["overhead_seconds"] for r in measured]),
+        },
+        "comfyui_endpoints": comfy.stats.snapshot(),
+        "oss": oss_server.snapshot(),
+        "jobs": records,
+    }
+
+    comfy.stop()
+    oss_server.stop()
+    if file_server is not None:
+        file_server.shutdown()
+
+    print("\n" + "=" * 60)
+    print(f"{'':<10}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}")
+    for name, stats in report["latency"].items():
+        cells = "".join(f"{stats.get(k, 0):>10.3f}" for k in ("p50", "p95", "p99", "mean")) if stats["count"] else ""
+        print(f"{name:<10}{stats['count']:>7}{cells}")
+    for endpoint, stats in sorted(report["comfyui_endpoints"].items()):
+        print(f"  comfyui {endpoint:<14} {stats['requests']:>5} req {stats['bytes'] / 1024 ** 2:>9.1f} MB {stats['seconds']:>8.2f}s")
+    print(f"  oss {report['oss']['requests']} req, {report['oss']['bytes'] / 1024 ** 2:.1f} MB, {report['oss']['objects']} object(s)")
+
+    output = Path(args.output) if args.output else TEST_DIR / f"e2e_benchmark_{label}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"报告已保存: {output}")
+    if report["counts"]["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
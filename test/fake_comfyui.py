@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+不需要 GPU 的 ComfyUI 替身服务器，用于测量 handler 自身的开销
+
+实现 handler 用到的接口: GET /、/object_info、POST /upload/image、/prompt、
+GET /history/{prompt_id}、/view 以及 /ws (websocket)。prompt 按提交顺序逐个"执行":
+依次发送 execution_start / executing / executed / execution_success 事件，每个节点
+等待 --node-delay 秒，输出节点产生固定的输出文件 (--output-file 或 --output-bytes
+大小的随机数据)。各接口可配置额外延迟以模拟真实服务器。
+
+使用方法:
+   python3 fake_comfyui.py --port 8188 --node-delay 0.05
+   python3 fake_comfyui.py --port 8188 --output-bytes 67108864 --view-delay 0.2
+
+也可在其他脚本中使用 FakeComfyUI(...).start() 在后台线程中启动。
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import queue
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+TEST_DIR = Path(__file__).parent
+DEFAULT_OUTPUT_FILE = TEST_DIR / "605b8464ed87d867f0573ed0998e46dc_raw.mp4"
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+CHUNK = 1024 * 1024
+
+# 输出节点类型 -> (history 中的键, 文件扩展名)
+OUTPUT_NODES = {
+    "VHS_VideoCombine": ("gifs", ".mp4"),
+    "SaveVideo": ("images", ".mp4"),
+    "SaveAnimatedWEBP": ("images", ".webp"),
+    "SaveImage": ("images", ".png"),
+    "PreviewImage": ("images", ".png"),
+}
+
+
+class Stats:
+    """每个接口的请求数、字节数与服务端耗时"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints: Dict[str, Dict] = {}
+
+    def add(self, endpoint: str, seconds: float, nbytes: int = 0) -> None:
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {"requests": 0, "bytes": 0, "seconds": 0.0})
+            entry["requests"] += 1
+            entry["bytes"] += nbytes
+            entry["seconds"] += seconds
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {name: dict(entry, seconds=round(entry["seconds"], 3)) for name, entry in self.endpoints.items()}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.endpoints.clear()
+
+
+class WebSocketClient:
+    """一个已完成握手的 websocket 连接 (只发送文本帧)"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message: Dict) -> None:
+        payload = json.dumps(message).encode("utf-8")
+        if len(payload) < 126:
+            header = struct.pack("!BB", 0x81, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack("!BBH", 0x81, 126, len(payload))
+        else:
+            header = struct.pack("!BBQ", 0x81, 127, len(payload))
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(header + payload)
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+
+
+class FakeComfyUI:
+    """
+    ComfyUI 替身
+
+    Args:
+        host / port: 监听地址 (port 为 0 时自动选择)
+        node_delay: 每个节点的执行时间 (秒)
+        upload_delay / prompt_delay / history_delay / view_delay: 对应接口的额外延迟 (秒)
+        output_file: 输出节点产生的文件内容来源
+        output_bytes: 大于 0 时改为产生该大小的随机数据
+        work_dir: 保存上传输入与输出文件的目录 (默认临时目录)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, node_delay: float = 0.02,
+                 upload_delay: float = 0, prompt_delay: float = 0, history_delay: float = 0,
+                 view_delay: float = 0, output_file: Optional[str] = None, output_bytes: int = 0,
+                 work_dir: Optional[str] = None):
+        self.node_delay = node_delay
+        self.upload_delay = upload_delay
+        self.prompt_delay = prompt_delay
+        self.history_delay = history_delay
+        self.view_delay = view_delay
+        self.work_dir = Path(work_dir or tempfile.mkdtemp(prefix="fake-comfyui-"))
+        self.input_dir = self.work_dir / "input"
+        self.output_dir = self.work_dir / "output"
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.output_source = self._prepare_output(output_file, output_bytes)
+
+        self.stats = Stats()
+        self.history: Dict[str, Dict] = {}
+        self.clients: Dict[str, WebSocketClient] = {}
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.queue: "queue.Queue" = queue.Queue()
+
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+
+    @property
+    def address(self) -> str:
+        """COMFY_HOST 格式的地址 (host:port)"""
+        return f"{self.host}:{self.port}"
+
+    def _prepare_output(self, output_file: Optional[str], output_bytes: int) -> Path:
+        if output_bytes > 0:
+            path = self.work_dir / "canned_output.bin"
+            with open(path, "wb") as f:
+                left = output_bytes
+                while left > 0:
+                    n = min(CHUNK, left)
+                    f.write(os.urandom(n))
+                    left -= n
+            return path
+        return Path(output_file or DEFAULT_OUTPUT_FILE)
+
+    def start(self) -> "FakeComfyUI":
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="fake-comfyui").start()
+        threading.Thread(target=self._execute_loop, daemon=True, name="fake-comfyui-exec").start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.queue.put(None)
+
+    # ------------------------------------------------------------------ 执行
+
+    def _send(self, client_id: str, message_type: str, data: Dict) -> None:
+        client = self.clients.get(client_id)
+        if client is not None:
+            client.send({"type": message_type, "data": data})
+
+    def _write_output(self, class_type: str, node: Dict) -> Dict:
+        key, ext = OUTPUT_NODES[class_type]
+        with self.lock:
+            self.counter += 1
+            counter = self.counter
+        prefix = str(node.get("inputs", {}).get("filename_prefix") or "ComfyUI")
+        subfolder, _, base = prefix.rpartition("/")
+        if ext == ".mp4" and self.output_source.suffix not in (".bin", ".mp4"):
+            ext = self.output_source.suffix
+        filename = f"{base}_{counter:05d}_{ext}"
+        # VHS_VideoCombine 的 save_output=false 与 PreviewImage 写入 temp
+        temp = class_type == "PreviewImage" or node.get("inputs", {}).get("save_output") is False
+        target_dir = self.output_dir / subfolder
+        target_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.output_source, target_dir / filename)
+        file_info = {"filename": filename, "subfolder": subfolder, "type": "temp" if temp else "output"}
+        if key == "gifs":
+            file_info["format"] = node.get("inputs", {}).get("format", "video/h264-mp4")
+        output = {key: [file_info]}
+        if class_type == "SaveVideo":
+            output["animated"] = [True]
+        return output
+
+    def _execute(self, prompt_id: str, prompt: Dict, client_id: str) -> None:
+        started = time.monotonic()
+        self._send(client_id, "execution_start", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+        self._send(client_id, "execution_cached", {"nodes": [], "prompt_id": prompt_id})
+        outputs = {}
+        for node_id, node in prompt.items():
+            self._send(client_id, "executing", {"node": node_id, "display_node": node_id, "prompt_id": prompt_id})
+            if self.node_delay:
+                time.sleep(self.node_delay)
+            class_type = node.get("class_type", "")
+            if class_type in OUTPUT_NODES:
+                outputs[node_id] = self._write_output(class_type, node)
+                self._send(client_id, "executed", {"node": node_id, "display_node": node_id,
+                                                   "output": outputs[node_id], "prompt_id": prompt_id})
+        with self.lock:
+            self.history[prompt_id] = {
+                "prompt": [0, prompt_id, prompt, {}, list(outputs)],
+                "outputs": outputs,
+                "status": {"status_str": "success", "completed": True, "messages": []},
+            }
+        self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+        self._send(client_id, "execution_success", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)})
+        self.stats.add("execute", time.monotonic() - started)
+
+    def _execute_loop(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self._execute(*item)
+            remaining = self.queue.qsize()
+            for client in list(self.clients.values()):
+                client.send({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": remaining}}}})
+
+    # ------------------------------------------------------------------ HTTP
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, body: bytes = b"", content_type: str = "application/json") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, data, status: int = 200) -> None:
+                self._reply(status, json.dumps(data).encode("utf-8"))
+
+            def _read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = io.BytesIO()
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                        if size == 0:
+                            while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                                pass
+                            return body.getvalue()
+                        body.write(self.rfile.read(size))
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_GET(self):
+                start = time.monotonic()
+                url = urlparse(self.path)
+                if url.path == "/ws":
+                    return self._websocket(parse_qs(url.query).get("clientId", [""])[0])
+                if url.path == "/":
+                    self._reply(200, b"<html>fake ComfyUI</html>", "text/html")
+                elif url.path == "/object_info":
+                    # 只提供 handler 用到的 output_node 标记
+                    self._json({class_type: {"output_node": True} for class_type in OUTPUT_NODES})
+                elif url.path.startswith("/history/"):
+                    time.sleep(fake.history_delay)
+                    prompt_id = url.path.rsplit("/", 1)[1]
+                    with fake.lock:
+                        entry = fake.history.get(prompt_id)
+                    self._json({prompt_id: entry} if entry else {})
+                elif url.path == "/view":
+                    return self._view(parse_qs(url.query), start)
+                else:
+                    self._reply(404, b"{}")
+                fake.stats.add(url.path.split("/")[1] or "/", time.monotonic() - start)
+
+            def _view(self, query, start):
+                time.sleep(fake.view_delay)
+                folder = fake.output_dir if query.get("type", ["output"])[0] != "input" else fake.input_dir
+                base = folder.resolve()
+                path = (folder / query.get("subfolder", [""])[0] / query.get("filename", [""])[0]).resolve()
+                if base not in path.parents or not path.is_file():
+                    self._reply(404, b"{}")
+                    return
+                size = path.stat().st_size
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile, CHUNK)
+                fake.stats.add("view", time.monotonic() - start, size)
+
+            def do_POST(self):
+                start = time.monotonic()
+                path = urlparse(self.path).path
+                body = self._read_body()
+                if path == "/upload/image":
+                    time.sleep(fake.upload_delay)
+                    self._upload(body)
+                elif path == "/prompt":
+                    time.sleep(fake.prompt_delay)
+                    request = json.loads(body or b"{}")
+                    prompt_id = str(uuid.uuid4())
+                    fake.queue.put((prompt_id, request.get("prompt", {}), request.get("client_id", "")))
+                    self._json({"prompt_id": prompt_id, "number": fake.queue.qsize(), "node_errors": {}})
+                else:
+                    self._reply(404, b"{}")
+                fake.stats.add(path.strip("/"), time.monotonic() - start, len(body))
+
+            def _upload(self, body: bytes) -> None:
+                header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode()
+                message = BytesParser(policy=policy.HTTP).parsebytes(header + body)
+                fields, image = {}, None
+                for part in message.iter_parts() if message.is_multipart() else []:
+                    name = part.get_param("name", header="content-disposition")
+                    if name == "image" and part.get_filename():
+                        image = part
+                    elif name:
+                        fields[name] = part.get_payload(decode=True).decode("utf-8", "replace")
+                if image is None:
+                    self._reply(400, b"{}")
+                    return
+                subfolder = fields.get("subfolder", "")
+                target = fake.input_dir / subfolder
+                target.mkdir(parents=True, exist_ok=True)
+                name = os.path.basename(image.get_filename())
+                with open(target / name, "wb") as f:
+                    f.write(image.get_payload(decode=True))
+                self._json({"name": name, "subfolder": subfolder, "type": "input"})
+
+            def _websocket(self, client_id: str) -> None:
+                key = self.headers.get("Sec-WebSocket-Key", "")
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+                self.send_response(101, "Switching Protocols")
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+                client = WebSocketClient(self.wfile)
+                fake.clients[client_id] = client
+                client.send({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": fake.queue.qsize()}}, "sid": client_id}})
+                try:
+                    self._read_frames(client)
+                finally:
+                    client.closed = True
+                    if fake.clients.get(client_id) is client:
+                        del fake.clients[client_id]
+                    self.close_connection = True
+
+            def _read_frames(self, client: WebSocketClient) -> None:
+                """读取客户端帧，只处理 close 与 ping"""
+                while True:
+                    try:
+                        head = self.rfile.read(2)
+                    except (OSError, socket.timeout):
+                        return
+                    if len(head) < 2:
+                        return
+                    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                    if length == 126:
+                        length = struct.unpack("!H", self.rfile.read(2))[0]
+                    elif length == 127:
+                        length = struct.unpack("!Q", self.rfile.read(8))[0]
+                    mask = self.rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+                    if opcode == 0x8:
+                        with client.lock:
+                            try:
+                                self.wfile.write(b"\x88\x00")
+                                self.wfile.flush()
+                            except OSError:
+                                pass
+                        return
+                    if opcode == 0x9:
+                        with client.lock:
+                            self.wfile.write(struct.pack("!BB", 0x8A, len(payload)) + payload)
+                            self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU-free stand-in for the ComfyUI HTTP/websocket API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--node-delay", type=float, default=0.02, help="seconds each node 'executes'")
+    parser.add_argument("--upload-delay", type=float, default=0)
+    parser.add_argument("--prompt-delay", type=float, default=0)
+    parser.add_argument("--history-delay", type=float, default=0)
+    parser.add_argument("--view-delay", type=float, default=0)
+    parser.add_argument("--output-file", default=str(DEFAULT_OUTPUT_FILE), help="file returned for every output node")
+    parser.add_argument("--output-bytes", type=int, default=0, help="return random data of this size instead")
+    parser.add_argument("--work-dir", help="directory for uploaded inputs and outputs (default: temp dir)")
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(
+        args.host, args.port, node_delay=args.node_delay, upload_delay=args.upload_delay,
+        prompt_delay=args.prompt_delay, history_delay=args.history_delay, view_delay=args.view_delay,
+        output_file=args.output_file, output_bytes=args.output_bytes, work_dir=args.work_dir,
+    ).start()
+    print(f"fake-comfyui - Listening on {fake.address}, files in {fake.work_dir}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"fake-comfyui - {json.dumps(fake.stats.snapshot())}")
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+本地 OSS 替身服务器 (path-style)，用于在没有真实 bucket 时测量输出上传开销
+
+支持 handler 用到的操作: PutObject、InitiateMultipartUpload、UploadPart、
+CompleteMultipartUpload、ListParts、AbortMultipartUpload 以及 GetBucketAcl
+(is_bucket_exist 健康检查)。不校验签名，对象只记录大小与 MD5 (或用 --store-dir 落盘)。
+
+OSS_ENDPOINT 为 IP 地址时 alibabacloud_oss_v2 使用 path-style 请求 (/bucket/key)，
+所以 handler 只需设置:
+   OSS_ENDPOINT=http://127.0.0.1:9000 OSS_BUCKET_NAME=bench OSS_REGION=cn-shanghai
+   OSS_ACCESS_KEY_ID=x OSS_ACCESS_KEY_SECRET=x
+
+使用方法:
+   python3 fake_oss.py --port 9000 --bandwidth 50 --latency 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+CHUNK = 1024 * 1024
+
+
+class FakeOSS:
+    """
+    OSS 替身
+
+    Args:
+        host / port: 监听地址 (port 为 0 时自动选择)
+        latency: 每个请求的额外延迟 (秒)
+        bandwidth: 每个连接的上传带宽上限 (MB/s, 0 不限)
+        store_dir: 保存对象内容的目录，None 时只记录元数据
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0,
+                 bandwidth: float = 0, store_dir: Optional[str] = None):
+        self.latency = latency
+        self.bandwidth = bandwidth * 1024 * 1024
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        self.objects: Dict[str, Dict] = {}
+        self.uploads: Dict[str, Dict] = {}
+        self.stats = {"requests": 0, "bytes": 0, "put_object": 0, "upload_part": 0, "complete": 0, "seconds": 0.0}
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+
+    @property
+    def endpoint(self) -> str:
+        """OSS_ENDPOINT 格式的地址"""
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeOSS":
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="fake-oss").start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return dict(self.stats, seconds=round(self.stats["seconds"], 3), objects=len(self.objects))
+
+    def _count(self, key: str, nbytes: int, seconds: float) -> None:
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += nbytes
+            self.stats["seconds"] += seconds
+            if key:
+                self.stats[key] += 1
+
+    def _store(self, bucket: str, key: str, data: bytes, etag: str) -> None:
+        with self.lock:
+            self.objects[f"{bucket}/{key}"] = {"size": len(data), "etag": etag}
+        if self.store_dir:
+            path = os.path.join(self.store_dir, bucket, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, body: str = "", headers: Optional[Dict[str, str]] = None) -> None:
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("x-oss-request-id", uuid.uuid4().hex[:24].upper())
+                if data:
+                    self.send_header("Content-Type", "application/xml")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if data and self.command != "HEAD":
+                    self.wfile.write(data)
+
+            def _error(self, status: int, code: str, message: str) -> None:
+                self._reply(status, f'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>{code}</Code>'
+                                    f'<Message>{escape(message)}</Message></Error>')
+
+            def _read_body(self) -> bytes:
+                """读取请求体，按 bandwidth 限速"""
+                length = int(self.headers.get("Content-Length", 0))
+                parts, start = [], time.monotonic()
+                while length > 0:
+                    chunk = self.rfile.read(min(CHUNK, length))
+                    if not chunk:
+                        break
+                    parts.append(chunk)
+                    length -= len(chunk)
+                    if fake.bandwidth:
+                        done = sum(len(p) for p in parts)
+                        ahead = done / fake.bandwidth - (time.monotonic() - start)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                return b"".join(parts)
+
+            def _target(self):
+                url = urlparse(self.path)
+                bucket, _, key = url.path.lstrip("/").partition("/")
+                return bucket, unquote(key), {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+
+            def _handle(self):
+                start = time.monotonic()
+                if fake.latency:
+                    time.sleep(fake.latency)
+                bucket, key, query = self._target()
+                body = self._read_body() if self.command in ("PUT", "POST") else b""
+                counter = None
+
+                if not key and "acl" in query:
+                    self._reply(200, '<?xml version="1.0" encoding="UTF-8"?>\n<AccessControlPolicy><Owner><ID>0</ID>'
+                                     '<DisplayName>0</DisplayName></Owner><AccessControlList><Grant>private</Grant>'
+                                     '</AccessControlList></AccessControlPolicy>')
+                elif self.command == "PUT" and "partNumber" in query:
+                    upload = fake.uploads.get(query.get("uploadId", ""))
+                    if upload is None:
+                        self._error(404, "NoSuchUpload", "The specified upload does not exist.")
+                    else:
+                        etag = f'"{hashlib.md5(body).hexdigest().upper()}"'
+                        with fake.lock:
+                            upload["parts"][int(query["partNumber"])] = (etag, body if fake.store_dir else len(body))
+                        counter = "upload_part"
+                        self._reply(200, headers={"ETag": etag})
+                elif self.command == "PUT":
+                    etag = f'"{hashlib.md5(body).hexdigest().upper()}"'
+                    fake._store(bucket, key, body, etag)
+                    counter = "put_object"
+                    self._reply(200, headers={"ETag": etag})
+                elif self.command == "POST" and "uploads" in query:
+                    upload_id = uuid.uuid4().hex.upper()
+                    with fake.lock:
+                        fake.uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}}
+                    self._reply(200, f'<?xml version="1.0" encoding="UTF-8"?>\n<InitiateMultipartUploadResult>'
+                                     f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+                                     f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+                elif self.command == "POST" and "uploadId" in query:
+                    with fake.lock:
+                        upload = fake.uploads.pop(query["uploadId"], None)
+                    if upload is None:
+                        self._error(404, "NoSuchUpload", "The specified upload does not exist.")
+                    else:
+                        parts = [upload["parts"][n] for n in sorted(upload["parts"])]
+                        etag = f'"{hashlib.md5("".join(p[0] for p in parts).encode()).hexdigest().upper()}-{len(parts)}"'
+                        if fake.store_dir:
+                            fake._store(bucket, key, b"".join(p[1] for p in parts), etag)
+                        else:
+                            with fake.lock:
+                                fake.objects[f"{bucket}/{key}"] = {"size": sum(p[1] for p in parts), "etag": etag}
+                        counter = "complete"
+                        self._reply(200, f'<?xml version="1.0" encoding="UTF-8"?>\n<CompleteMultipartUploadResult>'
+                                         f'<Location>{fake.endpoint}/{escape(bucket)}/{escape(key)}</Location>'
+                                         f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+                                         f'<ETag>{escape(etag)}</ETag></CompleteMultipartUploadResult>')
+                elif self.command == "GET" and "uploadId" in query:
+                    upload = fake.uploads.get(query["uploadId"])
+                    if upload is None:
+                        self._error(404, "NoSuchUpload", "The specified upload does not exist.")
+                    else:
+                        parts = "".join(
+                            f"<Part><PartNumber>{n}</PartNumber><ETag>{escape(etag)}</ETag>"
+                            f"<Size>{len(data) if isinstance(data, bytes) else data}</Size></Part>"
+                            for n, (etag, data) in sorted(upload["parts"].items())
+                        )
+                        self._reply(200, f'<?xml version="1.0" encoding="UTF-8"?>\n<ListPartsResult>'
+                                         f'<Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+                                         f'<UploadId>{query["uploadId"]}</UploadId><IsTruncated>false</IsTruncated>'
+                                         f'{parts}</ListPartsResult>')
+                elif self.command == "DELETE" and "uploadId" in query:
+                    with fake.lock:
+                        fake.uploads.pop(query["uploadId"], None)
+                    self._reply(204)
+                elif self.command in ("HEAD", "GET") and f"{bucket}/{key}" in fake.objects:
+                    obj = fake.objects[f"{bucket}/{key}"]
+                    self._reply(200, headers={"ETag": obj["etag"], "x-oss-object-size": str(obj["size"])})
+                else:
+                    self._error(404, "NoSuchKey", "The specified key does not exist.")
+                fake._count(counter, len(body), time.monotonic() - start)
+
+            do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _handle
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for OSS PutObject and multipart upload")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0, help="extra seconds per request")
+    parser.add_argument("--bandwidth", type=float, default=0, help="per-connection upload limit in MB/s (0 = unlimited)")
+    parser.add_argument("--store-dir", help="write object contents here (default: keep sizes only)")
+    args = parser.parse_args()
+
+    fake = FakeOSS(args.host, args.port, args.latency, args.bandwidth, args.store_dir).start()
+    print(f"fake-oss - Listening on {fake.endpoint}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"fake-oss - {json.dumps(fake.snapshot())}")
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()